@@ -57,6 +57,9 @@ def main():
     # Instantiate a cheStandard object
     cheStandard = cohqt.cheStandard(projectGDB, scriptPath)
 
+    # Check the Data Package against its manifest
+    cheStandard.checkDataPackage()
+
     # ENVIRONMENT SETTINGS
     # Set workspaces
     arcpy.env.workspace = projectGDB
@@ -66,6 +69,7 @@ def main():
 
     # DEFINE GLOBAL VARIABLES
     parameter_values = cheStandard.ParameterValues
+    parameter_table = cheStandard.ParameterTable
     coordinate_system = cheStandard.CoorSystem
     habitat_bounds = cheStandard.HabitatMgmtArea
     # File names for feature classes and rasters created by this script
@@ -259,8 +263,7 @@ def main():
         util.AddSubtypeDomains(featureList, projectGDB, parameter_values)
         
         # Create Domain for Type attributes and assign to Type field
-        typeList = [row[0] for row in arcpy.da.SearchCursor(
-                    parameter_values, "Type")]
+        typeList = list(parameter_table.column("Type"))
         util.AddCodedTextDomain(featureList, projectGDB, "Type", typeList)
 
         # Add layer to map for editing
@@ -32,13 +32,16 @@ import arcpy
 import sys
 import os
 import gc
+import rasterlib
 import hqtlib
 import util
 import cohqt
 from arcpy.sa import Con
+from collections import OrderedDict
 
 if arcpy.ListInstallations()[0] == 'arcgispro':  # switch
     import importlib
+    importlib.reload(rasterlib)
     importlib.reload(hqtlib) #ensures up-to-date hqtlib runs on arcpro
     importlib.reload(util)
     importlib.reload(cohqt)
@@ -71,6 +74,9 @@ def main():
     # Instantiate a cheStandard object
     cheStandard = cohqt.cheStandard(projectGDB, scriptPath)
 
+    # Check the Data Package against its manifest
+    cheStandard.checkDataPackage()
+
     # ENVIRONMENT SETTINGS
     # Set workspaces
     arcpy.env.workspace = projectGDB
@@ -86,7 +92,7 @@ def main():
     arcpy.env.overwriteOutput = True
 
     # DEFINE GLOBAL VARIABLES
-    Parameter_Values = cheStandard.ParameterValues
+    Parameter_Values = cheStandard.ParameterTable
     ConiferModifier = cheStandard.ConiferModifier
     GrSG_LDI = cheStandard.GrSG_LDI
     LekPresenceRaster = cheStandard.LekPresenceRaster
@@ -101,8 +107,7 @@ def main():
     BWMD_Open = cheStandard.BWMD_Open
     GrSG_Range = cheStandard.GrSGHabitat
     Mule_Range = cheStandard.MuleDeerHabitat
-    cellSize = arcpy.GetRasterProperties_management(
-        emptyRaster, "CELLSIZEX").getOutput(0)
+    cellSize = cheStandard.CellSize
 
     # Filenames for feature classes or rasters used by this script
     MAP_UNITS = "Map_Units"
@@ -213,7 +218,8 @@ def main():
         in_data = Proposed_Modified_Features
         out_name = INDIRECT_IMPACT_AREA
         Indirect_Impact_Area = hqtlib.CreateIndirectImpactArea(
-            in_data, Parameter_Values, out_name
+            in_data, Parameter_Values, out_name,
+            cheStandard.DistanceAreaCellSize, emptyRaster
             )
 
         # Add field "Indirect"
@@ -289,7 +295,9 @@ def main():
     out_name = ANALYSIS_AREA
     Analysis_Area = hqtlib.CreateAnalysisArea(Credit_Project_Area,
                                               Parameter_Values,
-                                              out_name)
+                                              out_name,
+                                              cheStandard.DistanceAreaCellSize,
+                                              emptyRaster)
 
     # Add Analysis_Area to map
     layerFile = cheStandard.getLayerFile("AnalysisArea.lyr")
@@ -297,39 +305,33 @@ def main():
 
     # Set processing extent to Analysis_Area
     arcpy.env.extent = ANALYSIS_AREA
+    cheStandard.setAnalysisArea(ANALYSIS_AREA, cellSize)
 
     ### GREATER SAGE-GROUSE ANTHRO DIST & MODIFIERS ###
     if is_grsg:
+        # Start loading the habitat modifiers while map units are summarized
+        # and anthropogenic disturbance is calculated
+        cheStandard.prefetchAnalysisArrays(
+            [GrSG_Habitat, LekPresenceRaster],
+            static=["GrSG_" + season for season in cheStandard.GrSGSeasons]
+            )
 
-        # Update message
-        arcpy.AddMessage("Calculating proportion of each map unit within 1 km "
-                         "of a lek")
-
-        # Calculate proportion of map unit within 1 km of a lek
-        inZoneData = Map_Units_Dissolve
-        inValueRaster = cheStandard.LekPresenceRaster
-        zoneField = "Map_Unit_ID"
-        outTable = "Proportion_Lek"
-        hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-        # Join the zonal statistic to the Map Units Dissolve table
-        field_name = "PropLek"
-        hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, field_name)
 
         # Update message
-        arcpy.AddMessage("Calculating proportion of each map unit in the mesic "
-                         "precip zone")
+        arcpy.AddMessage("Calculating proportion of each map unit within 1 km "
+                         "of a lek and in the mesic precip zone")
 
-        # Calculate Proportion of each map unit in the mesic precip zone
+        # Calculate proportion of map unit within 1 km of a lek and in the
+        # mesic precip zone
         inZoneData = Map_Units_Dissolve
-        inValueRaster = cheStandard.Precip
+        valueRasters = OrderedDict([("PropLek", cheStandard.LekPresenceRaster),
+                                    ("PropMesic", cheStandard.Precip)])
         zoneField = "Map_Unit_ID"
-        outTable = "Proportion_Mesic"
-        hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
+        zonalStats = hqtlib.CalcZonalStatsBatch(inZoneData, zoneField,
+                                                valueRasters)
 
-        # Join the zonal statistic to the Map Units Dissolve table
-        field_name = "PropMesic"
-        hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, field_name)
+        # Write the zonal statistics to the Map Units Dissolve table
+        hqtlib.WriteFieldsByKey(inZoneData, zoneField, zonalStats)
 
         # Update message
         arcpy.AddMessage("Calculating pre-project anthropogenic "
@@ -354,48 +356,30 @@ def main():
         arcpy.AddMessage("Calculating Pre-Project Habitat Modifiers for"
                          "Greater Sage-Grouse")
 
-        # Calculate pre-project cumulative habitat modifiers
-        winterHabitatPre = cohqt.calcWinterHabitatGRSG(
-            Current_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            GrSG_Habitat
-            )
-        LSDMWinterPre = cohqt.applyLekUpliftModifierPre(
-            winterHabitatPre,
-            LekPresenceRaster
-            )
-        breedingHabitatPre = cohqt.calcBreedingHabitatGRSG(
-            Current_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            Lek_Distance_Modifier,
-            GrSG_Habitat
-            )
-        LSDMBreedingPre = cohqt.applyLekUpliftModifierPre(
-            breedingHabitatPre,
-            LekPresenceRaster
-            )
-        summerHabitatPre = cohqt.calcSummerHabitatGRSG(
-            Current_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            SageModifier,
-            GrSG_Habitat
-            )
-        LSDMSummerPre = cohqt.applyLekUpliftModifierPre(
-            summerHabitatPre,
-            LekPresenceRaster
-            )
-        seasonalHabitatRasters = [LSDMWinterPre, LSDMBreedingPre, LSDMSummerPre]
+        # Read the anthropogenic disturbance and modifiers within the
+        # Analysis Area once, aligned to the Empty Raster
+        currentAnthro = cheStandard.getAnalysisArray(
+            CURRENT_ANTHRO_DISTURBANCE)
+        winterStatic, breedingStatic, summerStatic = [
+            cheStandard.getStaticArray("GrSG_" + season)
+            for season in cheStandard.GrSGSeasons
+            ]
+        habitatArray = cheStandard.getAnalysisArray(GrSG_Habitat)
+        lekPresenceArray = cheStandard.getAnalysisArray(LekPresenceRaster)
+
+        # Calculate pre-project cumulative habitat modifiers, only for the
+        # cells with suitable habitat or a lek
+        staticArrays = [winterStatic, breedingStatic, summerStatic]
+        LSDMWinterPre, LSDMBreedingPre, LSDMSummerPre = \
+            cohqt.calcSeasonalHabitatArrays(currentAnthro, staticArrays,
+                                            habitatArray, lekPresenceArray)
 
         # Save outputs
-        # winterHabitatPre.save(GRSG_PRE_WINTER)
-        LSDMWinterPre.save(GRSG_PRE_WINTER)
-        # breedingHabitatPre.save(GRSG_PRE_BREEDING)
-        LSDMBreedingPre.save(GRSG_PRE_BREEDING)
-        # summerHabitatPre.save(GRSG_PRE_SUMMER)
-        LSDMSummerPre.save(GRSG_PRE_SUMMER)
+        cheStandard.saveAnalysisArray(LSDMWinterPre, GRSG_PRE_WINTER)
+        cheStandard.saveAnalysisArray(LSDMBreedingPre, GRSG_PRE_BREEDING)
+        cheStandard.saveAnalysisArray(LSDMSummerPre, GRSG_PRE_SUMMER)
+        seasonalHabitatRasters = [GRSG_PRE_WINTER, GRSG_PRE_BREEDING,
+                                  GRSG_PRE_SUMMER]
 
         # Initialize list of uplift rasters to combine for LekUpliftModifier
         upliftRasters = []
@@ -416,12 +400,16 @@ def main():
 
         if arcpy.Exists(PROPOSED_MODIFIED_FEATURES):
             # Prepare proposed anthropogenic features
-            unique_proposed_subtypes = cohqt.convertProposedToRasterCredit(
-                PROPOSED_MODIFIED_FEATURES, cellSize
+            (unique_proposed_subtypes,
+             proposed_rasters) = cohqt.convertProposedToRasterCredit(
+                PROPOSED_MODIFIED_FEATURES, cellSize, Parameter_Values,
+                emptyRaster
             )
 
             anthroPath = cheStandard.AnthroFeaturePath
-            cohqt.combineProposedWithCurrentCredit(anthroPath, unique_proposed_subtypes)
+            cohqt.combineProposedWithCurrentCredit(
+                anthroPath, unique_proposed_subtypes, proposed_rasters
+            )
 
             # Update message
             arcpy.AddMessage("Calculating post-project anthropogenic "
@@ -473,22 +461,11 @@ def main():
                     row[0] = "False"
                     cursor.updateRow(row)
 
-        # Calc zonal stats for pre-project modifiers (three seasons)
+        # Collect pre-project modifiers (three seasons) for zonal statistics
         term = cheStandard.CreditTerms[0]
+        valueRasters = OrderedDict()
         for season, raster in zip(cheStandard.GrSGSeasons, seasonalHabitatRasters):
-            # Update message
-            arcpy.AddMessage("Summarizing GrSG " + term + " " + season)
-
-            # Calculate zonal statistics for each map unit
-            inZoneData = Map_Units_Dissolve
-            inValueRaster = raster
-            zoneField = "Map_Unit_ID"
-            outTable = "GrSG_Stats_" + term + "_" + season
-            hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-            # Join the zonal statistic to the Map Units Dissolve table
-            field_name = "GrSG_" + term + "_" + season
-            hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, field_name)
+            valueRasters["GrSG_" + term + "_" + season] = raster
 
         if arcpy.Exists("Conifer_Treatment_Area") or \
                 arcpy.Exists("Anthro_Features_Removed"):
@@ -504,69 +481,42 @@ def main():
             # Update message
             arcpy.AddMessage("Calculating Post-Project Habitat Modifiers")
 
+            # Read the post-project anthropogenic disturbance and lek uplift
+            # modifier within the Analysis Area
+            projectedAnthro = cheStandard.getAnalysisArray(
+                Projected_Anthro_Disturbance)
+            lekUpliftArray = cheStandard.getAnalysisArray(lekUpliftModifier)
+
             # Calculate post-project cumulative habtiat modifiers
-            winterHabitatPost = cohqt.calcWinterHabitatGRSG(
-                Projected_Anthro_Disturbance,
-                ConiferModifier,
-                GrSG_LDI,
-                GrSG_Habitat
-                )
-            LSDMWinterPost = cohqt.applyLekUpliftModifierPost(
-                winterHabitatPost,
-                LekPresenceRaster,
-                lekUpliftModifier
-                )
-            breedingHabitatPost = cohqt.calcBreedingHabitatGRSG(
-                Projected_Anthro_Disturbance,
-                ConiferModifier,
-                GrSG_LDI,
-                Lek_Distance_Modifier,
-                GrSG_Habitat
-                )
-            LSDMBreedingPost = cohqt.applyLekUpliftModifierPost(
-                breedingHabitatPost,
-                LekPresenceRaster,
-                lekUpliftModifier
-                )
-            summerHabitatPost = cohqt.calcSummerHabitatGRSG(
-                Projected_Anthro_Disturbance,
-                ConiferModifier,
-                GrSG_LDI,
-                SageModifier,
-                GrSG_Habitat
-                )
-            LSDMSummerPost = cohqt.applyLekUpliftModifierPost(
-                summerHabitatPost,
-                LekPresenceRaster,
-                lekUpliftModifier
-                )
-
-            seasonalHabitatRasters = [LSDMWinterPost, LSDMBreedingPost, LSDMSummerPost]
+            LSDMWinterPost, LSDMBreedingPost, LSDMSummerPost = \
+                cohqt.calcSeasonalHabitatArrays(projectedAnthro, staticArrays,
+                                                habitatArray, lekPresenceArray,
+                                                lekUpliftArray)
 
             # Save outputs
-            # winterHabitatPost.save("Post_Seasonal_Winter")
-            LSDMWinterPost.save(GRSG_POST_WINTER)
-            # breedingHabitatPost.save("Post_Seasonal_Breeding")
-            LSDMBreedingPost.save(GRSG_POST_BREEDING)
-            # summerHabitatPost.save("Post_Seasonal_Summer")
-            LSDMSummerPost.save(GRSG_POST_SUMMER)
-
-            # Calc zonal stats for post-project modifiers
+            cheStandard.saveAnalysisArray(LSDMWinterPost, GRSG_POST_WINTER)
+            cheStandard.saveAnalysisArray(LSDMBreedingPost,
+                                          GRSG_POST_BREEDING)
+            cheStandard.saveAnalysisArray(LSDMSummerPost, GRSG_POST_SUMMER)
+            seasonalHabitatRasters = [GRSG_POST_WINTER, GRSG_POST_BREEDING,
+                                      GRSG_POST_SUMMER]
+
+            # Collect post-project modifiers for zonal statistics
             term = cheStandard.CreditTerms[1]
             for season, raster in zip(cheStandard.GrSGSeasons, seasonalHabitatRasters):
-                # Update message
-                arcpy.AddMessage("Summarizing GrSG " + term + " " + season)
+                valueRasters["GrSG_" + term + "_" + season] = raster
 
-                # Calculate zonal statistics for each map unit
-                inZoneData = Map_Units_Dissolve
-                inValueRaster = raster
-                zoneField = "Map_Unit_ID"
-                outTable = "GrSG_Stats_" + term + "_" + season
-                hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
+        # Update message
+        arcpy.AddMessage("Summarizing GrSG " + ", ".join(valueRasters))
 
-                # Join the zonal statistic to the Map Units Dissolve table
-                field_name = "GrSG_" + term + "_" + season
-                hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, field_name)
+        # Calculate zonal statistics for each map unit in a single pass
+        inZoneData = Map_Units_Dissolve
+        zoneField = "Map_Unit_ID"
+        zonalStats = hqtlib.CalcZonalStatsBatch(inZoneData, zoneField,
+                                                valueRasters)
+
+        # Write the zonal statistics to the Map Units Dissolve table
+        hqtlib.WriteFieldsByKey(inZoneData, zoneField, zonalStats)
 
         # Calculate Credit Intensity
 
@@ -673,22 +623,11 @@ def main():
         # Update message
         arcpy.AddMessage("Current_Anthro_Disturbance Calculated")
 
-        # Calc zonal stats for pre-project modifiers (three seasons)
+        # Collect pre-project modifiers (three seasons) for zonal statistics
         term = cheStandard.DebitTerms[0]
+        valueRasters = OrderedDict()
         for season, raster in zip(cheStandard.MuleDeerSeasons, seasonalHabitatRasters):
-            # Update message
-            arcpy.AddMessage("Summarizing Mule Deer " + term + " " + season)
-
-            # Calculate zonal statistics for each map unit
-            inZoneData = Map_Units_Dissolve
-            inValueRaster = raster
-            zoneField = "Map_Unit_ID"
-            outTable = "Mule_Stats_" + term + "_" + season
-            hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-            # Join the zonal statistic to the Map Units Dissolve table
-            field_name = "Mule_" + term + "_" + season
-            hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, field_name)
+            valueRasters["Mule_" + term + "_" + season] = raster
 
         # # Calculate average of three seasonal habitat rasters pre-project
         # finalPreCumulative = hqtlib.calcAverageHabitatQuality(
@@ -746,22 +685,11 @@ def main():
             winterHabitatPost.save(MULE_POST_WINTER)
             # LSDMSummerPre.save("Pre_LSDM_Summer")
 
-            # Calc zonal stats for pre-project modifiers (three seasons)
+            # Collect post-project modifiers (three seasons) for zonal
+            # statistics
             term = cheStandard.DebitTerms[1]
             for season, raster in zip(cheStandard.MuleDeerSeasons, seasonalHabitatRasters):
-                # Update message
-                arcpy.AddMessage("Summarizing Mule Deer " + term + season)
-
-                # Calculate zonal statistics for each map unit
-                inZoneData = Map_Units_Dissolve
-                inValueRaster = raster
-                zoneField = "Map_Unit_ID"
-                outTable = "Mule_Stats_" + term + season
-                hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-                # Join the zonal statistic to the Map Units Dissolve table
-                field_name = "Mule_" + term + "_" + season
-                hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, field_name)
+                valueRasters["Mule_" + term + "_" + season] = raster
 
             # # Calculate average of three seasonal habitat rasters post-project
             # finalPostCumulative = hqtlib.calcAverageHabitatQuality(
@@ -771,18 +699,31 @@ def main():
 
             # Calculate permanent cumulative habtiat modifiers
 
+        # Update message
+        arcpy.AddMessage("Summarizing Mule Deer " + ", ".join(valueRasters))
+
+        # Calculate zonal statistics for each map unit in a single pass
+        inZoneData = Map_Units_Dissolve
+        zoneField = "Map_Unit_ID"
+        zonalStats = hqtlib.CalcZonalStatsBatch(inZoneData, zoneField,
+                                                valueRasters)
+
+        if arcpy.Exists(PROPOSED_MODIFIED_FEATURES):
             # Update message
             arcpy.AddMessage("Calculating Mule Deer Benefit")
 
-            # Calculate impact
-            pre_fields = ["Mule_Pre_Summer", "Mule_Pre_Migration", "Mule_Pre_Winter"]
-            post_fields = ["Mule_Post_Summer", "Mule_Post_Migration", "Mule_Post_Winter"]
-            out_fields = ["Mule_Summer_Benefit", "Mule_Migration_Benefit", "Mule_Winter_Benefit"]
-            for i in range(len(pre_fields)):
-                pre_field = pre_fields[i]
-                post_field = post_fields[i]
-                out_field = out_fields[i]
-                cohqt.calcDebits(Map_Units_Dissolve, pre_field, post_field, out_field)
+            # Calculate benefit for all seasons at once and write it with the
+            # zonal statistics to the Map Units Dissolve table
+            accounts = [
+                ("Mule_Pre_" + season, "Mule_Post_" + season,
+                 "Mule_" + season + "_Benefit")
+                for season in cheStandard.MuleDeerSeasons
+                ]
+            hqtlib.CalcFunctionalAcres(Map_Units_Dissolve, zoneField,
+                                       zonalStats, accounts)
+        else:
+            # Write the zonal statistics to the Map Units Dissolve table
+            hqtlib.WriteFieldsByKey(inZoneData, zoneField, zonalStats)
 
         # # Export data to Excel
         input_Tables = [MAP_UNITS_DISSOLVE]
@@ -802,6 +743,7 @@ def main():
         arcpy.Delete_management(raster)
 
     arcpy.Delete_management("in_memory")
+    cheStandard.restoreEnvironment()
 
     # Save map document
     if arcpy.ListInstallations()[0] == 'arcgispro':
@@ -55,6 +55,9 @@ def main():
     # Instantiate an cheStandard object
     cheStandard = cohqt.cheStandard(projectGDB, scriptPath)
 
+    # Check the Data Package against its manifest
+    cheStandard.checkDataPackage()
+
     # ENVIRONMENT SETTINGS
     # Set workspaces
     arcpy.env.workspace = projectGDB
@@ -64,6 +67,7 @@ def main():
 
     # DEFINE GLOBAL VARIABLES
     parameter_values = cheStandard.ParameterValues
+    parameter_table = cheStandard.ParameterTable
     coordinate_system = cheStandard.CoorSystem
     # Filenames for feature classes and rasters created by this script
     PROPOSED_SURFACE_DISTURBANCE_DEBITS = "Proposed_Surface_Disturbance_Debits"
@@ -190,8 +194,7 @@ def main():
     # Add Domains to Proposed_Surface_Disturbance_Debits layer
     featureList = [Proposed_Surface_Disturbance]
     domain_name = "Type"
-    code_list = [row[0] for row in arcpy.da.SearchCursor(
-        parameter_values, "Type")]
+    code_list = list(parameter_table.column("Type"))
 
     # Create Domain for Subtype attributes and assign to Subtype field
     util.AddSubtypeDomains(featureList, projectGDB, parameter_values)
@@ -208,8 +211,7 @@ def main():
     # Create Domain for Type attributes and assign to Reclassified Subtype
     # field
     domain_name = "Reclassified_Subtype"
-    code_list = [row[0] for row in arcpy.da.SearchCursor(
-        parameter_values, "Subtype")]
+    code_list = list(parameter_table.column("Subtype"))
     util.AddCodedTextDomain(featureList, projectGDB, domain_name, code_list)
 
     if includes_anthro_mod:
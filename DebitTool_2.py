@@ -31,13 +31,16 @@ import arcpy
 import sys
 import os
 import gc
+import rasterlib
 import hqtlib
 import util
 import cohqt
 from arcpy.sa import Con
+from collections import OrderedDict
 
 if arcpy.ListInstallations()[0] == 'arcgispro':  # switch
     import importlib
+    importlib.reload(rasterlib)
     importlib.reload(hqtlib) #ensures up-to-date hqtlib runs on arcpro
     importlib.reload(util)
     importlib.reload(cohqt)
@@ -59,6 +62,9 @@ def main():
     # Instantiate a cheStandard object
     cheStandard = cohqt.cheStandard(projectGDB, scriptPath)
 
+    # Check the Data Package against its manifest
+    cheStandard.checkDataPackage()
+
     # ENVIRONMENT SETTINGS
     # Set workspaces
     arcpy.env.workspace = projectGDB
@@ -74,7 +80,7 @@ def main():
     arcpy.env.overwriteOutput = True
 
     # DEFINE GLOBAL VARIABLES
-    Parameter_Values = cheStandard.ParameterValues
+    Parameter_Values = cheStandard.ParameterTable
     habitat_bounds = cheStandard.HabitatMgmtArea
     ConiferModifier = cheStandard.ConiferModifier
     GrSG_LDI = cheStandard.GrSG_LDI
@@ -91,8 +97,7 @@ def main():
     BWMD_Open = cheStandard.BWMD_Open
     GrSG_Range = cheStandard.GrSGHabitat
     Mule_Range = cheStandard.MuleDeerHabitat
-    cellSize = arcpy.GetRasterProperties_management(
-        emptyRaster, "CELLSIZEX").getOutput(0)
+    cellSize = cheStandard.CellSize
 
     # Filenames for feature classes or rasters used by this script
     PROPOSED_SURFACE_DISTURBANCE_DEBITS = "Proposed_Surface_Disturbance_Debits"
@@ -183,7 +188,8 @@ def main():
     in_data = Proposed_Surface_Disturbance
     out_name = INDIRECT_IMPACT_AREA
     Indirect_Impact_Area = hqtlib.CreateIndirectImpactArea(
-        in_data, Parameter_Values, out_name
+        in_data, Parameter_Values, out_name,
+        cheStandard.DistanceAreaCellSize, emptyRaster
         )
 
     # Set up flag for projects that propose to modify anthro features
@@ -222,7 +228,8 @@ def main():
         in_data = Proposed_Modified_Features
         out_name = INDIRECT_BENEFIT_AREA
         Indirect_Benefit_Area = hqtlib.CreateIndirectImpactArea(
-            in_data, Parameter_Values, out_name
+            in_data, Parameter_Values, out_name,
+            cheStandard.DistanceAreaCellSize, emptyRaster
             )
 
         # Union the indirect benefit area and the indirect impact area
@@ -267,7 +274,9 @@ def main():
     out_name = ANALYSIS_AREA
     Analysis_Area = hqtlib.CreateAnalysisArea(Debit_Project_Area,
                                              Parameter_Values,
-                                             out_name)
+                                             out_name,
+                                             cheStandard.DistanceAreaCellSize,
+                                             emptyRaster)
 
     # Add Analysis_Area to map
     layerFile = cheStandard.getLayerFile("AnalysisArea.lyr")
@@ -275,14 +284,19 @@ def main():
 
     # Set processing extent to Analysis_Area
     arcpy.env.extent = ANALYSIS_AREA
+    cheStandard.setAnalysisArea(ANALYSIS_AREA, cellSize)
 
     # Prepare proposed anthropogenic features
-    unique_proposed_subtypes = cohqt.convertProposedToRasterDebit(
-        Proposed_Surface_Disturbance, cellSize
+    (unique_proposed_subtypes,
+     proposed_rasters) = cohqt.convertProposedToRasterDebit(
+        Proposed_Surface_Disturbance, cellSize, Parameter_Values,
+        emptyRaster
         )
 
     anthroPath = cheStandard.AnthroFeaturePath
-    cohqt.combineProposedWithCurrentDebit(anthroPath, unique_proposed_subtypes)
+    cohqt.combineProposedWithCurrentDebit(
+        anthroPath, unique_proposed_subtypes, proposed_rasters
+    )
 
     # # Do something about anthropogenic mod features
     # if includes_anthro_mod:
@@ -295,6 +309,13 @@ def main():
 
     ### GREATER SAGE-GROUSE ANTHRO DIST & MODIFIERS ###
     if is_grsg:
+        # Start loading the habitat modifiers while anthropogenic
+        # disturbance is calculated
+        cheStandard.prefetchAnalysisArrays(
+            [GrSGHabitat, LekPresenceRaster],
+            static=["GrSG_" + season for season in cheStandard.GrSGSeasons]
+            )
+
         # Update message
         arcpy.AddMessage("Calculating pre-project anthropogenic disturbance "
                          "modifier for greater sage-grouse")
@@ -350,107 +371,60 @@ def main():
         # Update message
         arcpy.AddMessage("Calculating Pre-Project Habitat Modifiers")
 
-        # Calculate pre-project cumulative habitat modifiers
-        winterHabitatPre = cohqt.calcWinterHabitatGRSG(
-            Current_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            GrSGHabitat
-            )
-        LSDMWinterPre = cohqt.applyLekUpliftModifierPre(
-            winterHabitatPre,
-            LekPresenceRaster
-            )
-        breedingHabitatPre = cohqt.calcBreedingHabitatGRSG(
-            Current_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            Lek_Distance_Modifier,
-            GrSGHabitat
-            )
-        LSDMBreedingPre = cohqt.applyLekUpliftModifierPre(
-            breedingHabitatPre,
-            LekPresenceRaster
-            )
-        summerHabitatPre = cohqt.calcSummerHabitatGRSG(
-            Current_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            SageModifier,
-            GrSGHabitat
-            )
-        LSDMSummerPre = cohqt.applyLekUpliftModifierPre(
-            summerHabitatPre,
-            LekPresenceRaster
-            )
+        # Read the anthropogenic disturbance and modifiers within the
+        # Analysis Area once, aligned to the Empty Raster
+        currentAnthro = cheStandard.getAnalysisArray(
+            CURRENT_ANTHRO_DISTURBANCE)
+        projectedAnthro = cheStandard.getAnalysisArray(
+            PROJECTED_ANTHRO_DISTURBANCE)
+        lekDisturbance = cheStandard.getAnalysisArray(
+            LEK_DISTURBANCE_MODIFIER)
+        winterStatic, breedingStatic, summerStatic = [
+            cheStandard.getStaticArray("GrSG_" + season)
+            for season in cheStandard.GrSGSeasons
+            ]
+        habitatArray = cheStandard.getAnalysisArray(GrSGHabitat)
+        lekPresenceArray = cheStandard.getAnalysisArray(LekPresenceRaster)
+
+        # Calculate pre-project cumulative habitat modifiers, only for the
+        # cells with suitable habitat or a lek
+        staticArrays = [winterStatic, breedingStatic, summerStatic]
+        LSDMWinterPre, LSDMBreedingPre, LSDMSummerPre = \
+            cohqt.calcSeasonalHabitatArrays(currentAnthro, staticArrays,
+                                            habitatArray, lekPresenceArray)
         seasonalHabitatRasters = [LSDMWinterPre, LSDMBreedingPre, LSDMSummerPre]
 
         # Save outputs
-        # winterHabitatPre.save(GRSG_PRE_WINTER)
-        LSDMWinterPre.save(GRSG_PRE_WINTER)
-        # breedingHabitatPre.save(GRSG_PRE_BREEDING)
-        LSDMBreedingPre.save(GRSG_PRE_BREEDING)
-        # summerHabitatPre.save(GRSG_PRE_SUMMER)
-        LSDMSummerPre.save(GRSG_PRE_SUMMER)
+        cheStandard.saveAnalysisArray(LSDMWinterPre, GRSG_PRE_WINTER)
+        cheStandard.saveAnalysisArray(LSDMBreedingPre, GRSG_PRE_BREEDING)
+        cheStandard.saveAnalysisArray(LSDMSummerPre, GRSG_PRE_SUMMER)
 
         # Calculate average of three seasonal habitat rasters pre-project
         finalPreCumulative = cohqt.calcAverageHabitatQuality(
             seasonalHabitatRasters
         )
-        finalPreCumulative.save(CUMULATIVE_MODIFIER_PRE)
+        cheStandard.saveAnalysisArray(finalPreCumulative,
+                                      CUMULATIVE_MODIFIER_PRE)
 
         # Calculate post-project cumulative habtiat modifiers
-        winterHabitatPost = cohqt.calcWinterHabitatGRSG(
-            Projected_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            GrSGHabitat
-            )
-        LSDMWinterPost = cohqt.applyLekUpliftModifierPost(
-            winterHabitatPost,
-            LekPresenceRaster,
-            Lek_Disturbance_Modifier
-            )
-        breedingHabitatPost = cohqt.calcBreedingHabitatGRSG(
-            Projected_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            Lek_Distance_Modifier,
-            GrSGHabitat
-            )
-        LSDMBreedingPost = cohqt.applyLekUpliftModifierPost(
-            breedingHabitatPost,
-            LekPresenceRaster,
-            Lek_Disturbance_Modifier
-            )
-        summerHabitatPost = cohqt.calcSummerHabitatGRSG(
-            Projected_Anthro_Disturbance,
-            ConiferModifier,
-            GrSG_LDI,
-            SageModifier,
-            GrSGHabitat
-            )
-        LSDMSummerPost = cohqt.applyLekUpliftModifierPost(
-            summerHabitatPost,
-            LekPresenceRaster,
-            Lek_Disturbance_Modifier
-            )
+        LSDMWinterPost, LSDMBreedingPost, LSDMSummerPost = \
+            cohqt.calcSeasonalHabitatArrays(projectedAnthro, staticArrays,
+                                            habitatArray, lekPresenceArray,
+                                            lekDisturbance)
 
         seasonalHabitatRasters = [LSDMWinterPost, LSDMBreedingPost, LSDMSummerPost]
 
         # Save outputs
-        # winterHabitatPost.save("Post_Seasonal_Winter")
-        LSDMWinterPost.save(GRSG_POST_WINTER)
-        # breedingHabitatPost.save("Post_Seasonal_Breeding")
-        LSDMBreedingPost.save(GRSG_POST_BREEDING)
-        # summerHabitatPost.save("Post_Seasonal_Summer")
-        LSDMSummerPost.save(GRSG_POST_SUMMER)
+        cheStandard.saveAnalysisArray(LSDMWinterPost, GRSG_POST_WINTER)
+        cheStandard.saveAnalysisArray(LSDMBreedingPost, GRSG_POST_BREEDING)
+        cheStandard.saveAnalysisArray(LSDMSummerPost, GRSG_POST_SUMMER)
 
         # Calculate average of three seasonal habitat rasters post-project
         finalPostCumulative = cohqt.calcAverageHabitatQuality(
             seasonalHabitatRasters
         )
-        finalPostCumulative.save(CUMULATIVE_MODIFIER_POST)
+        cheStandard.saveAnalysisArray(finalPostCumulative,
+                                      CUMULATIVE_MODIFIER_POST)
 
         # Calculate permanent cumulative habtiat modifiers
 
@@ -467,38 +441,31 @@ def main():
         # Update message
         arcpy.AddMessage("Calculating debits for greater sage-grouse")
 
-        # Calculate zonal statistics for pre-project
+        # Calculate zonal statistics for pre- and post-project
         inZoneData = Debit_Project_Area
-        inValueRaster = finalPreCumulative
+        valueRasters = OrderedDict([
+            ("GRSG_Pre_Project", CUMULATIVE_MODIFIER_PRE),
+            ("GrSG_Post_Project", CUMULATIVE_MODIFIER_POST)
+            ])
         zoneField = fields[0]
-        outTable = "GRSG_Stats_Pre"
-        hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-        # Join the zonal statistic to the Debit Project Area table
-        fieldName = "GRSG_Pre_Project"
-        hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, fieldName)
-
-        # Calculate zonal statistics for post-project
-        inZoneData = Debit_Project_Area
-        inValueRaster = finalPostCumulative
-        zoneField = fields[0]
-        outTable = "GRSG_Stats_Post"
-        hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-        # Join the zonal statistic to the Debit Project Area table
-        fieldName = "GrSG_Post_Project"
-        hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, fieldName)
-
-        # Calculate debits (if not collecting field data)
-        cohqt.calcDebits(Debit_Project_Area, "GRSG_Pre_Project",
-                          "GrSG_Post_Project", "Debits")
+        zonalStats = hqtlib.CalcZonalStatsBatch(inZoneData, zoneField,
+                                                valueRasters)
+
+        # Calculate debits (if not collecting field data) and write them with
+        # the zonal statistics to the Debit Project Area table
+        hqtlib.CalcFunctionalAcres(
+            Debit_Project_Area, zoneField, zonalStats,
+            [("GRSG_Pre_Project", "GrSG_Post_Project", "Debits")]
+            )
 
         # Update message
         arcpy.AddMessage("Creating visualization of impact from debit project")
 
         # Calculate impact intensity for debit project
-        debit_impact = cohqt.calcImpact(finalPreCumulative, finalPostCumulative)
-        debit_impact.save(DEBIT_PROJECT_IMPACT)
+        debit_impact = cheStandard.saveAnalysisArray(
+            cohqt.calcImpact(finalPreCumulative, finalPostCumulative),
+            DEBIT_PROJECT_IMPACT
+            )
 
         # Add Debit Impact raster to map and save map document
         feature = debit_impact
@@ -521,6 +488,14 @@ def main():
 
     # Update message
     if is_mule:
+        # Start loading the habitat modifiers while anthropogenic
+        # disturbance is calculated
+        cheStandard.prefetchAnalysisArrays(
+            [MuleDeerHabitat],
+            static=["MuleDeer_" + season
+                    for season in cheStandard.MuleDeerSeasons]
+            )
+
         arcpy.AddMessage("Calculating pre-project anthropogenic disturbance "
                         "modifier for mule deer")
 
@@ -634,104 +609,39 @@ def main():
         # Update message
         arcpy.AddMessage("Calculating Pre-Project Habitat Modifiers")
 
-        # Calculate pre-project cumulative habitat modifiers
-        summerHabitatPre = cohqt.calcSummerHabitatMD(
-            Current_Anthro_Disturbance, MuleDeer_LDI, SummerModifier,
-            SuitableHabitat=MuleDeerHabitat
-        )
-        # LSDMWinterPre = cohqt.applyLekUpliftModifierPre(summerHabitatPre,
-        #                                                  LekPresenceRaster)
-        migratoryHabitatPre = cohqt.calcMigratoryHabitatMD(
-            Current_Anthro_Disturbance, MuleDeer_LDI, MigrationModifier,
-            SuitableHabitat=MuleDeerHabitat
-        )
-        # LSDMBreedingPre = cohqt.applyLekUpliftModifierPre(migratoryHabitatPre,
-        #                                                    LekPresenceRaster)
-        winterHabitatPre = cohqt.calcWinterHabitatMD(
-            Current_Anthro_Disturbance, MuleDeer_LDI, WinterModifier,
-            SuitableHabitat=MuleDeerHabitat
-        )
-        # LSDMSummerPre = cohqt.applyLekUpliftModifierPre(winterHabitatPre,
-        #                                                  LekPresenceRaster)
-        seasonalHabitatRasters = [summerHabitatPre, migratoryHabitatPre, winterHabitatPre]
-
-        # Save outputs
-        summerHabitatPre.save(MULE_PRE_SUMMER)
-        # LSDMWinterPre.save("Pre_LSDM_Winter")
-        migratoryHabitatPre.save(MULE_PRE_MIGRATION)
-        # LSDMBreedingPre.save("Pre_LSDM_Breeding")
-        winterHabitatPre.save(MULE_PRE_WINTER)
-        # LSDMSummerPre.save("Pre_LSDM_Summer")
-
-        # Calc zonal stats for pre-project modifiers (three seasons)
-        term = cheStandard.DebitTerms[0]
-        for season, raster in zip(cheStandard.MuleDeerSeasons, seasonalHabitatRasters):
-            # Update message
-            arcpy.AddMessage("Summarizing Mule Deer " + term + " " + season)
-
-            # Calculate zonal statistics for each map unit
-            inZoneData = Debit_Project_Area
-            inValueRaster = raster
-            zoneField = fields[0]
-            outTable = "Mule_Stats_" + term + "_" + season
-            hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-            # Join the zonal statistic to the Map Units Dissolve table
-            fieldName = "Mule_" + term + "_" + season
-            hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, fieldName)
-
-        # # Calculate average of three seasonal habitat rasters pre-project
-        # finalPreCumulative = hqtlib.calcAverageHabitatQuality(
-        #     seasonalHabitatRasters
-        # )
-        # finalPreCumulative.save(CUMULATIVE_MODIFIER_PRE)
+        # Read the anthropogenic disturbance and modifiers within the
+        # Analysis Area once, aligned to the Empty Raster
+        habitatArray = cheStandard.getAnalysisArray(MuleDeerHabitat)
+        seasonalStatics = [cheStandard.getStaticArray("MuleDeer_" + season)
+                           for season in cheStandard.MuleDeerSeasons]
+
+        # Calculate pre- and post-project cumulative habitat modifiers for
+        # the three seasons and collect them for zonal statistics
+        valueRasters = OrderedDict()
+        for term, anthroRaster, outRasters in [
+                (cheStandard.DebitTerms[0], CURRENT_ANTHRO_DISTURBANCE_MD,
+                 [MULE_PRE_SUMMER, MULE_PRE_MIGRATION, MULE_PRE_WINTER]),
+                (cheStandard.DebitTerms[1], PROJECTED_ANTHRO_DISTURBANCE_MD,
+                 [MULE_POST_SUMMER, MULE_POST_MIGRATION, MULE_POST_WINTER])]:
+            anthroArray = cheStandard.getAnalysisArray(anthroRaster)
+            seasonalHabitatArrays = cohqt.calcSeasonalHabitatArrays(
+                anthroArray, seasonalStatics, habitatArray
+                )
+            for season, seasonalHabitat, outRaster in zip(
+                    cheStandard.MuleDeerSeasons, seasonalHabitatArrays,
+                    outRasters):
+                cheStandard.saveAnalysisArray(seasonalHabitat, outRaster)
+                valueRasters["Mule_" + term + "_" + season] = outRaster
 
-        # Calculate post-project cumulative habitat modifiers
-        summerHabitatPost = cohqt.calcSummerHabitatMD(
-            Projected_Anthro_Disturbance, MuleDeer_LDI, SummerModifier,
-            SuitableHabitat=MuleDeerHabitat
-        )
-        # LSDMWinterPost = cohqt.applyLekUpliftModifierPost(summerHabitatPost,
-        #                                                  LekPresenceRaster)
-        migratoryHabitatPost = cohqt.calcMigratoryHabitatMD(
-            Projected_Anthro_Disturbance, MuleDeer_LDI, MigrationModifier,
-            SuitableHabitat=MuleDeerHabitat
-        )
-        # LSDMBreedingPost = cohqt.applyLekUpliftModifierPost(migratoryHabitatPost,
-        #                                                    LekPresenceRaster)
-        winterHabitatPost = cohqt.calcWinterHabitatMD(
-            Projected_Anthro_Disturbance, MuleDeer_LDI, WinterModifier,
-            SuitableHabitat=MuleDeerHabitat
-        )
-        # LSDMSummerPost = cohqt.applyLekUpliftModifierPost(winterHabitatPost,
-        #                                                  LekPresenceRaster)
-        seasonalHabitatRasters = [summerHabitatPost, migratoryHabitatPost,
-                                winterHabitatPost]
-
-        # Save outputs
-        summerHabitatPost.save(MULE_POST_SUMMER)
-        # LSDMWinterPre.save("Pre_LSDM_Winter")
-        migratoryHabitatPost.save(MULE_POST_MIGRATION)
-        # LSDMBreedingPre.save("Pre_LSDM_Breeding")
-        winterHabitatPost.save(MULE_POST_WINTER)
-        # LSDMSummerPre.save("Pre_LSDM_Summer")
-
-        # Calc zonal stats for pre-project modifiers (three seasons)
-        term = cheStandard.DebitTerms[1]
-        for season, raster in zip(cheStandard.MuleDeerSeasons, seasonalHabitatRasters):
-            # Update message
-            arcpy.AddMessage("Summarizing Mule Deer " + term + " " + season)
-
-            # Calculate zonal statistics for each map unit
-            inZoneData = Debit_Project_Area
-            inValueRaster = raster
-            zoneField = fields[0]
-            outTable = "Mule_Stats_" + term + "_" + season
-            hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
+        # Update message
+        arcpy.AddMessage("Summarizing Mule Deer " + ", ".join(valueRasters))
 
-            # Join the zonal statistic to the Map Units Dissolve table
-            fieldName = "Mule_" + term + "_" + season
-            hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, fieldName)
+        # Calculate zonal statistics for the debit project area in a single
+        # pass
+        inZoneData = Debit_Project_Area
+        zoneField = fields[0]
+        zonalStats = hqtlib.CalcZonalStatsBatch(inZoneData, zoneField,
+                                                valueRasters)
 
         # # Calculate average of three seasonal habitat rasters post-project
         # finalPostCumulative = hqtlib.calcAverageHabitatQuality(
@@ -744,15 +654,15 @@ def main():
         # Update message
         arcpy.AddMessage("Calculating Mule Deer Impact")
 
-        # Calculate impact
-        pre_fields = ["Mule_Pre_Summer", "Mule_Pre_Migration", "Mule_Pre_Winter"]
-        post_fields = ["Mule_Post_Summer", "Mule_Post_Migration", "Mule_Post_Winter"]
-        out_fields = ["Mule_Summer_Impact", "Mule_Migration_Impact", "Mule_Winter_Impact"]
-        for i in range(len(pre_fields)):
-            pre_field = pre_fields[i]
-            post_field = post_fields[i]
-            out_field = out_fields[i]
-            cohqt.calcDebits(Debit_Project_Area, pre_field, post_field, out_field)
+        # Calculate impact for all seasons at once and write it with the
+        # zonal statistics to the Debit Project Area table
+        accounts = [
+            ("Mule_Pre_" + season, "Mule_Post_" + season,
+             "Mule_" + season + "_Impact")
+            for season in cheStandard.MuleDeerSeasons
+            ]
+        hqtlib.CalcFunctionalAcres(Debit_Project_Area, zoneField, zonalStats,
+                                   accounts)
 
         # # Update message
         # arcpy.AddMessage("Creating visualization of impact from debit project")
@@ -814,6 +724,7 @@ def main():
         arcpy.Delete_management(raster)
 
     arcpy.Delete_management("in_memory")
+    cheStandard.restoreEnvironment()
     try:
         arcpy.Delete_management(scratch_folder)
     except:
@@ -48,6 +48,9 @@ def main():
     # Instantiate a idStandard object
     cheStandard = cohqt.cheStandard(projectGDB, scriptPath)
 
+    # Check the Data Package against its manifest
+    cheStandard.checkDataPackage()
+
     # ENVIRONMENT SETTINGS
     # Set workspaces
     arcpy.env.workspace = projectGDB
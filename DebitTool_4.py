@@ -33,13 +33,16 @@ import arcpy
 import os
 import sys
 import gc
+import numpy as np
+import rasterlib
 import hqtlib
 import util
 import cohqt
-from arcpy.sa import Con, IsNull, Float, Raster
+from collections import OrderedDict
 
 if arcpy.ListInstallations()[0] == 'arcgispro':  # switch
     import importlib
+    importlib.reload(rasterlib)
     importlib.reload(hqtlib) #ensures up-to-date hqtlib runs on arcpro
     importlib.reload(util)
     importlib.reload(cohqt)
@@ -61,6 +64,9 @@ def main():
     # Instantiate a idStandard object
     cheStandard = cohqt.cheStandard(projectGDB, scriptPath)
 
+    # Check the Data Package against its manifest
+    cheStandard.checkDataPackage()
+
     # ENVIRONMENT SETTINGS
     # Set workspaces
     arcpy.env.workspace = projectGDB
@@ -175,19 +181,20 @@ def main():
     # Convert Map Units to raster of Habitat Quality (0 - 1 scale) and  mask
     # out BWSG habitat
     seasonsList = cheStandard.GrSGSeasons
-    for season in seasonsList:
-        mu_raster_path = cohqt.convertMapUnitsToRaster(projectGDB, 
-                                                       Map_Units, 
-                                                       season, 
-                                                       cell_size)
-        mu_raster = Raster(mu_raster_path)
-        # Mask out BWSG habitat
-        SuitableHabitat_adjusted = Con(IsNull(Float(mu_raster)), 
-                                       GrSG_Habitat, 
-                                       Float(mu_raster))
-        SuitableHabitat_adjusted.save(os.path.join(
-            projectGDB, season + "_Habitat_adjusted")
-                                      )
+    grid, muBands = cohqt.convertMapUnitsToRaster(projectGDB,
+                                                  Map_Units,
+                                                  seasonsList,
+                                                  cell_size,
+                                                  cheStandard.EmptyRaster)
+    # Mask out BWSG habitat for all seasons at once
+    habitat = cheStandard.cache.read(GrSG_Habitat, grid, nodata=np.nan)
+    adjustedBands = np.where(np.isnan(muBands), habitat, muBands)
+    spatialReference = arcpy.Describe(Map_Units).spatialReference
+    for season, adjustedArray in zip(seasonsList, adjustedBands):
+        rasterlib.SaveArray(adjustedArray, grid,
+                            os.path.join(projectGDB,
+                                         season + "_Habitat_adjusted"),
+                            spatial_reference=spatialReference)
     
     # Update message
     arcpy.AddMessage("Calculating Pre-Project Habitat Modifiers")
@@ -306,31 +313,22 @@ def main():
     finalPostCumulative.save(CUMULATIVE_MODIFIER_POST_A)
     
     # Calculate Zonal Statistics for cumulative modifier rasters
-    # Calculate zonal statistics for pre-project
-    inZoneData = DEBIT_PROJECT_AREA
-    inValueRaster = finalPreCumulative
-    zoneField = "ZONAL"
-    outTable = "GRSG_Stats_Pre_adjusted"
-    hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-    # Join the zonal statistic to the Debit Project Area table
-    fieldName = "GRSG_Pre_Project_A"
-    hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, fieldName)
-
-    # Calculate zonal statistics for post-project
+    # Calculate zonal statistics for pre- and post-project
     inZoneData = DEBIT_PROJECT_AREA
-    inValueRaster = finalPostCumulative
+    valueRasters = OrderedDict([
+        ("GRSG_Pre_Project_A", finalPreCumulative),
+        ("GrSG_Post_Project_A", finalPostCumulative)
+        ])
     zoneField = "ZONAL"
-    outTable = "GRSG_Stats_Post_adjusted"
-    hqtlib.CalcZonalStats(inZoneData, zoneField, inValueRaster, outTable)
-
-    # Join the zonal statistic to the Debit Project Area table
-    fieldName = "GrSG_Post_Project_A"
-    hqtlib.JoinMeanToTable(inZoneData, outTable, zoneField, fieldName)
-
-    # Calculate debits using field data
-    cohqt.calcDebits(DEBIT_PROJECT_AREA, "GRSG_Pre_Project_A",
-                     "GrSG_Post_Project_A", "Debits_adj")
+    zonalStats = hqtlib.CalcZonalStatsBatch(inZoneData, zoneField,
+                                            valueRasters)
+
+    # Calculate debits using field data and write them with the zonal
+    # statistics to the Debit Project Area table
+    hqtlib.CalcFunctionalAcres(
+        DEBIT_PROJECT_AREA, zoneField, zonalStats,
+        [("GRSG_Pre_Project_A", "GrSG_Post_Project_A", "Debits_adj")]
+        )
     
     # Update message
     arcpy.AddMessage("Creating visualization of impact from debit project")
@@ -0,0 +1,104 @@
+"""
+Name:     ExportArrayStore.py
+Author:   Environmental Incentives, LLC
+Created:  October 18, 2026
+Revised:  October 18, 2026
+Version:  Compatible with Python 2.7 (ArcMap) and Python 3 (ArcGIS Pro)
+Requires: ArcGIS version 10.1 or later, Basic (ArcView) license or better
+          Spatial Analyst extension, numpy
+
+Exports the rasters of the Data Package (InputData.gdb and AnthroData.gdb)
+to ToolData/ArrayStore as memory-mapped arrays with a JSON manifest. Once
+exported, the HQT tools read windows of these rasters from the array store
+instead of decoding them from the file geodatabases. Re-run this tool after
+updating the Data Package. The products of the modifiers that do not
+depend on the project (e.g., conifer modifier x LDI per season) are composed
+once into static surfaces in the same store, and the envelopes of the
+anthropogenic feature classes are indexed in ToolData/SpatialIndex.
+
+Copyright 2017-2020 Environmental Incentives, LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+# Import system modules
+import arcpy
+import collections
+import os
+import sys
+import gc
+import rasterlib
+import hqtlib
+import cohqt
+
+if arcpy.ListInstallations()[0] == 'arcgispro':  # switch
+    import importlib
+    importlib.reload(rasterlib)
+    importlib.reload(hqtlib)
+    importlib.reload(cohqt)
+
+
+def main():
+    # DEFINE DIRECTORIES
+    # Get the pathname to this script
+    scriptPath = sys.path[0]
+    arcpy.AddMessage("Script folder: " + scriptPath)
+    arcpy.AddMessage("Python version: " + sys.version)
+
+    # Instantiate an cheStandard object
+    cheStandard = cohqt.cheStandard(None, scriptPath)
+
+    # FUNCTION CALLS
+    # List the rasters of the Data Package geodatabases
+    rasters = collections.OrderedDict()
+    for workspace in [cheStandard.InputDataPath,
+                      cheStandard.AnthroFeaturePath]:
+        arcpy.env.workspace = workspace
+        for raster in arcpy.ListRasters():
+            name = os.path.basename(workspace) + "/" + raster
+            rasters[name] = os.path.join(workspace, raster)
+
+    arcpy.AddMessage("Exporting " + str(len(rasters)) + " rasters to "
+                     + cheStandard.ArrayStorePath)
+    # Record the content hash of each raster in the Data Package manifest
+    cheStandard.updateDataPackage()
+    hashes = dict((name, entry["hash"]) for name, entry
+                  in cheStandard.manifest.datasets.items())
+    arcpy.AddMessage("Composing static surfaces: "
+                     + ", ".join(cheStandard.StaticSurfaces))
+    rasterlib.ExportArrayStore(rasters, cheStandard.ArrayStorePath,
+                               hashes=hashes,
+                               static=cheStandard.StaticSurfaces)
+
+    # Index the envelopes of the anthropogenic feature classes
+    contentHashes = cheStandard.manifest.hashes()
+    walk = arcpy.da.Walk(cheStandard.AnthroFeaturePath,
+                         datatype="FeatureClass",
+                         type=["Polygon", "Polyline", "Point"])
+    for dirpath, dirnames, filenames in walk:
+        for filename in filenames:
+            in_features = os.path.join(dirpath, filename)
+            hqtlib.AnthroSpatialIndex(in_features,
+                                      cheStandard.SpatialIndexPath,
+                                      contentHashes.get(in_features))
+
+    # ------------------------------------------------------------------------
+
+# EXECUTE SCRIPT
+
+
+if __name__ == "__main__":
+    gc.enable()
+    main()
+    gc.collect()
@@ -14,8 +14,11 @@ HQT.
 
 import arcpy
 import os
+from collections import OrderedDict
 import numpy as np
 import util
+import rasterlib
+import hqtlib
 from arcpy.sa import (Raster, Con, IsNull, EucDistance, Exp, 
 CellStatistics, NbrCircle, FocalStatistics, RemapRange, Reclassify,
 Float, SetNull)
@@ -31,6 +34,8 @@ class cheStandard:
     _input_data = "InputData.gdb"
     _anthro_data = "AnthroData.gdb"
     _layer_files = "LayerFiles"
+    _array_store = "ArrayStore"
+    _spatial_index = "SpatialIndex"
     _parameter_table = "ParameterValues"
     _grsg_ag_index = "GrSG_Ag_Index"
     _grsg_bw = "GrSG_BW"
@@ -62,9 +67,51 @@ class cheStandard:
     _grsg_seasons = ["Winter", "Breed", "Summer"]
     _mule_deer_seasons = ["Summer", "Migration", "Winter"]
 
-    def __init__(self, workspace, scriptPath):
+    # Maximum size of the raster windows held by the cache
+    _cache_bytes = 512 * 2 ** 20
+
+    # Derive the indirect impact and analysis areas from distance rasters
+    # on the Empty Raster grid instead of vector buffers (default of the
+    # distanceAreas argument)
+    _distance_areas = False
+
+    # Size of the tiles of the analysis grid skipped outside the Analysis
+    # Area
+    _tile_size = 256
+
+    # Products of standard rasters that do not depend on the project,
+    # composed once per Data Package by ExportArrayStore.py. Suitable
+    # habitat differs between tools and is applied per project.
+    _static_surfaces = OrderedDict([
+        ("GrSG_Anthro", ["AgricultureIndex", "Lakes"]),
+        ("GrSG_Winter", ["ConiferModifier", "GrSG_LDI"]),
+        ("GrSG_Breed", ["ConiferModifier", "GrSG_LDI",
+                        "LekDistanceModifier"]),
+        ("GrSG_Summer", ["ConiferModifier", "GrSG_LDI", "SageModifier"]),
+        ("MuleDeer_Summer", ["MuleDeerLDI", "MuleDeerSummerMod"]),
+        ("MuleDeer_Migration", ["MuleDeerLDI", "MuleDeerMigrationMod"]),
+        ("MuleDeer_Winter", ["MuleDeerLDI", "MuleDeerWinterMod"])
+        ])
+
+    def __init__(self, workspace, scriptPath, distanceAreas=None):
         self.workspace = workspace
+        if distanceAreas is not None:
+            self._distance_areas = distanceAreas
         self.toolSharePath = os.path.dirname(scriptPath)
+        self.cache = rasterlib.RasterCache(
+            self._cache_bytes, rasterlib.ArrayStore.open(self.ArrayStorePath)
+            )
+        self._coordinate_system = None
+        self.analysisGrid = None
+        self.analysisMask = None
+        self.analysisWindows = None
+        self.manifest = None
+        self._static_rasters = {}
+        self._environment = None
+
+    def _inputRaster(self, name):
+        # Open each standard raster once per tool run
+        return self.cache.raster(os.path.join(self.InputDataPath, name))
 
     # Getters for files and data directories
     @property
@@ -83,7 +130,15 @@ class cheStandard:
     def LayerFilePath(self):
         return os.path.join(self.toolSharePath, self._layer_files)
 
+    @property
+    def ArrayStorePath(self):
+        return os.path.join(self.ToolDataPath, self._array_store)
+
     # Getters for standard credit system values and objects
+    @property
+    def SpatialIndexPath(self):
+        return os.path.join(self.ToolDataPath, self._spatial_index)
+
     @property
     def CreditTerms(self):
         return self._credit_terms
@@ -102,11 +157,20 @@ class cheStandard:
 
     @property
     def CoorSystem(self):
-        inputDataPath = self.InputDataPath
-        reference_layer = os.path.join(inputDataPath,
-                                       self._coordinate_reference)
-        coordinate_system = arcpy.Describe(reference_layer).spatialReference
-        return coordinate_system
+        if self._coordinate_system is None and self.manifest is not None:
+            entry = self.manifest.datasets.get(
+                self._input_data + "/" + self._coordinate_reference)
+            if entry is not None and "spatial_reference" in entry:
+                self._coordinate_system = arcpy.SpatialReference()
+                self._coordinate_system.loadFromString(
+                    entry["spatial_reference"])
+        if self._coordinate_system is None:
+            inputDataPath = self.InputDataPath
+            reference_layer = os.path.join(inputDataPath,
+                                           self._coordinate_reference)
+            self._coordinate_system = arcpy.Describe(
+                reference_layer).spatialReference
+        return self._coordinate_system
 
     @property
     def HabitatMgmtArea(self):
@@ -135,25 +199,60 @@ class cheStandard:
                                       self._mule_deer_habitat_mgmt_area)
         return mule_deer_habitat
 
+    @property
+    def StaticSurfaces(self):
+        # Store names of the rasters multiplied into each static surface
+        return OrderedDict(
+            (name, [self._input_data + "/" + os.path.basename(
+                rasterlib.DatasetPath(getattr(self, source)))
+                    for source in sources])
+            for name, sources in self._static_surfaces.items()
+            )
+
     @property
     def ParameterValues(self):
         anthroFeaturePath = self.AnthroFeaturePath
         return os.path.join(anthroFeaturePath, self._parameter_table)
 
+    @property
+    def ParameterTable(self):
+        version = None
+        if self.manifest is not None:
+            entry = self.manifest.datasets.get(
+                self._anthro_data + "/" + self._parameter_table)
+            if entry is not None and \
+                    self._anthro_data not in self.manifest.changed:
+                version = entry["hash"]
+        return hqtlib.ParameterTable.get(self.ParameterValues, version)
+
+    @property
+    def CellSize(self):
+        if self.manifest is not None:
+            entry = self.manifest.datasets.get(
+                self._input_data + "/" + self._extent_raster)
+            if entry is not None:
+                return entry["grid"][2]
+        return float(arcpy.GetRasterProperties_management(
+            self.EmptyRaster, "CELLSIZEX").getOutput(0))
+
+    @property
+    def DistanceAreaCellSize(self):
+        # Cell size for hqtlib.DistanceArea, or None to buffer vectors
+        if self._distance_areas:
+            return self.CellSize
+        return None
+
     @property
     def EmptyRaster(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._extent_raster))
+        return self._inputRaster(self._extent_raster)
 
     @property
     def AgricultureIndex(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._grsg_ag_index))
+        return self._inputRaster(self._grsg_ag_index)
 
     @property
     def Lakes(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._lakes))
+        return self._inputRaster(self._lakes)
 
     # @property
     # def UrbanIndex(self):
@@ -162,73 +261,59 @@ class cheStandard:
 
     @property
     def LekPresenceRaster(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._lek_presence_raster))
+        return self._inputRaster(self._lek_presence_raster)
 
     @property
     def LekDistanceModifier(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._lek_distance_modifier))
+        return self._inputRaster(self._lek_distance_modifier)
 
     @property
     def ConiferModifier(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._grsg_conifer_modifier))
+        return self._inputRaster(self._grsg_conifer_modifier)
 
     @property
     def GrSG_LDI(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._grsg_ldi))
+        return self._inputRaster(self._grsg_ldi)
 
     @property
     def SageModifier(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._lek_distance_modifier))
+        return self._inputRaster(self._lek_distance_modifier)
 
     @property
     def Precip(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._precip))
+        return self._inputRaster(self._precip)
 
     @property
     def ConiferCover(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._conifer_cover))
+        return self._inputRaster(self._conifer_cover)
 
     @property
     def BWSGHab(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._grsg_bw))
+        return self._inputRaster(self._grsg_bw)
 
     @property
     def BWMDHab(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._mule_deer_bw))
+        return self._inputRaster(self._mule_deer_bw)
 
     @property
     def MuleDeerMigrationMod(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._mule_deer_mig_mod))
+        return self._inputRaster(self._mule_deer_mig_mod)
 
     @property
     def MuleDeerWinterMod(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._mule_deer_winter_mod))
+        return self._inputRaster(self._mule_deer_winter_mod)
 
     @property
     def MuleDeerSummerMod(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._mule_deer_summer_mod))
+        return self._inputRaster(self._mule_deer_summer_mod)
 
     @property
     def MuleDeerLDI(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._mule_deer_ldi))
+        return self._inputRaster(self._mule_deer_ldi)
 
     @property
     def BWMD_Open(self):
-        inputDataPath = self.InputDataPath
-        return Raster(os.path.join(inputDataPath, self._mule_deer_open))
+        return self._inputRaster(self._mule_deer_open)
 
     # Instance methods
     def getLayerFile(self, layer_name):
@@ -236,6 +321,219 @@ class cheStandard:
         layer_file = os.path.join(layerFilePath, layer_name)
         return layer_file
 
+    def checkDataPackage(self):
+        """
+        Checks the Data Package against its manifest (see
+        hqtlib.DataPackageManifest) by file signatures only, and warns about
+        datasets that no longer match it. Dataset hashes are then used as
+        cache keys. The manifest is created by updateDataPackage.
+        :return: a list of the modified, missing or new datasets and changed
+        geodatabases
+        """
+        manifest = hqtlib.DataPackageManifest.load(self.ToolDataPath)
+        if manifest is None:
+            arcpy.AddWarning("WARNING:: The Data Package has no manifest. "
+                             "Run Export Array Store to create it.")
+            return []
+        modified = manifest.validate()
+        if modified:
+            arcpy.AddWarning("WARNING:: The following datasets do not match "
+                             "version " + manifest.version + " of the Data "
+                             "Package and may be partially updated: "
+                             + ", ".join(modified))
+        self.manifest = manifest
+        self.cache.keys = manifest.hashes()
+        return modified
+
+    def updateDataPackage(self):
+        """
+        Creates the Data Package manifest, or hashes the datasets of the
+        geodatabases that have changed since it was saved. This reads every
+        changed dataset and is meant to be run once per Data Package release
+        (see ExportArrayStore.py), not by the tools.
+        :return: a list of the modified, missing or new datasets
+        """
+        manifest = hqtlib.DataPackageManifest.load(self.ToolDataPath)
+        if manifest is None:
+            arcpy.AddMessage("Creating Data Package manifest")
+            manifest = hqtlib.DataPackageManifest.create(
+                self.ToolDataPath, [self._input_data, self._anthro_data]
+                )
+        modified = manifest.validate(rehash=True)
+        if modified:
+            arcpy.AddWarning("WARNING:: The following datasets do not match "
+                             "version " + manifest.version + " of the Data "
+                             "Package: " + ", ".join(modified))
+        self.manifest = manifest
+        self.cache.keys = manifest.hashes()
+        return modified
+
+    def setAnalysisArea(self, analysisArea, cellSize=None):
+        """
+        Sets the grid used for analysis arrays to the extent of the Analysis
+        Area, snapped to the Empty Raster, and snaps geoprocessing outputs to
+        the same grid. Cells of the grid outside the Analysis Area polygon
+        are masked: analysis arrays are only read for the tiles the polygon
+        covers, and saved analysis arrays are NoData there. Geoprocessing
+        inputs are not masked, so that, e.g., EucDistance still sees features
+        outside the polygon. The snapRaster, cellSize and
+        outputCoordinateSystem environments keep these values for the rest of
+        the tool run, until restoreEnvironment is called.
+        :param analysisArea: the Analysis Area feature class
+        :param cellSize: the cell size of the grid, optional; defaults to
+        the cell size of the Empty Raster
+        :return: the analysis Grid
+        """
+        emptyGrid = rasterlib.Grid.fromRaster(self.EmptyRaster)
+        extent = arcpy.Describe(analysisArea).extent
+        if cellSize is not None:
+            cellSize = float(cellSize)
+        self.analysisGrid = emptyGrid.snapExtent(extent.XMin, extent.YMin,
+                                                 extent.XMax, extent.YMax,
+                                                 cellSize)
+
+        # Keep geoprocessing outputs (Con, EucDistance, etc.) on the same
+        # grid so that they can be read without resampling, saving the
+        # environments set by the caller
+        if self._environment is None:
+            self._environment = dict(
+                (name, getattr(arcpy.env, name))
+                for name in ("snapRaster", "cellSize",
+                             "outputCoordinateSystem")
+                )
+        arcpy.env.snapRaster = self.EmptyRaster
+        arcpy.env.cellSize = self.analysisGrid.cellSize
+        if self.analysisGrid.spatialReference is not None:
+            arcpy.env.outputCoordinateSystem = \
+                self.analysisGrid.spatialReference
+
+        # Rasterize the Analysis Area (cells it touches) rather than
+        # processing its whole bounding rectangle
+        polygons = rasterlib.ReadPolygons(analysisArea)
+        self.analysisMask = rasterlib.RasterizeFractions(
+            polygons, self.analysisGrid) > 0
+        self.analysisWindows = rasterlib.TileWindows(self.analysisMask,
+                                                     self._tile_size)
+        return self.analysisGrid
+
+    def restoreEnvironment(self):
+        """
+        Restores the environments changed by setAnalysisArea to the values
+        they had before it was first called.
+        :return: None
+        """
+        if self._environment is None:
+            return
+        for name, value in self._environment.items():
+            setattr(arcpy.env, name, value)
+        self._environment = None
+
+    def getAnalysisArray(self, raster, nodata=np.nan):
+        """
+        Reads a raster within the analysis grid (see setAnalysisArea).
+        Only the tiles covered by the Analysis Area are read; other tiles
+        are NoData. Standard rasters are read once per run through the
+        cache; rasters created by the tool are read each time.
+        :param raster: a raster dataset, basename or Raster object, or an
+        array already on the analysis grid
+        :param nodata: the value assigned to NoData cells
+        :return: a 2D numpy array with the shape of the analysis grid
+        """
+        if isinstance(raster, np.ndarray):
+            return raster
+        path = rasterlib.DatasetPath(raster)
+        if path.startswith(self.ToolDataPath):
+            def read(window):
+                return self.cache.read(raster, self.analysisGrid, window,
+                                       nodata)
+        else:
+            def read(window):
+                return rasterlib.ReadRasterWindow(raster, self.analysisGrid,
+                                                  window, nodata)
+        if self.analysisWindows is None:
+            return read(None)
+
+        array = None
+        for window in self.analysisWindows:
+            block = read(window)
+            if array is None:
+                array = np.full(self.analysisGrid.Shape, nodata,
+                                dtype=block.dtype)
+            array[window.row:window.row + window.n_rows,
+                  window.col:window.col + window.n_cols] = block
+        if array is None:
+            array = np.full(self.analysisGrid.Shape, nodata)
+        return array
+
+    def getStaticArray(self, name):
+        """
+        Reads a static surface (see StaticSurfaces) within the analysis
+        grid from the array store, or multiplies its rasters if the store
+        does not hold a current copy.
+        :param name: the name of the static surface (e.g., "GrSG_Winter")
+        :return: a 2D numpy array with the shape of the analysis grid
+        """
+        array = self.cache.readStatic(name, self.analysisGrid)
+        if array is None:
+            sources = self._static_surfaces[name]
+            array = self.getAnalysisArray(getattr(self, sources[0]))
+            for source in sources[1:]:
+                array = array * self.getAnalysisArray(getattr(self, source))
+        return array
+
+    def getStaticRaster(self, name):
+        """
+        Saves a static surface within the analysis grid to the workspace,
+        once per run, for use in map algebra.
+        :param name: the name of the static surface (e.g., "GrSG_Anthro")
+        :return: a Raster object, or None if the array store does not hold
+        a current copy of the static surface
+        """
+        if name not in self._static_rasters:
+            if self.analysisGrid is None:
+                return None
+            array = self.cache.readStatic(name, self.analysisGrid)
+            if array is None:
+                return None
+            outRaster = os.path.join(self.workspace, "Static_" + name)
+            self._static_rasters[name] = self.saveAnalysisArray(array,
+                                                                outRaster)
+        return Raster(self._static_rasters[name])
+
+    def prefetchAnalysisArrays(self, rasters, static=()):
+        """
+        Starts reading standard rasters within the analysis grid in the
+        background (see rasterlib.RasterCache.prefetch), so that the inputs
+        of the next stage of a tool are loaded while the current one runs.
+        :param rasters: a list of standard rasters, as returned by the
+        cheStandard properties
+        :param static: a list of static surface names, optional; the
+        rasters of surfaces not current in the array store are read instead
+        :return: None
+        """
+        rasters = list(rasters)
+        current = []
+        for name in static:
+            if self.cache.staticName(name, self.analysisGrid) is None:
+                rasters.extend(getattr(self, source)
+                               for source in self._static_surfaces[name])
+            else:
+                current.append(name)
+        self.cache.prefetch(rasters, self.analysisGrid, static=current)
+
+    def saveAnalysisArray(self, array, outRaster):
+        """
+        Saves an array on the analysis grid as a raster dataset. Float cells
+        outside the Analysis Area polygon are saved as NoData.
+        :param array: a 2D numpy array with the shape of the analysis grid
+        :param outRaster: the name or path of the output raster dataset
+        :return: the name or path of the output raster dataset
+        """
+        if self.analysisMask is not None and array.dtype.kind == "f":
+            array = np.where(self.analysisMask, array, np.nan)
+        return rasterlib.SaveArray(array, self.analysisGrid, outRaster,
+                                   spatial_reference=self.CoorSystem)
+
 
 # ----------------------------------------------------------------------------
 
@@ -256,7 +554,7 @@ def DetectHabitat(project_area, habitat_range):
 def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
                              anthro_disturbance_type, cheStandard,
                              dist_field, weight_field, cellSize, emptyRaster,
-                             mask = None):
+                             mask = None, fractional = False):
     """
     Calculates the anthropogenic disturbance associated with all subtypes of
     disturbance present within the Analysis Area, selects the maximum impact
@@ -267,56 +565,35 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
     :param Anthro_Features: feature class with anthropogenic features
     :param raster_100: raster of value 100
     :param Analysis_Area: Analysis Area feature class
-    :param Parameter_Values: the Parameter Values table
+    :param Parameter_Values: the Parameter Values table or a
+    hqtlib.ParameterTable
     :param term: string corresponding to term
     :param field: field name where Subtype is stored as a string
+    :param fractional: True if proposed feature rasters were converted with
+    fractional coverage (see convertProposedToRasterDebit), to scale effects
+    within partially covered cells by their '_Coverage' rasters
     :return: the name of the resulting anthropogenic disturbance raster as
     a string
     """
-    # Extract lists of Types, Subtypes, Distances, and Weights
-    typeList = [row[0] for row in arcpy.da.SearchCursor(
-        Parameter_Values, "Type")]
-    subtypeList = [row[0] for row in arcpy.da.SearchCursor(
-        Parameter_Values, "Subtype")]
-    distanceList = [row[0] for row in arcpy.da.SearchCursor(
-        Parameter_Values, dist_field)]
-    weightList = [row[0] for row in arcpy.da.SearchCursor(
-        Parameter_Values, weight_field)]
-
     # Create dictionaries for weights and distances by subtype
-    distanceDict = dict(list(zip(subtypeList, distanceList)))
-    weightDict = dict(list(zip(subtypeList, weightList)))
+    parameterTable = hqtlib.ParameterTable.get(Parameter_Values)
+    distanceDict = parameterTable.lookup(dist_field)
+    weightDict = parameterTable.lookup(weight_field)
 
     # Identify raster that will be used as the snap raster
     arcpy.env.snapRaster = emptyRaster
 
-    def makeUnique(typeList):
-        """Uniquify the anthropogenic feature types"""
-        uniqueTypes = []
-        for anthroType in typeList:
-            if anthroType not in uniqueTypes:
-                if anthroType != "N/A":
-                    uniqueTypes.append(anthroType)
-        return uniqueTypes
-
-    def getUniqueSubtypes(uniqueType, typeList, subtypeList):
-        """get unique subtypes associated with each type"""
-        uniqueSubtypeList = []
-        i = 0
-        for t in typeList:
-            if t == uniqueType:
-                subtypeIndex = i
-                subtype = subtypeList[subtypeIndex]
-                uniqueSubtypeList.append(subtype)
-            i += 1
-        return uniqueSubtypeList
-
-    def calcSubtypeDisturbance(AnthroFeatures, subtype, AnthroDisturbanceType):
+    def calcSubtypeDisturbance(AnthroFeatures, subtype, AnthroDisturbanceType,
+                               coverage=None):
         """calculate disturbance associated with each subtype"""
         distance = distanceDict[subtype]
         weight = weightDict[subtype]
 
         AnthroFeatures = Raster(AnthroFeatures)
+        if coverage is not None:
+            # Fraction of each feature cell covered, 1 outside the coverage
+            # raster (e.g., current features)
+            coverage = Con(IsNull(Raster(coverage)), 1, Raster(coverage))
 
         if distance > 0:
             arcpy.AddMessage("  Calculating direct and indirect effects of "
@@ -325,6 +602,10 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
             tmp1 = 100 - (1/(1 + Exp(((outEucDist / (distance/2))-1)*5))) * weight  # sigmoidal
             # tmp1 = (100 - (weight * Power((1 - outEucDist/distance), 2)))  # exponential
             # tmp1 = 100 - (weight - (outEucDist / distance) * weight)  # linear
+            if coverage is not None:
+                # Scale the effect within cells partially covered by features
+                tmp1 = Con(IsNull(AnthroFeatures), tmp1,
+                           100 - (100 - tmp1) * coverage)
             tmp2 = Con(IsNull(tmp1), 100, tmp1)
             subtypeRaster = tmp2
             subtypeRaster.save(AnthroDisturbanceType + "_" + subtype
@@ -333,6 +614,8 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
             arcpy.AddMessage("  Calculating direct effects of "
                              + str(subtype))
             tmp3 = Con(IsNull(AnthroFeatures), 0, AnthroFeatures)
+            if coverage is not None:
+                tmp3 = tmp3 * coverage
             subtypeRaster = 100 - (tmp3 * weight)
             subtypeRaster.save(AnthroDisturbanceType + "_" + subtype
                                + "_Subtype_Disturbance")
@@ -361,7 +644,11 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
 
         if AnthroDisturbanceType == "Pre" or AnthroDisturbanceType == "Post":
             if dist_field == "GrSG_Dist":  # better way of distinguishing if ag index needed
-                rasterList2 = rasterList + [Agriculture_Index, Lakes]
+                staticRaster = cheStandard.getStaticRaster("GrSG_Anthro")
+                if staticRaster is not None:
+                    rasterList2 = rasterList + [staticRaster]
+                else:
+                    rasterList2 = rasterList + [Agriculture_Index, Lakes]
             else:
                 rasterList2 = rasterList + [Lakes]
             anthroRaster = np.prod(np.array(rasterList2))
@@ -373,13 +660,13 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
 
     # Function calls
     anthro_path = cheStandard.AnthroFeaturePath
-    uniqueTypes = makeUnique(typeList)
+    uniqueTypes = parameterTable.Types
     rasterList = []
     # features = arcpy.MakeFeatureLayer_management(Anthro_Features, "lyr")
     for anthroType in uniqueTypes:
         arcpy.AddMessage(" Evaluating " + term + " "
                          + anthroType + " Indirect Disturbance")
-        uniqueSubtypeList = getUniqueSubtypes(anthroType, typeList, subtypeList)
+        uniqueSubtypeList = parameterTable.typeSubtypes[anthroType]
         subtypeRasters = []
         for subtype in uniqueSubtypeList:
             # where_clause = """{} = '{}'""".format(
@@ -420,6 +707,7 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
             # 'post', or 'LekDisturbanceModifier')
 
             # For calculating pre-project anthro disturbance
+            coverage = None
             if anthro_disturbance_type == "Pre":
                 AnthroFeatures = os.path.join(anthro_path, subtype)
 
@@ -427,6 +715,7 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
             elif anthro_disturbance_type == "Post":
                 if subtype in unique_proposed_subtypes:
                     AnthroFeatures = "Post_" + subtype
+                    coverage = "Post_" + subtype + "_Coverage"
                 else:
                     AnthroFeatures = os.path.join(anthro_path, subtype)
 
@@ -434,9 +723,15 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
             elif anthro_disturbance_type == "LekDisturbanceModifier":
                 if subtype in unique_proposed_subtypes:
                     AnthroFeatures = "Proposed_" + subtype
+                    coverage = "Proposed_" + subtype + "_Coverage"
                 else:
                     AnthroFeatures = None
 
+            # Partial coverage is only recorded for proposed features
+            if not fractional or (coverage is not None and
+                                  not arcpy.Exists(coverage)):
+                coverage = None
+
             # For each subtype, calculate subtype raster
             if AnthroFeatures is not None:
                 # Mask out anthro features if specified
@@ -451,13 +746,13 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
                         )
                         subtypeRaster = calcSubtypeDisturbance("temp_masked_raster",
                                                                subtype,
-                                                               term)
+                                                               term, coverage)
                     except arcpy.ExecuteError:
                         subtypeRaster = None
                 else:
                     subtypeRaster = calcSubtypeDisturbance(AnthroFeatures,
                                                            subtype,
-                                                           term)
+                                                           term, coverage)
                 if subtypeRaster is not None:
                     subtypeRasters.append(subtypeRaster)
 
@@ -477,6 +772,86 @@ def CalcAnthroDisturbance(Parameter_Values, term, unique_proposed_subtypes,
     return anthroRaster
 
 
+def calcSeasonalHabitat(anthroRaster, staticSurface, SuitableHabitat=None):
+    """multiply anthropogenic disturbance by the static surface of a
+    season, i.e., the product of its project-independent modifiers (see
+    cheStandard.getStaticArray)"""
+    seasonalHabitat = anthroRaster * staticSurface
+
+    if SuitableHabitat is not None:
+        seasonalHabitat = seasonalHabitat * SuitableHabitat
+
+    return seasonalHabitat
+
+
+def getActiveCells(habitat, lekPresence=None, inputs=()):
+    """
+    Returns the cells where seasonal habitat has to be calculated. Cells
+    without suitable habitat (0) or a lek are 0 in every seasonal habitat
+    array, and cells without habitat data (e.g., outside the program scope)
+    are NoData, so these are filled rather than calculated.
+    :param habitat: the suitable habitat array
+    :param lekPresence: the lek presence array, optional
+    :param inputs: a list of the other arrays multiplied by habitat (e.g.,
+    anthropogenic disturbance and static surfaces); cells where any of them
+    is NoData are calculated
+    :return: a rasterlib.ActiveCells
+    """
+    finite = np.ones(habitat.shape, dtype=bool)
+    for array in inputs:
+        finite &= np.isfinite(array)
+    if lekPresence is None:
+        noLek = np.ones(habitat.shape, dtype=bool)
+        noLekData = noLek
+    else:
+        noLek = lekPresence == 0
+        noLekData = noLek | np.isnan(lekPresence)
+    zero = (habitat == 0) & noLek & finite
+    nodata = np.isnan(habitat) & noLekData
+    fill = np.where(nodata, np.nan, 0.0)
+    return rasterlib.ActiveCells(~(zero | nodata), fill)
+
+
+def calcSeasonalHabitatArrays(anthroArray, staticArrays, habitatArray,
+                              lekPresenceArray=None, lekModifierArray=None):
+    """
+    Calculates seasonal habitat arrays as anthropogenic disturbance x
+    static surface x suitable habitat, with the lek adjustments if lek
+    presence is provided, on the active cells only (see getActiveCells).
+    :param anthroArray: the anthropogenic disturbance array
+    :param staticArrays: a list of static surface arrays, one per season
+    :param habitatArray: the suitable habitat array
+    :param lekPresenceArray: the lek presence array, optional
+    :param lekModifierArray: the lek disturbance or uplift modifier array
+    for post-project habitat; pre-project habitat is calculated if None
+    :return: a list of seasonal habitat arrays on the full grid
+    """
+    activeCells = getActiveCells(habitatArray, lekPresenceArray,
+                                 [anthroArray] + list(staticArrays))
+    anthro = activeCells.gather(anthroArray)
+    habitat = activeCells.gather(habitatArray)
+    if lekPresenceArray is not None:
+        lekPresence = activeCells.gather(lekPresenceArray)
+    if lekModifierArray is not None:
+        lekModifier = activeCells.gather(lekModifierArray)
+
+    seasonalHabitatArrays = []
+    for staticArray in staticArrays:
+        seasonalHabitat = calcSeasonalHabitat(
+            anthro, activeCells.gather(staticArray), habitat
+            )
+        if lekPresenceArray is not None and lekModifierArray is None:
+            seasonalHabitat = applyLekUpliftModifierPre(seasonalHabitat,
+                                                        lekPresence)
+        elif lekPresenceArray is not None:
+            seasonalHabitat = applyLekUpliftModifierPost(seasonalHabitat,
+                                                         lekPresence,
+                                                         lekModifier)
+        seasonalHabitatArrays.append(activeCells.scatter(seasonalHabitat))
+
+    return seasonalHabitatArrays
+
+
 def calcWinterHabitatGRSG (anthroRaster, ConiferModifier, LDI, 
                            SuitableHabitat=None):
     
@@ -554,6 +929,10 @@ def calcWinterHabitatMD(anthroRaster, LDI, WinterModifier,
 def applyLekUpliftModifierPre(preSeasonalHabitat, LekPresenceRaster):
     """make the habitat quality of the pre seasonal habtiat raster equal to 1
     wherever the Lek Presence Raster is also 1, ie a lek is present"""
+    if isinstance(preSeasonalHabitat, np.ndarray):
+        return np.where(LekPresenceRaster == 0, preSeasonalHabitat,
+                        LekPresenceRaster)
+
     inRaster = LekPresenceRaster
     inTrueRaster = preSeasonalHabitat
     inFalseConstant = LekPresenceRaster
@@ -568,6 +947,12 @@ def applyLekUpliftModifierPost(postSeasonalHabitat, LekPresenceRaster,
     """make the habitat quality of the post seasonal habitat raster equal
     to the lek disturbance/uplift modifier wherever the Lek Presence Raster
     is 1, ie a lek is present"""
+    if isinstance(postSeasonalHabitat, np.ndarray):
+        LekDisturbanceModifier = np.where(np.isnan(LekPresenceRaster),
+                                          np.nan, LekDisturbanceModifier)
+        return np.where(LekPresenceRaster == 0, postSeasonalHabitat,
+                        LekDisturbanceModifier)
+
     inRaster = LekPresenceRaster
     inTrueRaster = postSeasonalHabitat
     inFalseConstant = LekDisturbanceModifier
@@ -579,29 +964,19 @@ def applyLekUpliftModifierPost(postSeasonalHabitat, LekPresenceRaster,
 
 def calcConiferPost(coniferTreatmentArea, Conifer_Cover):
     arcpy.AddMessage("Calculating post-project conifer modifier")
-    # Add field Conifer to use when converting to raster
-    inTable = coniferTreatmentArea
-    fieldName = "Conifer"
-    fieldType = "SHORT"
-    expression = 0
-    arcpy.AddField_management(inTable, fieldName, fieldType)
-    arcpy.CalculateField_management(inTable, fieldName, expression,
-                                    "PYTHON_9.3", "")
-
-    # Convert to raster
+    # Convert to raster (all treated cells have a conifer cover of 0)
     in_features = coniferTreatmentArea
-    value_field = "Conifer"
     out_rasterdataset = "Proposed_Conifer_Cover"
-    cell_assignment = "MAXIMUM_AREA"
-    priority_field = "Conifer"
     cellSize = 30
 
-    coniferRaster = arcpy.PolygonToRaster_conversion(in_features,
-                                                     value_field,
-                                                     out_rasterdataset,
-                                                     cell_assignment,
-                                                     priority_field,
-                                                     cellSize)
+    grid = rasterlib.FeatureGrid(in_features, Conifer_Cover, cellSize)
+    polygons = rasterlib.ReadPolygons(in_features, value=0,
+                                      densify_distance=cellSize)
+    coniferArray = rasterlib.RasterizePolygons(polygons, grid)
+    rasterlib.SaveArray(coniferArray, grid, out_rasterdataset,
+                        spatial_reference=arcpy.Describe(
+                            in_features).spatialReference)
+    coniferRaster = Raster(out_rasterdataset)
 
     # Mask existing conifer cover
     coniferPost = Con(IsNull(coniferRaster), Conifer_Cover, coniferRaster)
@@ -640,42 +1015,112 @@ def calcUplift(preModifier, postModifier):
     return uplift
 
 
-def convertMapUnitsToRaster(projectGDB, mapUnits, season, cellSize):
-    # Select features of specified subtype
-    util.ClearSelectedFeatures(mapUnits)
-    feature = arcpy.MakeFeatureLayer_management(mapUnits, "lyr")
-    fields = ["Winter", "Breed", "Summer"]
-    for field in fields:
-        where_clause = "NOT {0} IS NULL".format(
-                    arcpy.AddFieldDelimiters(feature, field)
-                    )
-        arcpy.SelectLayerByAttribute_management(feature,
-                                                "ADD_TO_SELECTION",
-                                                where_clause)
-        
-    # Count features selected to ensure >0 feature selected
-    test = arcpy.GetCount_management(mapUnits)
-    count = int(test.getOutput(0))    
-
-    # Convert to raster
-    if count > 0:
-        in_features = mapUnits
-        value_field = season
+def convertMapUnitsToRaster(projectGDB, mapUnits, seasons, cellSize,
+                            emptyRaster=None):
+    # Read map units with the values of all seasons in a single pass
+    polygons = rasterlib.ReadPolygonBands(mapUnits, seasons, seasons,
+                                          densify_distance=float(cellSize))
+
+    # Convert to a raster band per season
+    grid = rasterlib.FeatureGrid(mapUnits, emptyRaster, float(cellSize))
+    seasonBands = rasterlib.RasterizePolygonBands(polygons, grid)
+    spatialReference = arcpy.Describe(mapUnits).spatialReference
+    for season, seasonArray in zip(seasons, seasonBands):
         out_rasterdataset = os.path.join(
             projectGDB, season + "_Site_Quality")
-        cell_assignment = "MAXIMUM_AREA"
-        priority_field = season
-        
-        arcpy.PolygonToRaster_conversion(in_features,
-                                         value_field,
-                                         out_rasterdataset,
-                                         cell_assignment,
-                                         priority_field,
-                                         cellSize)
-        return out_rasterdataset
-        
-        
-def convertProposedToRasterCredit(anthroFeaturesRemoved, cellSize):
+        rasterlib.SaveArray(seasonArray, grid, out_rasterdataset,
+                            spatial_reference=spatialReference)
+
+    return grid, seasonBands
+
+
+def rasterizeProposedSubtypes(proposedFeatures, cellSize, emptyRaster, nodata,
+                              parameterValues, fractional=False):
+    # Identify the output grid, aligned to the Empty Raster
+    grid = rasterlib.FeatureGrid(proposedFeatures, emptyRaster,
+                                 float(cellSize))
+
+    # Check feature type of provided feature class
+    desc = arcpy.Describe(proposedFeatures)
+
+    # Group features by subtype in a single pass, with the Weight of their
+    # subtype in the Parameter Values table as value and priority
+    parameterTable = hqtlib.ParameterTable.get(parameterValues)
+    weights = parameterTable.lookup("Weight")
+    groups = rasterlib.ReadFeatureGroups(proposedFeatures, "Subtype",
+                                         densify_distance=grid.cellSize)
+    for subtype, features in groups.items():
+        weight = weights.get(subtype)
+        groups[subtype] = [(coordinates, weight, weight)
+                           for coordinates, _, _ in features
+                           if weight is not None]
+
+    # Rasterize all subtypes in a single sweep. If fractional, every cell a
+    # feature touches is assigned and the fraction of each cell covered is
+    # recorded apart from the Weight, so features smaller than a cell are
+    # not lost
+    if desc.shapeType == "Polygon":
+        proposedRasters = rasterlib.RasterizePolygonGroups(
+            groups, grid, nodata=nodata, fractional=fractional
+            )
+    else:
+        # Burn lines and points buffered by the Buffer distance of their
+        # subtype in the Parameter Values table
+        bufferDict = parameterTable.lookup("Buffer")
+        proposedRasters = rasterlib.RasterizeLineGroups(
+            groups, bufferDict, grid, nodata=nodata, fractional=fractional
+            )
+
+    # Keep only the cells covered by each subtype, as proposed features
+    # cover a small part of the analysis area
+    coverageRasters = OrderedDict()
+    for subtype, stacked in proposedRasters.items():
+        window, proposedArray = stacked[:2]
+        if fractional:
+            covered = stacked[2] > 0
+            proposedRasters[subtype] = rasterlib.SparseRaster.fromArray(
+                proposedArray, grid, window, mask=covered
+                )
+            coverageRasters[subtype] = rasterlib.SparseRaster.fromArray(
+                stacked[2] / np.float32(255), grid, window, mask=covered
+                )
+        else:
+            proposedRasters[subtype] = rasterlib.SparseRaster.fromArray(
+                proposedArray, grid, window, nodata
+                )
+
+    return grid, proposedRasters, coverageRasters
+
+
+def saveCoverageRasters(coverageRasters, prefix, spatialReference):
+    """
+    Saves the fraction of each cell covered by the features of each subtype
+    (see rasterizeProposedSubtypes), NoData outside the features, as
+    '<prefix>_<subtype>_Coverage'.
+    :param coverageRasters: a dictionary of subtypes mapped to SparseRasters
+    :param prefix: "Proposed" or "Post"
+    :param spatialReference: the spatial reference of the rasters
+    :return: None
+    """
+    for subtype, coverageRaster in coverageRasters.items():
+        coverageRaster.save(prefix + "_" + subtype + "_Coverage", np.nan,
+                            spatialReference)
+
+
+def readCoverageRaster(prefix, subtype, grid, tileSize):
+    """
+    Reads a raster saved by saveCoverageRasters as a SparseRaster.
+    :return: a SparseRaster, or None if the raster does not exist
+    """
+    coverageRaster = prefix + "_" + subtype + "_Coverage"
+    if not arcpy.Exists(coverageRaster):
+        return None
+    return rasterlib.SparseRaster.fromRaster(coverageRaster, grid, tileSize)
+
+
+def convertProposedToRasterCredit(anthroFeaturesRemoved, cellSize,
+                                  parameterValues, emptyRaster=None,
+                                  fractional=False):
     arcpy.AddMessage("Preparing Proposed Surface Disturbance for processing")
     # Add field Conifer to use when converting to raster
     inTable = anthroFeaturesRemoved
@@ -685,131 +1130,102 @@ def convertProposedToRasterCredit(anthroFeaturesRemoved, cellSize):
     arcpy.AddField_management(inTable, fieldName, fieldType)
     arcpy.CalculateField_management(inTable, fieldName, expression, "PYTHON_9.3", "")
 
-    # Check feature type of provided feature class
-    desc = arcpy.Describe(anthroFeaturesRemoved)
-
-    # Make feature layer of proposed surface disturbance
-    features = arcpy.MakeFeatureLayer_management(anthroFeaturesRemoved, "lyr")
-
-    # Generate list of unique subtypes in Proposed_Surface_Disturbance
-    uniqueProposedSubtypes = list(set([row[0] for row in arcpy.da.SearchCursor(
-        anthroFeaturesRemoved, "Subtype")]))
+    # Convert all subtypes to raster, with 0 in place of Null values in
+    # proposed anthro feature removed rasters
+    grid, proposedRasters, coverageRasters = rasterizeProposedSubtypes(
+        anthroFeaturesRemoved, cellSize, emptyRaster, 0, parameterValues,
+        fractional
+        )
+    uniqueProposedSubtypes = list(proposedRasters.keys())
     arcpy.AddMessage("Proposed Surface Disturbance contains "
                      + ", ".join(uniqueProposedSubtypes))
 
-    for subtype in uniqueProposedSubtypes:
-        # Select features of specified subtype
-        field = "Subtype"
-        where_clause = """{} = '{}'""".format(arcpy.AddFieldDelimiters
-                                              (features, field), subtype)
-
-        arcpy.SelectLayerByAttribute_management(features,
-                                                "NEW_SELECTION",
-                                                where_clause)
-
-        # Count features selected to ensure >0 feature selected
-        test = arcpy.GetCount_management(features)
-        count = int(test.getOutput(0))
-
-        # Convert to raster
-        if count > 0:
-            in_features = features
-            value_field = "Weight"
-            out_rasterdataset = os.path.join("in_memory", "Proposed_" + subtype + "Null")
-            cell_assignment = "MAXIMUM_AREA"
-            priority_field = "Weight"
-
-            if desc.shapeType == "Polygon":
-                arcpy.PolygonToRaster_conversion(in_features,
-                                                 value_field,
-                                                 out_rasterdataset,
-                                                 cell_assignment,
-                                                 priority_field,
-                                                 cellSize)
-            else:  # Consider changing to buffer of ? meters
-                arcpy.FeatureToRaster_conversion(in_features,
-                                                 value_field,
-                                                 out_rasterdataset,
-                                                 cellSize)
-
-            # Change Null values to 0 in proposed anthro feature removed raster
-            out_con = Con(IsNull(out_rasterdataset), 0, out_rasterdataset)
-            out_con.save("Proposed_" + subtype)
+    spatialReference = arcpy.Describe(anthroFeaturesRemoved).spatialReference
+    for subtype, proposedRaster in proposedRasters.items():
+        proposedRaster.save("Proposed_" + subtype, 0, spatialReference)
+    saveCoverageRasters(coverageRasters, "Proposed", spatialReference)
 
-        # Clear selected features
-        arcpy.SelectLayerByAttribute_management(features, "CLEAR_SELECTION")
-
-    return uniqueProposedSubtypes
+    return uniqueProposedSubtypes, proposedRasters
     # The returned set of uniqueProposedSutbypes is used in
     # combineProposedWithCurrent and calcAnthroDisturbance to
     # identify which subtypes are included in the post-project
     # surface disturbance
 
 
-def convertProposedToRasterDebit(ProposedSurfaceDisturbance, cellSize):
+def convertProposedToRasterDebit(ProposedSurfaceDisturbance, cellSize,
+                                 parameterValues, emptyRaster=None,
+                                 fractional=False):
     arcpy.AddMessage("Preparing Proposed Surface Disturbance for processing")
 
-    # Check feature type of provided feature class
-    desc = arcpy.Describe(ProposedSurfaceDisturbance)
-
-    # Make feature layer of proposed surface disturbance
-    features = arcpy.MakeFeatureLayer_management(ProposedSurfaceDisturbance, "lyr")
-
-    # Generate list of unique subtypes in Proposed_Surface_Disturbance
-    uniqueProposedSubtypes = list(set([row[0] for row in arcpy.da.SearchCursor(
-        ProposedSurfaceDisturbance, "Subtype")]))
+    # Convert all subtypes to raster
+    grid, proposedRasters, coverageRasters = rasterizeProposedSubtypes(
+        ProposedSurfaceDisturbance, cellSize, emptyRaster, np.nan,
+        parameterValues, fractional
+        )
+    uniqueProposedSubtypes = list(proposedRasters.keys())
     arcpy.AddMessage("Proposed Surface Disturbance contains "
                      + str(uniqueProposedSubtypes))
 
-    for subtype in uniqueProposedSubtypes:
-        # Select features of specified subtype
-        field = "Subtype"
-        where_clause = """{} = '{}'""".format(arcpy.AddFieldDelimiters
-                                              (features, field), subtype)
-
-        arcpy.SelectLayerByAttribute_management(features,
-                                                "NEW_SELECTION",
-                                                where_clause)
-
-        # Count features selected to ensure >0 feature selected
-        test = arcpy.GetCount_management(features)
-        count = int(test.getOutput(0))
-
-        # Convert to raster
-        if count > 0:
-            in_features = features
-            value_field = "Weight"
-            out_rasterdataset = os.path.join("Proposed_" + subtype)
-            cell_assignment = "MAXIMUM_AREA"
-            priority_field = "Weight"
-
-            if desc.shapeType == "Polygon":
-                arcpy.PolygonToRaster_conversion(in_features,
-                                                 value_field,
-                                                 out_rasterdataset,
-                                                 cell_assignment,
-                                                 priority_field,
-                                                 cellSize)
-            else:  # Consider changing to buffer of ? meters
-                arcpy.FeatureToRaster_conversion(in_features,
-                                                 value_field,
-                                                 out_rasterdataset,
-                                                 cellSize)
-
-        # Clear selected features
-        arcpy.SelectLayerByAttribute_management(features,
-                                                "CLEAR_SELECTION")
+    spatialReference = arcpy.Describe(
+        ProposedSurfaceDisturbance).spatialReference
+    for subtype, proposedRaster in proposedRasters.items():
+        proposedRaster.save("Proposed_" + subtype, np.nan, spatialReference)
+    saveCoverageRasters(coverageRasters, "Proposed", spatialReference)
 
-    return uniqueProposedSubtypes
+    return uniqueProposedSubtypes, proposedRasters
     # The returned set of uniqueProposedSutbypes is used in
     # combineProposedWithCurrent and calcAnthroDisturbanceto
     # identify which subtypes are included in the proposed
     # surface disturbance
 
 
-def combineProposedWithCurrentCredit(anthroPath, uniqueProposedSubtypes):
+def combineProposedWithCurrentCredit(anthroPath, uniqueProposedSubtypes,
+                                     proposedRasters=None, fractional=False):
     for subtype in uniqueProposedSubtypes:
         # Merge proposed and current feature rasters
+        if proposedRasters is not None:
+            # Remove the cells of removed features from the current anthro
+            # feature cells, without full-extent temporaries
+            proposedAnthroFeature = proposedRasters[subtype]
+            grid = proposedAnthroFeature.grid
+            tileSize = proposedAnthroFeature.tileSize
+            currentPath = os.path.join(anthroPath, subtype)
+            spatialReference = arcpy.Describe(currentPath).spatialReference
+            currentAnthroFeature = rasterlib.SparseRaster.fromRaster(
+                currentPath, grid, tileSize
+                )
+            removed = proposedAnthroFeature.filter(lambda values: values == 1)
+            removedCoverage = None
+            if fractional:
+                removedCoverage = readCoverageRaster("Proposed", subtype,
+                                                     grid, tileSize)
+            if removedCoverage is None:
+                postAnthroFeature = currentAnthroFeature.difference(removed)
+                postAnthroFeature.save("Post_" + subtype, np.nan,
+                                       spatialReference)
+                continue
+
+            # Keep the part of each current cell that was not removed, and
+            # drop the cells that were removed entirely
+            removedCoverage = removedCoverage.difference(
+                removedCoverage.difference(removed)
+                )
+            current = currentAnthroFeature.toArray()
+            remaining = np.where(np.isnan(current), np.nan,
+                                 1 - removedCoverage.toArray(fill=0))
+            remaining[remaining <= 0] = np.nan
+            current[np.isnan(remaining)] = np.nan
+            postAnthroFeature = rasterlib.SparseRaster.fromArray(
+                current, grid, tile_size=tileSize
+                )
+            postCoverage = rasterlib.SparseRaster.fromArray(
+                remaining, grid, tile_size=tileSize
+                )
+            postAnthroFeature.save("Post_" + subtype, np.nan,
+                                   spatialReference)
+            saveCoverageRasters({subtype: postCoverage}, "Post",
+                                spatialReference)
+            continue
         currentAnthroFeature = Raster(os.path.join(anthroPath, subtype))
         proposedAnthroFeature = Raster("Proposed_" + subtype)
         postAnthroFeature = SetNull(proposedAnthroFeature,
@@ -817,9 +1233,37 @@ def combineProposedWithCurrentCredit(anthroPath, uniqueProposedSubtypes):
         postAnthroFeature.save(os.path.join("Post_" + subtype))
 
 
-def combineProposedWithCurrentDebit(anthroPath, uniqueProposedSubtypes):
+def combineProposedWithCurrentDebit(anthroPath, uniqueProposedSubtypes,
+                                    proposedRasters=None, fractional=False):
     for subtype in uniqueProposedSubtypes:
         # Merge proposed and current feature rasters
+        if proposedRasters is not None:
+            # Add the cells of proposed features to the current anthro
+            # feature cells, without full-extent temporaries
+            proposedAnthroFeature = proposedRasters[subtype]
+            grid = proposedAnthroFeature.grid
+            tileSize = proposedAnthroFeature.tileSize
+            currentPath = os.path.join(anthroPath, subtype)
+            spatialReference = arcpy.Describe(currentPath).spatialReference
+            currentAnthroFeature = rasterlib.SparseRaster.fromRaster(
+                currentPath, grid, tileSize
+                )
+            postAnthroFeature = proposedAnthroFeature.union(
+                currentAnthroFeature
+                )
+            postAnthroFeature.save("Post_" + subtype, np.nan,
+                                   spatialReference)
+            if fractional:
+                # Current features cover their cells entirely
+                proposedCoverage = readCoverageRaster("Proposed", subtype,
+                                                      grid, tileSize)
+                if proposedCoverage is not None:
+                    currentCoverage = currentAnthroFeature.constant(1)
+                    saveCoverageRasters(
+                        {subtype: currentCoverage.union(proposedCoverage)},
+                        "Post", spatialReference
+                        )
+            continue
         currentAnthroFeature = Raster(os.path.join(anthroPath, subtype))
         proposedAnthroFeature = Raster("Proposed_" + subtype)
         postAnthroFeature = Con(IsNull(proposedAnthroFeature),
@@ -828,6 +1272,13 @@ def combineProposedWithCurrentDebit(anthroPath, uniqueProposedSubtypes):
 
 
 def calcAverageHabitatQuality(seasonalHabitatRasters):
+    if isinstance(seasonalHabitatRasters[0], np.ndarray):
+        # Mean of the seasons with data, as CellStatistics with DATA
+        stack = np.array(seasonalHabitatRasters, dtype=np.float64)
+        count = np.sum(~np.isnan(stack), axis=0)
+        total = np.nansum(stack, axis=0)
+        return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
     statisticsType = "MEAN"
     ignoreNoData = "DATA"
     averageRaster = CellStatistics(seasonalHabitatRasters, statisticsType,
@@ -835,27 +1286,6 @@ def calcAverageHabitatQuality(seasonalHabitatRasters):
     return averageRaster
 
 
-def calcDebits(DebitProjectArea, pre_field, post_field, out_field):
-    # Add field for debits
-    inTable = DebitProjectArea
-    fieldName = out_field
-    fieldType = "DOUBLE"
-
-    arcpy.AddField_management(inTable, fieldName, fieldType)
-
-    # Calculate debits
-    with arcpy.da.UpdateCursor(DebitProjectArea, ["Acres",
-                                                  pre_field,
-                                                  post_field,
-                                                  out_field]) as cursor:
-        for row in cursor:
-            row[3] = row[0] * (row[1] - row[2])
-            cursor.updateRow(row)
-            arcpy.AddMessage("Functional Acre difference from {} to {} is "
-                             "equal to {}".format(pre_field, post_field,
-                                                  row[3]))
-
-
 def calcImpact(finalPreCumulative, finalPostCumulative):
     debitImpact = finalPreCumulative - finalPostCumulative
     return debitImpact
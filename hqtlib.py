@@ -31,9 +31,15 @@ import arcpy
 import os
 import sys
 import random
+import hashlib
+import multiprocessing
+import json
+import time
 import numpy as np
-from arcpy.sa import Con, IsNull
+from collections import OrderedDict
+from arcpy.sa import Con, IsNull, EucDistance, SetNull
 import util
+import rasterlib
 
 
 # ----------------------------------------------------------------------------
@@ -188,61 +194,539 @@ def EliminateNonHabitat(Project_Area, out_name, habitat_bounds):
     return clipped_feature
 
 
-def CreateIndirectImpactArea(in_data, parameter_values, out_name):
+class ParameterTable(object):
+    """
+    The Parameter Values table, read once into an array per column, with the
+    subtypes of each type and the maximum of each distance column. Use
+    ParameterTable.get to share one instance per table and data package
+    version; functions that take the Parameter Values table accept either
+    its path or a ParameterTable.
+    """
+    _tables = {}
+
+    def __init__(self, path):
+        self.path = path
+        self.version = _workspaceVersion(path)
+        fields = [field for field in arcpy.ListFields(path)
+                  if field.type not in ("OID", "Geometry", "GlobalID")]
+        names = [field.name for field in fields]
+        rows = [row for row in arcpy.da.SearchCursor(path, names)]
+
+        # Numeric columns hold NaN for null values; text columns hold None
+        self.columns = OrderedDict()
+        for i, field in enumerate(fields):
+            values = [row[i] for row in rows]
+            if field.type in ("Double", "Single", "Integer", "SmallInteger",
+                              "BigInteger"):
+                self.columns[field.name] = np.array(
+                    [np.nan if value is None else value for value in values],
+                    dtype=np.float64)
+            else:
+                self.columns[field.name] = np.array(values, dtype=object)
+
+        # Subtypes of each type, in table order
+        self.typeSubtypes = OrderedDict()
+        for anthroType, subtype in zip(self.columns["Type"],
+                                       self.columns["Subtype"]):
+            self.typeSubtypes.setdefault(anthroType, []).append(subtype)
+
+        # Maximum of each distance column (e.g., Distance, GrSG_Dist)
+        self.maxDistances = {}
+        for name, column in self.columns.items():
+            if name.lower().endswith(("distance", "_dist")) and \
+                    column.dtype.kind == "f" and not np.isnan(column).all():
+                self.maxDistances[name] = float(np.nanmax(column))
+
+    @classmethod
+    def get(cls, parameter_values, version=None):
+        """
+        Returns the ParameterTable of the Parameter Values table, reading the
+        table only if it has not been read since the data package changed.
+        :param parameter_values: the path to the Parameter Values table or a
+        ParameterTable
+        :param version: the version of the table (e.g., its content hash in
+        the DataPackageManifest), optional; defaults to the time its
+        geodatabase was last modified
+        :return: a ParameterTable
+        """
+        if isinstance(parameter_values, cls):
+            return parameter_values
+        if version is None:
+            version = _workspaceVersion(parameter_values)
+        table = cls._tables.get(parameter_values)
+        if table is None or table.version != version:
+            table = cls(parameter_values)
+            table.version = version
+            cls._tables[parameter_values] = table
+        return table
+
+    @property
+    def Types(self):
+        """The anthropogenic feature types, excluding N/A"""
+        return [anthroType for anthroType in self.typeSubtypes
+                if anthroType != "N/A"]
+
+    @property
+    def Subtypes(self):
+        return list(self.columns["Subtype"])
+
+    def column(self, field):
+        """Returns the values of a field as an array, in table order"""
+        return self.columns[field]
+
+    def lookup(self, field):
+        """
+        Returns the values of a field by subtype.
+        :param field: the name of the field
+        :return: a dictionary of subtypes mapped to values; null numeric
+        values are None
+        """
+        values = self.columns[field]
+        if values.dtype.kind == "f":
+            values = [None if np.isnan(value) else float(value)
+                      for value in values]
+        return dict(zip(self.columns["Subtype"], values))
+
+    def maxDistance(self, field="Distance"):
+        """Returns the maximum value of a distance field"""
+        return self.maxDistances[field]
+
+
+def _workspaceVersion(path):
+    """
+    Returns the time the workspace (e.g., file geodatabase) of a dataset was
+    last modified, used as the version of the data within it. Lock files are
+    ignored, as the tools create them while reading the data.
+    """
+    workspace = os.path.dirname(path)
+    if not os.path.isdir(workspace):
+        return None
+    times = [os.path.getmtime(os.path.join(workspace, name))
+             for name in os.listdir(workspace) if not name.endswith(".lock")]
+    return max(times) if times else None
+
+
+class DataPackageManifest(object):
+    """
+    A record of the datasets in the Data Package geodatabases (grid, extent,
+    data type, spatial reference and content hash of each) and of the files
+    that hold them, saved as manifest.json in the ToolData folder. The
+    manifest is created and updated by a release step (ExportArrayStore.py),
+    which hashes every dataset. Tools only check the files quickly by size
+    and modification time (e.g., to detect a partially updated ToolData
+    folder) and never hash or write.
+    """
+    FILE_NAME = "manifest.json"
+
+    def __init__(self, tool_data_path, data):
+        self.toolDataPath = tool_data_path
+        self.data = data
+        # Geodatabases found changed by the last validate without rehashing
+        self.changed = []
+
+    @property
+    def version(self):
+        return self.data["version"]
+
+    @property
+    def datasets(self):
+        return self.data["datasets"]
+
+    @property
+    def modified(self):
+        """The datasets that no longer match the manifest"""
+        return self.data.get("modified", [])
+
+    @classmethod
+    def create(cls, tool_data_path, workspaces, version=None):
+        """
+        Describes and hashes every dataset in the provided geodatabases and
+        saves the manifest.
+        :param tool_data_path: the path to the ToolData folder
+        :param workspaces: a list of geodatabase names in the ToolData
+        folder, e.g., ["InputData.gdb", "AnthroData.gdb"]
+        :param version: the version of the Data Package, optional; defaults
+        to the date and time the manifest is created
+        :return: a DataPackageManifest
+        """
+        if version is None:
+            version = time.strftime("%Y-%m-%dT%H:%M:%S")
+        datasets = OrderedDict()
+        for workspace in workspaces:
+            datasets.update(_describeWorkspace(tool_data_path, workspace))
+        data = OrderedDict([
+            ("version", version),
+            ("workspaces", OrderedDict(
+                (workspace, _workspaceSignature(
+                    os.path.join(tool_data_path, workspace)))
+                for workspace in workspaces)),
+            ("datasets", datasets),
+            ("modified", [])
+            ])
+        manifest = cls(tool_data_path, data)
+        manifest.save()
+        return manifest
+
+    @classmethod
+    def load(cls, tool_data_path):
+        """
+        Loads the manifest of a ToolData folder.
+        :param tool_data_path: the path to the ToolData folder
+        :return: a DataPackageManifest, or None if there is no manifest
+        """
+        path = os.path.join(tool_data_path, cls.FILE_NAME)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return cls(tool_data_path, json.load(f,
+                                                 object_pairs_hook=OrderedDict))
+
+    def save(self):
+        """
+        Saves the manifest to the ToolData folder, warning instead of failing
+        if the folder cannot be written (e.g., a read-only network share).
+        :return: True if the manifest was saved
+        """
+        path = os.path.join(self.toolDataPath, self.FILE_NAME)
+        try:
+            with open(path, "w") as f:
+                json.dump(self.data, f, indent=2)
+        except (IOError, OSError) as e:
+            arcpy.AddWarning("WARNING:: The Data Package manifest could not "
+                             "be saved to " + path + ": " + str(e))
+            return False
+        return True
+
+    def changedWorkspaces(self):
+        """Returns the geodatabases whose files have changed since the
+        manifest was saved, by file size and modification time"""
+        return [workspace for workspace, signature
+                in self.data["workspaces"].items()
+                if _workspaceSignature(os.path.join(self.toolDataPath,
+                                                    workspace)) != signature]
+
+    def validate(self, rehash=False):
+        """
+        Checks the Data Package against the manifest by the size and
+        modification time of its files. Without rehash, geodatabases whose
+        files have changed are reported by name and their datasets have no
+        hash in hashes(), so that nothing cached from them is used.
+        With rehash (a release step), changed geodatabases are hashed again:
+        the entries of changed and new datasets are replaced by their current
+        description and missing datasets are removed, so that hashes()
+        follows the content, and the manifest is saved. Datasets that differ
+        from the Data Package version (the hash recorded when the manifest
+        was created, kept as "version_hash") are recorded as modified, so
+        that later runs report them without hashing.
+        :param rehash: True to hash the datasets of changed geodatabases
+        :return: a list of the modified, missing or new datasets, and of the
+        changed geodatabases that were not hashed
+        """
+        changed = self.changedWorkspaces()
+        if not rehash:
+            self.changed = changed
+            return self.modified + changed
+        self.changed = []
+        if changed:
+            modified = set(self.modified)
+            for workspace in changed:
+                current = _describeWorkspace(self.toolDataPath, workspace)
+                expected = dict(
+                    (name, entry) for name, entry in self.datasets.items()
+                    if name.startswith(workspace + "/"))
+                for name in set(current) | set(expected):
+                    if name not in current:
+                        del self.datasets[name]
+                        modified.add(name)
+                        continue
+                    original = None
+                    if name in expected:
+                        original = expected[name].get(
+                            "version_hash", expected[name]["hash"])
+                    if current[name]["hash"] != original:
+                        current[name]["version_hash"] = original
+                        modified.add(name)
+                    else:
+                        modified.discard(name)
+                    self.datasets[name] = current[name]
+                self.data["workspaces"][workspace] = _workspaceSignature(
+                    os.path.join(self.toolDataPath, workspace))
+            self.data["modified"] = sorted(modified)
+            self.save()
+        return self.modified
+
+    def path(self, name):
+        """Returns the path of a dataset in the manifest"""
+        return os.path.join(self.toolDataPath, *name.split("/"))
+
+    def hashes(self):
+        """
+        Returns the content hash of each dataset, e.g., to use as a cache key.
+        Datasets in geodatabases that have changed since they were hashed
+        (see validate) are mapped to None.
+        :return: a dictionary of dataset paths mapped to hashes
+        """
+        return dict((self.path(name),
+                     None if name.split("/")[0] in self.changed
+                     else entry["hash"])
+                    for name, entry in self.datasets.items())
+
+
+def _workspaceSignature(workspace):
+    """
+    Returns a hash of the names, sizes and modification times of the files
+    of a file geodatabase, ignoring lock files.
+    """
+    signature = hashlib.sha1()
+    if os.path.isdir(workspace):
+        for name in sorted(os.listdir(workspace)):
+            if name.endswith(".lock"):
+                continue
+            stat = os.stat(os.path.join(workspace, name))
+            signature.update("{}:{}:{};".format(
+                name, stat.st_size, int(stat.st_mtime)).encode("utf-8"))
+    return signature.hexdigest()
+
+
+def _hashValue(value):
+    """Encodes a cursor value the same way in Python 2 and 3"""
+    if value is None:
+        return b"\x00"
+    if isinstance(value, (bytes, bytearray)):
+        return bytes(value)
+    if isinstance(value, float):
+        return repr(value).encode("utf-8")
+    if not isinstance(value, type(u"")):
+        value = u"{}".format(value)
+    return value.encode("utf-8")
+
+
+def _describeWorkspace(tool_data_path, workspace):
+    """Describes and hashes the datasets of a geodatabase for the manifest"""
+    datasets = OrderedDict()
+    walk = arcpy.da.Walk(os.path.join(tool_data_path, workspace),
+                         datatype=["RasterDataset", "FeatureClass", "Table"])
+    for dirpath, dirnames, filenames in walk:
+        for filename in filenames:
+            path = os.path.join(dirpath, filename)
+            desc = arcpy.Describe(path)
+            content = hashlib.sha1()
+            entry = OrderedDict([("type", desc.dataType)])
+            if hasattr(desc, "spatialReference"):
+                entry["spatial_reference"] = \
+                    desc.spatialReference.exportToString()
+            if hasattr(desc, "extent"):
+                entry["extent"] = [desc.extent.XMin, desc.extent.YMin,
+                                   desc.extent.XMax, desc.extent.YMax]
+            if desc.dataType == "RasterDataset":
+                raster = arcpy.Raster(path)
+                grid = rasterlib.Grid.fromRaster(raster)
+                entry["grid"] = [grid.xMin, grid.yMax, grid.cellSize,
+                                 grid.nRows, grid.nCols]
+                entry["dtype"] = raster.pixelType
+                window = rasterlib.Window(0, 0, grid.nRows, grid.nCols)
+                for block in rasterlib.IterateBlocks(window, 1024):
+                    values = rasterlib.ReadRasterWindow(raster, grid, block,
+                                                        nodata=np.nan)
+                    content.update(np.ascontiguousarray(
+                        values, dtype=np.float64).tobytes())
+            else:
+                fields = [field.name for field in arcpy.ListFields(path)
+                          if field.type not in ("OID", "Geometry")]
+                if desc.dataType == "FeatureClass":
+                    fields.append("SHAPE@WKB")
+                with arcpy.da.SearchCursor(path, fields) as cursor:
+                    for row in cursor:
+                        content.update(b"\x1f".join(
+                            _hashValue(value) for value in row) + b"\x1e")
+            entry["hash"] = content.hexdigest()
+            name = workspace + "/" + os.path.relpath(
+                path, os.path.join(tool_data_path, workspace)).replace(
+                    "\\", "/")
+            datasets[name] = entry
+    return datasets
+
+
+def _cascadedUnion(geometries):
+    """Unions geometries pairwise, level by level, so that each union joins
+    geometries of similar size"""
+    while len(geometries) > 1:
+        pairs = []
+        for k in range(0, len(geometries) - 1, 2):
+            pairs.append(geometries[k].union(geometries[k + 1]))
+        if len(geometries) % 2:
+            pairs.append(geometries[-1])
+        geometries = pairs
+    return geometries[0] if geometries else None
+
+
+def _distanceGroups(in_data, distances):
+    """Groups the subtypes of features by their distance in a single pass,
+    skipping subtypes without a distance"""
+    groups = OrderedDict()
+    with arcpy.da.SearchCursor(in_data, ["Subtype"]) as cursor:
+        for subtype, in cursor:
+            distance = distances.get(subtype)
+            if distance is not None:
+                subtypes = groups.setdefault(float(distance), [])
+                if subtype not in subtypes:
+                    subtypes.append(subtype)
+    return groups
+
+
+def _subtypeClause(in_data, subtypes):
+    """Returns an SQL expression selecting the features of the subtypes"""
+    return "{} IN ({})".format(
+        arcpy.AddFieldDelimiters(in_data, "Subtype"),
+        ", ".join("'{}'".format(subtype.replace("'", "''"))
+                  for subtype in subtypes))
+
+
+def DistanceArea(in_data, groups, out_name, cell_size, snap_raster=None,
+                 polygonize=True):
+    """
+    Derives the area within a distance of features from Euclidean distance
+    rasters rather than vector buffers: the distance from each group of
+    features is thresholded by the group's distance and the groups are
+    combined with a Boolean Or. Every cell a feature touches is a source
+    cell, so features smaller than a cell are not lost.
+    :param in_data: a feature class
+    :param groups: a non-empty dictionary of distances mapped to lists of
+    the subtypes (Subtype field) of the features within that distance, or
+    to None for all features
+    :param out_name: a name to save the output as a string
+    :param cell_size: the cell size of the distance rasters
+    :param snap_raster: a raster to align the distance rasters to,
+    optional; defaults to the snapRaster environment
+    :param polygonize: True to save the area as a polygon feature class,
+    False to save it as a raster of 1 (NoData outside the area)
+    :return: the name of the output as a string
+    """
+    # Process the extent of the features expanded by the largest distance
+    extent = arcpy.Describe(in_data).extent
+    margin = max(list(groups.keys()) + [0]) + 2 * float(cell_size)
+    env_extent, env_snap = arcpy.env.extent, arcpy.env.snapRaster
+    arcpy.env.extent = arcpy.Extent(extent.XMin - margin,
+                                    extent.YMin - margin,
+                                    extent.XMax + margin,
+                                    extent.YMax + margin)
+    if snap_raster is not None:
+        arcpy.env.snapRaster = snap_raster
+
+    try:
+        # Read the features once, grouped by subtype unless all features
+        # are used
+        desc = arcpy.Describe(in_data)
+        grid = rasterlib.FeatureGrid(in_data, snap_raster, float(cell_size))
+        if any(subtypes is None for subtypes in groups.values()):
+            group_field = "OID@"
+        else:
+            group_field = "Subtype"
+        features = rasterlib.ReadFeatureGroups(
+            in_data, group_field, densify_distance=grid.cellSize)
+
+        area = None
+        for distance, subtypes in groups.items():
+            selected = [feature for group, members in features.items()
+                        if subtypes is None or group in subtypes
+                        for feature in members]
+            if not selected:
+                continue
+            source = _touchedCells(selected, desc.shapeType, grid)
+            rasterlib.SaveArray(source.astype(np.uint8), grid,
+                                "in_memory/distance_source", nodata=0,
+                                spatial_reference=desc.spatialReference)
+            if distance > 0:
+                within = ~IsNull(EucDistance("in_memory/distance_source",
+                                             distance, cell_size))
+            else:
+                within = ~IsNull("in_memory/distance_source")
+            area = within if area is None else area | within
+
+        areaRaster = SetNull(area == 0, 1)
+        if polygonize:
+            arcpy.RasterToPolygon_conversion(areaRaster,
+                                             "in_memory/distance_area",
+                                             "NO_SIMPLIFY")
+            arcpy.Dissolve_management("in_memory/distance_area", out_name)
+        else:
+            areaRaster.save(out_name)
+    finally:
+        arcpy.env.extent, arcpy.env.snapRaster = env_extent, env_snap
+        for temp in ["in_memory/distance_source", "in_memory/distance_area"]:
+            if arcpy.Exists(temp):
+                arcpy.Delete_management(temp)
+
+    return out_name
+
+
+def _touchedCells(features, shape_type, grid):
+    """Returns a boolean array of the cells of the grid that features (see
+    rasterlib.ReadFeatureGroups) touch"""
+    if shape_type == "Polygon":
+        return rasterlib.RasterizeFractions(features, grid) > 0
+    window, array = rasterlib.RasterizeLineGroups({0: features}, {},
+                                                  grid)[0]
+    return ~np.isnan(rasterlib.ExpandArray(array, window, grid, np.nan))
+
+
+def CreateIndirectImpactArea(in_data, parameter_values, out_name,
+                             cell_size=None, snap_raster=None):
     """
     Buffers the provide feature class by the distance associated with the
     subytpe in the Parameter Values table. Provided feature class must have
     a field named 'Subtype' populated exactly the same as
-    Anthro_Attribute_Table subtype codes.
+    Anthro_Attribute_Table subtype codes. Features are buffered in groups of
+    the same distance and the groups are unioned; features with a distance
+    of 0 are included unbuffered, and features of subtypes without a
+    distance are skipped.
     :param in_data: feature class with a field named 'Subtype' populated
     exactly the same as the Parameter Values table subtype codes.
-    :param parameter_values: the Parameter Values table
+    :param parameter_values: the Parameter Values table or a ParameterTable
     :param out_name: a name to save the output as a string
+    :param cell_size: a cell size to derive the area from distance rasters
+    instead of vector buffers (see DistanceArea), optional
+    :param snap_raster: the raster to align distance rasters to, optional
     :return: the name of the output as a string
     """
-    # Join attribute table from AnthroAttributeTable.dbf based on Subtype
-    # Get list of existing field names
-    existingFields = arcpy.ListFields(in_data)
-    fieldNames = [field.name.lower() for field in existingFields]
-    # Perform join
-    in_field = "Subtype"
-    join_table = parameter_values
-    join_field = "Subtype"
-    fields = ["Distance", "Weight"]
-    for field in fields:
-        if field.lower() in fieldNames:
-            arcpy.DeleteField_management(in_data, field)
-            
-    arcpy.JoinField_management(in_data, in_field, join_table, join_field,
-                               fields)
-
-    # Buffer Proposed_Surface_Disturbance based on Distance field
-    in_features = in_data
-    out_feature_class = out_name
-    buffer_field = "Distance"
-    line_side = "FULL"
-    line_end_type = "ROUND"
-    dissolve_option = "ALL"
-    indirect_impact_area = arcpy.Buffer_analysis(in_features,
-                                                 out_feature_class,
-                                                 buffer_field, line_side,
-                                                 line_end_type,
-                                                 dissolve_option)
-
-    # Merge all features with 0 distance (skipped by buffer)
-    fc = arcpy.MakeFeatureLayer_management(in_data, "lyr")
-    where_clause = """{} = {}""".format(
-        arcpy.AddFieldDelimiters(fc, buffer_field), 0)
-    arcpy.SelectLayerByAttribute_management(fc, "NEW_SELECTION",
-                                            where_clause)
-    
-    merged_fc = arcpy.Merge_management([indirect_impact_area, fc], 
-                                       'in_memory/merged')
-    
-    indirect_impact_area_merge = arcpy.Dissolve_management(
-        merged_fc)
+    # Group features by the distance of their subtype in a single pass
+    distances = ParameterTable.get(parameter_values).lookup("Distance")
+    groups = _distanceGroups(in_data, distances)
+    if cell_size is not None and groups:
+        return DistanceArea(in_data, groups, out_name, cell_size,
+                            snap_raster)
+
+    # Buffer each group with a single distance, dissolving within the group
+    geometries = []
+    for k, (distance, subtypes) in enumerate(groups.items()):
+        where_clause = _subtypeClause(in_data, subtypes)
+        layer = arcpy.MakeFeatureLayer_management(in_data, "lyr",
+                                                  where_clause)
+        out_feature_class = "in_memory/indirect_" + str(k)
+        if distance > 0:
+            arcpy.Buffer_analysis(layer, out_feature_class,
+                                  str(distance) + " Unknown", "FULL",
+                                  "ROUND", "ALL")
+        else:
+            arcpy.Dissolve_management(layer, out_feature_class)
+        arcpy.Delete_management("lyr")
+        with arcpy.da.SearchCursor(out_feature_class, ["SHAPE@"]) as cursor:
+            geometries.extend(row[0] for row in cursor if row[0] is not None)
+        arcpy.Delete_management(out_feature_class)
+
+    # Union the groups and save the result
+    spatial_reference = arcpy.Describe(in_data).spatialReference
+    indirect_impact_area = arcpy.CreateFeatureclass_management(
+        arcpy.env.workspace, out_name, "POLYGON",
+        spatial_reference=spatial_reference
+        )
+    union = _cascadedUnion(geometries)
+    if union is not None:
+        with arcpy.da.InsertCursor(indirect_impact_area,
+                                   ["SHAPE@"]) as cursor:
+            cursor.insertRow([union])
 
-    return indirect_impact_area_merge
+    return out_name
 
 
 def CreateMapUnits(Project_Area, out_data):
@@ -260,14 +744,18 @@ def CreateMapUnits(Project_Area, out_data):
     return map_units
 
 
-def CreateAnalysisArea(Project_Area, parameter_values, out_name):
+def CreateAnalysisArea(Project_Area, parameter_values, out_name,
+                       cell_size=None, snap_raster=None):
     """
     Buffers the Project_Area layer by the maximum distance found in the
     Parameter Values table.
     :param Project_Area: the Project Area feature class, non-habitat must
     be removed
-    :param parameter_values: the Parameter Values table
+    :param parameter_values: the Parameter Values table or a ParameterTable
     :param out_name: a name to save the output as a string
+    :param cell_size: a cell size to derive the area from a distance raster
+    instead of a vector buffer (see DistanceArea), optional
+    :param snap_raster: the raster to align the distance raster to, optional
     :return: the name of the output as a string
     """
     in_features = Project_Area
@@ -277,9 +765,12 @@ def CreateAnalysisArea(Project_Area, parameter_values, out_name):
     dissolve_option = "ALL"
 
     # identify maximum indirect effect distance for buffer
-    effect_distances = [row[0] for row in arcpy.da.SearchCursor(
-        parameter_values, "Distance") if isinstance(row[0], (int, float))]
-    buffer_distance = max(effect_distances)
+    buffer_distance = ParameterTable.get(parameter_values).maxDistance(
+        "Distance")
+
+    if cell_size is not None:
+        return DistanceArea(in_features, {buffer_distance: None},
+                            out_feature_class, cell_size, snap_raster)
 
     Analysis_Area = arcpy.Buffer_analysis(in_features, out_feature_class,
                                           buffer_distance, line_side,
@@ -288,15 +779,90 @@ def CreateAnalysisArea(Project_Area, parameter_values, out_name):
     return Analysis_Area
 
 
-def ClipAnthroFeatures(clip_features, anthro_feature_path):
+def AnthroSpatialIndex(in_features, index_folder, key=None):
+    """
+    Returns the envelope index of a feature class (see
+    rasterlib.EnvelopeIndex), loading it from the index folder if it was
+    built from the same content and building and saving it otherwise.
+    :param in_features: the path of the feature class
+    :param index_folder: the folder of the saved indexes, created if
+    necessary
+    :param key: the content hash of the feature class, e.g., from the Data
+    Package manifest; if None, the index is always built
+    :return: a rasterlib.EnvelopeIndex
+    """
+    path = os.path.join(index_folder,
+                        os.path.basename(in_features) + ".npz")
+    if key is not None and os.path.exists(path):
+        index = rasterlib.EnvelopeIndex.load(path)
+        if index.key == key:
+            return index
+    arcpy.AddMessage("Indexing " + os.path.basename(in_features))
+    index = rasterlib.EnvelopeIndex.fromFeatures(in_features, key=key)
+    if key is not None:
+        if not os.path.exists(index_folder):
+            os.makedirs(index_folder)
+        index.save(path)
+    return index
+
+
+def _clipCandidates(task):
+    """
+    Worker of ClipAnthroFeatures: intersects candidate features with the
+    clip geometry.
+    :param task: a tuple of the feature class path, output name, attribute
+    fields, object ids to read, clip geometry as Esri JSON and intersection
+    dimension
+    :return: the output name and a list of (WKB, attributes...) rows
+    """
+    in_features, out_name, fields, oids, clip_json, dimension = task
+    clip = arcpy.AsShape(clip_json, True)
+    oid_field = arcpy.Describe(in_features).OIDFieldName
+    where_clause = "{} IN ({})".format(
+        arcpy.AddFieldDelimiters(in_features, oid_field),
+        ", ".join(str(oid) for oid in oids))
+    rows = []
+    with arcpy.da.SearchCursor(in_features, ["SHAPE@"] + fields,
+                               where_clause) as cursor:
+        for row in cursor:
+            if row[0] is None:
+                continue
+            clipped = row[0].intersect(clip, dimension)
+            if clipped is None or clipped.pointCount == 0:
+                continue
+            rows.append((bytes(clipped.WKB),) + tuple(row[1:]))
+    return out_name, rows
+
+
+def ClipAnthroFeatures(clip_features, anthro_feature_path, index_folder=None,
+                       hashes=None, workers=None, chunk_size=1000):
     """
     Clips all provided anthropogenic feature layers to the Analysis Area
     boundary and saves to the project's gdb. Tool must be run while the
     project's gdb is the active workspace.
     :param clip_features: the Analysis Area feature class
     :param anthro_feature_path: the path to the Anthro_Features gdb
+    :param index_folder: the folder of the envelope indexes of the anthro
+    feature classes, optional; if provided, only the features whose
+    envelopes intersect the Analysis Area are clipped
+    :param hashes: a dictionary of feature class paths and content hashes,
+    optional (see DataPackageManifest.hashes); indexes are rebuilt when the
+    content changes
+    :param workers: the number of worker processes intersecting candidate
+    features with the Analysis Area, optional; requires index_folder. The
+    clipped features are written by this process as they are returned.
+    :param chunk_size: the number of candidate features per worker task or
+    per clip when index_folder is provided
     :return: None
     """
+    clip_shapes = []
+    if index_folder is not None:
+        with arcpy.da.SearchCursor(clip_features, ["SHAPE@"]) as cursor:
+            for row in cursor:
+                if row[0] is not None:
+                    clip_shapes.append(row[0])
+
+    tasks = []
     walk = arcpy.da.Walk(anthro_feature_path, datatype="FeatureClass",
                          type=["Polygon", "Polyline", "Point"])
     for dirpath, dirnames, filenames in walk:
@@ -304,31 +870,97 @@ def ClipAnthroFeatures(clip_features, anthro_feature_path):
             arcpy.AddMessage("Clipping " + filename)
             in_features = os.path.join(dirpath, filename)
             out_name = "Anthro_" + filename + "_Clip"
-            arcpy.Clip_analysis(in_features, clip_features, out_name)
+            if index_folder is None:
+                arcpy.Clip_analysis(in_features, clip_features, out_name)
+                continue
+
+            # Clip only the candidates found in the envelope index, which
+            # is in the coordinates of the anthro feature class
+            index = AnthroSpatialIndex(in_features, index_folder,
+                                       (hashes or {}).get(in_features))
+            desc = arcpy.Describe(in_features)
+            extents = [shape.projectAs(desc.spatialReference).extent
+                       for shape in clip_shapes]
+            oids = [index.query(extent.XMin, extent.YMin, extent.XMax,
+                                extent.YMax) for extent in extents]
+            oids = np.unique(np.concatenate(oids)) if oids else []
+            arcpy.CreateFeatureclass_management(
+                arcpy.env.workspace, out_name, desc.shapeType.upper(),
+                in_features, spatial_reference=desc.spatialReference
+                )
+            if len(oids) == 0:
+                continue
+            if workers:
+                # Queue the candidates in chunks for the worker pool
+                fields = [field.name for field in arcpy.ListFields(in_features)
+                          if field.editable and
+                          field.type not in ("OID", "Geometry", "GlobalID")]
+                clip = clip_shapes[0]
+                for shape in clip_shapes[1:]:
+                    clip = clip.union(shape)
+                clip_json = clip.projectAs(desc.spatialReference).JSON
+                dimension = {"Polygon": 4, "Polyline": 2}.get(desc.shapeType,
+                                                              1)
+                for start in range(0, len(oids), chunk_size):
+                    tasks.append((in_features, out_name, fields,
+                                  [int(oid) for oid in
+                                   oids[start:start + chunk_size]],
+                                  clip_json, dimension))
+                continue
+
+            # Clip the candidates in chunks so that each where clause stays
+            # bounded, appending each chunk to the output
+            oid_field = arcpy.AddFieldDelimiters(in_features,
+                                                 desc.OIDFieldName)
+            for start in range(0, len(oids), chunk_size):
+                where_clause = "{} IN ({})".format(
+                    oid_field, ", ".join(str(int(oid)) for oid in
+                                         oids[start:start + chunk_size]))
+                layer = arcpy.MakeFeatureLayer_management(
+                    in_features, "anthro_candidates_lyr", where_clause)
+                arcpy.Clip_analysis(layer, clip_features,
+                                    "in_memory/anthro_candidates_clip")
+                arcpy.Append_management("in_memory/anthro_candidates_clip",
+                                        out_name, "NO_TEST")
+                arcpy.Delete_management("anthro_candidates_lyr")
+                arcpy.Delete_management("in_memory/anthro_candidates_clip")
+
+    if not tasks:
+        return
+
+    # Intersect in worker processes and insert each returned batch from
+    # this process only, so that writes to the project's gdb do not contend
+    if os.path.basename(sys.executable).lower() in ("arcmap.exe",
+                                                    "arcgispro.exe"):
+        multiprocessing.set_executable(os.path.join(sys.exec_prefix,
+                                                    "pythonw.exe"))
+    fields = dict((task[1], task[2]) for task in tasks)
+    pool = multiprocessing.Pool(workers)
+    try:
+        for out_name, rows in pool.imap_unordered(_clipCandidates, tasks):
+            if not rows:
+                continue
+            with arcpy.da.InsertCursor(out_name, ["SHAPE@WKB"]
+                                       + fields[out_name]) as cursor:
+                for row in rows:
+                    cursor.insertRow((bytearray(row[0]),) + row[1:])
+    finally:
+        pool.close()
+        pool.join()
 
 
 def BufferAnthroFeatures(filename, Parameter_Values):
     """
     Buffer line and point type anthropogenic features
     :param filename: the anthro feature to be buffered
-    :param Parameter_Values: the Parameter Values table
+    :param Parameter_Values: the Parameter Values table or a ParameterTable
     :return: None
     """
-    # Join Buffer field from Parameter_Values table based on Subtype
-    # Get list of existing field names
-    existingFields = arcpy.ListFields(filename)
-    fieldNames = [field.name.lower() for field in existingFields]
-    # Perform join
-    in_field = "Subtype"
-    join_table = Parameter_Values
-    join_field = "Subtype"
-    fields = ["Buffer"]
-    for field in fields:
-        if field.lower() in fieldNames:
-            arcpy.DeleteField_management(filename, field)
-            
-    arcpy.JoinField_management(filename, in_field, join_table, join_field,
-                               fields)
+    # Write Buffer field from the cached Parameter Values by Subtype
+    buffers = ParameterTable.get(Parameter_Values).lookup("Buffer")
+    values = dict((subtype, {"Buffer": buffer})
+                  for subtype, buffer in buffers.items())
+    WriteFieldsByKey(filename, "Subtype", values, ["Buffer"])
 
     # Buffer Proposed_Surface_Disturbance based on Distance field
     in_features = filename
@@ -555,16 +1187,17 @@ def DissolveMapUnits(Map_Units, allowable_fields, out_name, anthro_features):
         )
 
     # Combine notes fields
-    # Retrieve lists of map unit ids and notes
+    # Group the unique notes of each map unit id in one pass, in the order
+    # they are found
     fc = Map_Units
     id_field = arcpy.ListFields(fc, "*_Unit_ID")[0].name
     fields = [id_field, "Notes"]
-    mu_ids = []
-    mu_notes = []
+    mu_notes = {}
     with arcpy.da.SearchCursor(fc, fields) as cursor:
-        for row in cursor:
-            mu_ids.append(row[0])
-            mu_notes.append(row[1])
+        for mu_id, note in cursor:
+            notes = mu_notes.setdefault(mu_id, OrderedDict())
+            if note is not None:
+                notes[note] = None
 
     # Add notes field back to map units dissolve
     util.AddFields(map_units_dissolve, ["Notes"], ["TEXT"])
@@ -573,24 +1206,13 @@ def DissolveMapUnits(Map_Units, allowable_fields, out_name, anthro_features):
     fc = map_units_dissolve
     fields = [id_field, "Notes"]
     seperator = "; "
+    # Truncate long notes (should be 255 chararcters)
+    field_length = arcpy.ListFields(fc, fields[1])[0].length
     with arcpy.da.UpdateCursor(fc, fields) as cursor:
         for row in cursor:
             try:
-                # Get unique list of notes from map units dissolve
-                new_notes = []
-                for note, mu_id in zip(mu_notes, mu_ids):
-                    if mu_id == row[0]:
-                        new_notes.append(note)
-                new_notes_unique = list(set(new_notes))
-                new_notes_unique = [note for note in new_notes_unique \
-                                    if note is not None]
-                new_notes_string = seperator.join(new_notes_unique)
-                # Truncate long notes (should be 255 chararcters)
-                field_length = arcpy.ListFields(fc, fields[1])[0].length
-                if len(new_notes_string) > field_length:
-                    new_notes_string = new_notes_string[:field_length]
-                # Update table
-                row[1] = new_notes_string
+                new_notes_string = seperator.join(mu_notes.get(row[0], ()))
+                row[1] = new_notes_string[:field_length]
                 cursor.updateRow(row)
             except:
                 arcpy.AddMessage("Notes field not populated, refer to original "
@@ -681,6 +1303,168 @@ def CalcZonalStats(in_zone_data, zone_field, in_value_raster, out_table):
         arcpy.Delete_management(tmp_raster)
 
 
+def CalcZonalStatsBatch(in_zone_data, zone_field, value_rasters,
+                        statistics=("MEAN",), cell_size=5, block_rows=256):
+    """
+    Calculates statistics of several value rasters within each map unit in a
+    single pass, reading each cell within the map units' envelopes once, also
+    when a dataset is a source of several WindowExpressions. As
+    in CalcZonalStats, null values are counted as 0 and the
+    value rasters are summarized at the cell_size resolution (nearest
+    neighbor) so that small map units do not return null values.
+    :param in_zone_data: the Map Units Dissolve feature class
+    :param zone_field: the field to use as zone field, must be integer and
+    cannot be OBJECTID
+    :param value_rasters: a dictionary of names mapped to raster datasets,
+    basenames, Raster objects or rasterlib.WindowExpressions; use an
+    OrderedDict to preserve field order
+    :param statistics: a list of statistics from MEAN, SUM, COUNT, MIN, MAX
+    and STD
+    :param cell_size: the resolution at which zones are summarized
+    :param block_rows: the number of raster rows read at a time
+    :return: a numpy structured array with one row per zone, holding the zone
+    field and a field per value raster and statistic, named '<name>' if a
+    single statistic is requested or '<name>_<STATISTIC>' otherwise
+    """
+    statistics = [stat.upper() for stat in statistics]
+    names = list(value_rasters.keys())
+    snap_raster = arcpy.env.snapRaster or value_rasters[names[0]]
+    grid = rasterlib.Grid.fromRaster(snap_raster)
+    factor = max(1, int(round(grid.cellSize / float(cell_size))))
+
+    # Read zones once and identify the envelope of each zone
+    polygons = rasterlib.ReadPolygons(
+        in_zone_data, zone_field,
+        densify_distance=grid.cellSize / float(factor)
+        )
+    envelopes = {}
+    for rings, zone, _ in polygons:
+        points = np.concatenate(rings)
+        envelope = [points[:, 0].min(), points[:, 1].min(),
+                    points[:, 0].max(), points[:, 1].max()]
+        if zone in envelopes:
+            current = envelopes[zone]
+            envelope = [min(current[0], envelope[0]),
+                        min(current[1], envelope[1]),
+                        max(current[2], envelope[2]),
+                        max(current[3], envelope[3])]
+        envelopes[zone] = envelope
+    zone_ids = np.array(sorted(envelopes), dtype=np.int64)
+    nodata_zone = int(zone_ids.min()) - 1 if len(zone_ids) else -1
+
+    # Merge overlapping zone envelopes into disjoint windows of the value
+    # rasters, so that each cell is read once for all zones
+    windows = rasterlib.MergeWindows([grid.windowFromExtent(*envelope)
+                                      for envelope in envelopes.values()])
+
+    # Summarize all value rasters within each window, reading (or
+    # evaluating) each block of each raster once and accumulating every zone
+    # in the block
+    accumulators = dict((name, rasterlib.ZonalAccumulator(len(zone_ids),
+                                                          statistics))
+                        for name in names)
+    for window in windows:
+        zone_grid = grid.subGrid(window).refine(factor)
+        zone_array = rasterlib.RasterizePolygons(polygons, zone_grid,
+                                                 nodata_zone, np.int64,
+                                                 supersample=1)
+        zone_index = rasterlib.ZoneIndex(zone_array, zone_ids)
+        del zone_array
+        for block in rasterlib.IterateBlocks(window, block_rows):
+            row = (block.row - window.row) * factor
+            block_index = zone_index[row:row + block.n_rows * factor]
+            if not (block_index >= 0).any():
+                continue
+            reads = {}
+            for name in names:
+                values = rasterlib.ReadRasterWindow(value_rasters[name],
+                                                    grid, block, nodata=0,
+                                                    reads=reads)
+                values = rasterlib.UpsampleArray(values, factor)
+                accumulators[name].update(block_index, values)
+
+    # Assemble output table
+    fields = [(str(zone_field), np.int32)]
+    columns = [zone_ids]
+    for name in names:
+        results = accumulators[name].result()
+        for stat in statistics:
+            if len(statistics) == 1:
+                field_name = name
+            else:
+                field_name = name + "_" + stat
+            fields.append((str(field_name), np.float64))
+            columns.append(results[stat])
+    zonal_stats = np.zeros(len(zone_ids), dtype=fields)
+    for (field_name, _), column in zip(fields, columns):
+        zonal_stats[field_name] = column
+
+    return zonal_stats
+
+
+def WriteFieldsByKey(in_data, key_field, values, field_names=None,
+                     field_type="DOUBLE"):
+    """
+    Writes several fields to the attribute table of in_data in a single
+    UpdateCursor pass, replacing existing versions of the fields. All fields
+    are deleted and added in one operation each (per field in ArcMap, which
+    has no AddFields tool). Rows whose key is not in values are set to null,
+    as are NaN values.
+    :param in_data: the Map Unit Dissolve feature class
+    :param key_field: the name of the field to match rows on ("Map_Unit_ID")
+    :param values: a dictionary of key values mapped to dictionaries of field
+    names and values, or a numpy structured array such as the output of
+    CalcZonalStatsBatch with a key_field field
+    :param field_names: a list of field names to write, optional; defaults to
+    all fields in values other than key_field
+    :param field_type: the field type of the new fields
+    :return: None
+    """
+    if hasattr(values, "dtype"):
+        names = [name for name in values.dtype.names if name != key_field]
+        values = dict(
+            (row[key_field].item(),
+             dict((name, row[name].item()) for name in names))
+            for row in values
+            )
+    else:
+        names = []
+        for row_values in values.values():
+            for name in row_values:
+                if name not in names:
+                    names.append(name)
+    if field_names is None:
+        field_names = names
+
+    # Delete existing instances of the fields, if present
+    lower_names = [field_name.lower() for field_name in field_names]
+    existing_fields = [field.name for field in arcpy.ListFields(in_data)
+                       if field.name.lower() in lower_names]
+    if existing_fields:
+        arcpy.DeleteField_management(in_data, existing_fields)
+
+    # Add all fields
+    if arcpy.ListInstallations()[0] == 'arcgispro':
+        arcpy.management.AddFields(
+            in_data, [[field_name, field_type] for field_name in field_names]
+            )
+    else:
+        for field_name in field_names:
+            arcpy.AddField_management(in_data, field_name, field_type)
+
+    # Fill all fields from the provided values
+    with arcpy.da.UpdateCursor(in_data,
+                               [key_field] + list(field_names)) as cursor:
+        for row in cursor:
+            row_values = values.get(row[0], {})
+            for i, field_name in enumerate(field_names, 1):
+                value = row_values.get(field_name)
+                if value is not None and value != value:
+                    value = None
+                row[i] = value
+            cursor.updateRow(row)
+
+
 def JoinMeanToTable(in_data, zonal_stats, zone_field, field_name):
     """
     Joins the MEAN field of the provided table to the Map_Units_Dissolve
@@ -691,23 +1475,82 @@ def JoinMeanToTable(in_data, zonal_stats, zone_field, field_name):
     :param field_name: a field name to save the joined field as a string
     :return: None
     """
-    # Delete existing instances of the new field or MEAN, if present
-    existingFields = arcpy.ListFields(in_data)
-    for field in existingFields:
-        if field.name.lower() == field_name.lower():
-            arcpy.DeleteField_management(in_data, field.name)
-        if field.name == "MEAN":
-            arcpy.DeleteField_management(in_data, field.name)
-
-    # Join MEAN field from ZonalStats table to Map_Units_Dissolve
-    joinTable = zonal_stats
-    joinField = zone_field
-    field = "MEAN"
-    arcpy.JoinField_management(in_data, zone_field, joinTable, joinField,
-                               field)
-
-    # Change name of joined field
-    arcpy.AlterField_management(in_data, field, field_name)
+    # Read MEAN field from ZonalStats table
+    values = dict(
+        (zone, {field_name: mean}) for zone, mean in
+        arcpy.da.SearchCursor(zonal_stats, [zone_field, "MEAN"])
+        )
+
+    # Write to Map_Units_Dissolve in a single pass
+    WriteFieldsByKey(in_data, zone_field, values, [field_name])
+
+
+def CalcFunctionalAcres(in_data, zone_field, zonal_stats, accounts):
+    """
+    Calculates the change in functional acres (Acres * (pre - post)) for each
+    feature of in_data from the zonal statistics of its zone, writes the
+    zonal statistics and the results in a single pass and reports the totals
+    in one summary table.
+    :param in_data: the Map Units Dissolve or Debit Project Area feature
+    class, with an Acres field
+    :param zone_field: the zone field of in_data and zonal_stats
+    :param zonal_stats: a numpy structured array from CalcZonalStatsBatch
+    :param accounts: a list of (pre_field, post_field, out_field) tuples,
+    where pre_field and post_field are fields of zonal_stats; since null
+    values are summarized as 0, the mean of pre - post is the difference of
+    their means
+    :return: a list of (out_field, pre, post, difference) tuples with the
+    total functional acres of in_data
+    """
+    # Read acres of each feature and find its zone in the zonal statistics
+    rows = [row for row in arcpy.da.SearchCursor(
+        in_data, ["OID@", zone_field, "Acres"])]
+    oids = [row[0] for row in rows]
+    zones = np.array([row[1] if row[1] is not None else -1 for row in rows],
+                     dtype=np.int64)
+    acres = np.array([row[2] if row[2] is not None else np.nan
+                      for row in rows], dtype=np.float64)
+    zone_ids = zonal_stats[zone_field].astype(np.int64)
+    zone_index = rasterlib.ZoneIndex(zones, zone_ids)
+    has_zone = zone_index >= 0
+
+    # Collect the zonal statistics of each feature's zone
+    out_fields = [name for name in zonal_stats.dtype.names
+                  if name != zone_field]
+    values = dict((oid, {}) for oid in oids)
+    for name in out_fields:
+        column = np.where(has_zone, zonal_stats[name][zone_index], np.nan)
+        for oid, value in zip(oids, column):
+            values[oid][name] = float(value)
+
+    # Calculate functional acres for all features and accounts at once
+    summary = []
+    for pre_field, post_field, out_field in accounts:
+        pre = np.where(has_zone, zonal_stats[pre_field][zone_index],
+                       np.nan) * acres
+        post = np.where(has_zone, zonal_stats[post_field][zone_index],
+                        np.nan) * acres
+        difference = pre - post
+        for oid, value in zip(oids, difference):
+            values[oid][out_field] = float(value)
+        out_fields.append(out_field)
+        summary.append((out_field, float(np.nansum(pre)),
+                        float(np.nansum(post)), float(np.nansum(difference))))
+
+    # Write the zonal statistics and all accounts in a single pass
+    WriteFieldsByKey(in_data, "OID@", values, out_fields)
+
+    # Report totals
+    template = "{:<28}{:>14}{:>14}{:>14}"
+    lines = ["Functional acres for {} feature(s):".format(len(oids)),
+             template.format("", "Pre", "Post", "Difference")]
+    for out_field, pre, post, difference in summary:
+        lines.append(template.format(out_field, "{:.2f}".format(pre),
+                                     "{:.2f}".format(post),
+                                     "{:.2f}".format(difference)))
+    arcpy.AddMessage("\n".join(lines))
+
+    return summary
 
 
 def GenerateTransects(workspace, Map_Units, field_name, out_name):
@@ -0,0 +1,1924 @@
+"""
+Name:     rasterlib.py
+Author:   Environmental Incentives, LLC
+Created:  October 18, 2026
+Revised:  October 18, 2026
+Version:  Compatible with Python 2.7 (ArcMap) and Python 3 (ArcGIS Pro)
+Requires: ArcGIS version 10.1 or later, Basic (ArcView) license or better
+          Spatial Analyst extension, numpy
+
+This library contains array-based raster functions used by the Nevada Credit
+System, Colorado Habitat Exchange, and Idaho Sage Steppe Mitigation Program
+HQTs. Rasters are read into numpy arrays window by window so that summaries
+can be calculated in memory rather than through intermediate geoprocessing
+outputs.
+
+Copyright 2017-2020 Environmental Incentives, LLC.
+
+Licensed under the Apache License, Version 2.0 (the "License");
+you may not use this file except in compliance with the License.
+You may obtain a copy of the License at
+
+    https://www.apache.org/licenses/LICENSE-2.0
+
+Unless required by applicable law or agreed to in writing, software
+distributed under the License is distributed on an "AS IS" BASIS,
+WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+See the License for the specific language governing permissions and
+limitations under the License.
+
+"""
+
+# Import system modules
+import arcpy
+import collections
+import json
+import math
+import os
+import threading
+import numpy as np
+
+
+# ----------------------------------------------------------------------------
+
+# CLASSES
+
+# A block of cells within a grid, as offsets and counts of rows and columns
+Window = collections.namedtuple("Window", ["row", "col", "n_rows", "n_cols"])
+
+
+class Grid(object):
+    """
+    A raster grid described by the coordinates of its upper-left corner, its
+    (square) cell size, its number of rows and columns and, optionally, its
+    spatial reference. Grids are aligned if they share a cell size and
+    spatial reference and their origins differ by whole cells, so that the
+    cells of one are an integer-offset window of the other.
+    """
+    # Tolerance for alignment, as a fraction of the cell size
+    TOLERANCE = 1e-4
+
+    def __init__(self, x_min, y_max, cell_size, n_rows, n_cols,
+                 spatial_reference=None):
+        self.xMin = float(x_min)
+        self.yMax = float(y_max)
+        self.cellSize = float(cell_size)
+        self.nRows = int(n_rows)
+        self.nCols = int(n_cols)
+        self.spatialReference = spatial_reference
+
+    @classmethod
+    def fromRaster(cls, raster):
+        """
+        Creates a grid matching the extent and cell size of a raster.
+        :param raster: a raster dataset, basename, Raster object or
+        WindowExpression (which uses the grid of its first source)
+        :return: a Grid
+        """
+        while isinstance(raster, WindowExpression):
+            raster = raster.sources[0]
+        raster = _asRaster(raster)
+        extent = raster.extent
+        return cls(extent.XMin, extent.YMax, raster.meanCellWidth,
+                   raster.height, raster.width,
+                   getattr(raster, "spatialReference", None))
+
+    def __eq__(self, other):
+        return (isinstance(other, Grid) and
+                (self.xMin, self.yMax, self.cellSize, self.nRows,
+                 self.nCols) ==
+                (other.xMin, other.yMax, other.cellSize, other.nRows,
+                 other.nCols))
+
+    def __ne__(self, other):
+        return not self == other
+
+    def _sameSpatialReference(self, other):
+        if self.spatialReference is None or other.spatialReference is None:
+            return True
+        return self.spatialReference.name == other.spatialReference.name
+
+    def isAligned(self, other):
+        """
+        Returns whether another grid shares this grid's cell size, spatial
+        reference and cell boundaries.
+        :param other: a Grid
+        :return: True if aligned
+        """
+        tolerance = self.TOLERANCE * self.cellSize
+        if abs(self.cellSize - other.cellSize) > tolerance or \
+                not self._sameSpatialReference(other):
+            return False
+        for offset in (other.xMin - self.xMin, self.yMax - other.yMax):
+            cells = offset / self.cellSize
+            if abs(cells - round(cells)) * self.cellSize > tolerance:
+                return False
+        return True
+
+    def checkAligned(self, other, name="Raster"):
+        """
+        Raises a ValueError if another grid is not aligned to this grid, as
+        combining them would require resampling.
+        :param other: a Grid
+        :param name: the name of the other grid's dataset, for the message
+        :return: None
+        """
+        if not self.isAligned(other):
+            raise ValueError(
+                "{} (cell size {}, origin {}, {}) is not aligned to the grid "
+                "(cell size {}, origin {}, {}); snap it to the Empty "
+                "Raster".format(name, other.cellSize, other.xMin, other.yMax,
+                                self.cellSize, self.xMin, self.yMax))
+
+    def windowOf(self, other):
+        """
+        Returns the window of this grid covered by an aligned grid. The
+        window is not clipped to this grid.
+        :param other: a Grid aligned to this grid
+        :return: a Window
+        """
+        self.checkAligned(other)
+        return Window(int(round((self.yMax - other.yMax) / self.cellSize)),
+                      int(round((other.xMin - self.xMin) / self.cellSize)),
+                      other.nRows, other.nCols)
+
+    def intersection(self, other):
+        """
+        Returns the cells shared by this grid and an aligned grid.
+        :param other: a Grid aligned to this grid
+        :return: a Grid, with no rows or columns if the grids do not overlap
+        """
+        return self.subGrid(self.clipWindow(self.windowOf(other)))
+
+    def align(self, other):
+        """
+        Returns the grid covering another grid's extent, snapped to this
+        grid's origin and cell size (expanded outward to whole cells).
+        :param other: a Grid
+        :return: a Grid aligned to this grid
+        """
+        return self.snapExtent(other.xMin, other.yMin, other.xMax,
+                               other.yMax)
+
+    @property
+    def xMax(self):
+        return self.xMin + self.nCols * self.cellSize
+
+    @property
+    def yMin(self):
+        return self.yMax - self.nRows * self.cellSize
+
+    @property
+    def Shape(self):
+        return self.nRows, self.nCols
+
+    @property
+    def Extent(self):
+        return arcpy.Extent(self.xMin, self.yMin, self.xMax, self.yMax)
+
+    def windowFromExtent(self, x_min, y_min, x_max, y_max):
+        """
+        Returns the window of cells covering the provided extent, expanded
+        outward to whole cells. The window is not clipped to the grid.
+        :param x_min: minimum x coordinate of the extent
+        :param y_min: minimum y coordinate of the extent
+        :param x_max: maximum x coordinate of the extent
+        :param y_max: maximum y coordinate of the extent
+        :return: a Window
+        """
+        col = int(math.floor((x_min - self.xMin) / self.cellSize))
+        row = int(math.floor((self.yMax - y_max) / self.cellSize))
+        col_end = int(math.ceil((x_max - self.xMin) / self.cellSize))
+        row_end = int(math.ceil((self.yMax - y_min) / self.cellSize))
+        return Window(row, col, max(row_end - row, 0), max(col_end - col, 0))
+
+    def clipWindow(self, window):
+        """
+        Returns the part of a window that lies within the grid.
+        :param window: a Window
+        :return: a Window, with no rows or columns if outside the grid
+        """
+        row = min(max(window.row, 0), self.nRows)
+        col = min(max(window.col, 0), self.nCols)
+        row_end = min(max(window.row + window.n_rows, row), self.nRows)
+        col_end = min(max(window.col + window.n_cols, col), self.nCols)
+        return Window(row, col, row_end - row, col_end - col)
+
+    def snapExtent(self, x_min, y_min, x_max, y_max, cell_size=None):
+        """
+        Returns a grid aligned to this grid's origin that covers the provided
+        extent, expanded outward to whole cells.
+        :param x_min: minimum x coordinate of the extent
+        :param y_min: minimum y coordinate of the extent
+        :param x_max: maximum x coordinate of the extent
+        :param y_max: maximum y coordinate of the extent
+        :param cell_size: the cell size of the new grid, optional; defaults to
+        this grid's cell size
+        :return: a Grid
+        """
+        cell_size = float(cell_size or self.cellSize)
+        grid_x_min = self.xMin + math.floor(
+            (x_min - self.xMin) / cell_size) * cell_size
+        grid_y_max = self.yMax + math.ceil(
+            (y_max - self.yMax) / cell_size) * cell_size
+        n_cols = int(math.ceil((x_max - grid_x_min) / cell_size))
+        n_rows = int(math.ceil((grid_y_max - y_min) / cell_size))
+        return Grid(grid_x_min, grid_y_max, cell_size, max(n_rows, 0),
+                    max(n_cols, 0), self.spatialReference)
+
+    def subGrid(self, window):
+        """
+        Returns the grid of the cells within the provided window.
+        :param window: a Window
+        :return: a Grid
+        """
+        return Grid(self.xMin + window.col * self.cellSize,
+                    self.yMax - window.row * self.cellSize,
+                    self.cellSize, window.n_rows, window.n_cols,
+                    self.spatialReference)
+
+    def refine(self, factor):
+        """
+        Returns a grid with the same extent and cells divided by factor.
+        :param factor: the number of fine cells per cell along each axis
+        :return: a Grid
+        """
+        return Grid(self.xMin, self.yMax, self.cellSize / factor,
+                    self.nRows * factor, self.nCols * factor,
+                    self.spatialReference)
+
+
+class WindowExpression(object):
+    """
+    A raster calculated from other rasters by a function of numpy arrays. The
+    function is only evaluated for the windows that are read, so cells that
+    are never summarized are never calculated, e.g.
+    WindowExpression(lambda pre, post: pre - post, pre_raster, post_raster)
+    """
+
+    def __init__(self, func, *sources, **kwargs):
+        self.func = func
+        self.sources = sources
+        self.nodata = kwargs.get("nodata", 0)
+
+    def read(self, grid, window=None, reads=None):
+        """
+        Evaluates the expression within a window of the provided grid.
+        :param grid: the Grid the window refers to
+        :param window: a Window, or None to evaluate the entire grid
+        :param reads: a dictionary of arrays already read within the window,
+        optional, see ReadRasterWindow
+        :return: a 2D numpy array
+        """
+        arrays = [ReadRasterWindow(source, grid, window, self.nodata, reads)
+                  for source in self.sources]
+        return self.func(*arrays)
+
+
+def _sortedMember(values, sorted_values):
+    """Returns whether each value is in a sorted array of values"""
+    if not len(sorted_values):
+        return np.zeros(len(values), dtype=bool)
+    positions = np.searchsorted(sorted_values, values)
+    positions[positions == len(sorted_values)] = 0
+    return sorted_values[positions] == values
+
+
+class ActiveCells(object):
+    """
+    The cells of an array that take part in a calculation, as flat indices.
+    Inputs are gathered into 1D arrays of the active cells, and results are
+    scattered back into arrays whose other cells hold known values (e.g., 0
+    outside suitable habitat).
+    """
+
+    def __init__(self, active, fill):
+        """
+        :param active: a 2D boolean array of the cells to calculate
+        :param fill: the value of the other cells, as a scalar or an array
+        with the shape of active
+        """
+        self.shape = active.shape
+        self.index = np.flatnonzero(active)
+        self.fill = fill
+
+    @property
+    def Count(self):
+        return self.index.size
+
+    def gather(self, array):
+        """
+        Returns the values of the active cells.
+        :param array: a 2D array with the shape of the mask
+        :return: a 1D numpy array
+        """
+        return np.take(array, self.index)
+
+    def scatter(self, values, dtype=np.float64):
+        """
+        Returns an array of the full shape with the values of the active
+        cells and the fill value elsewhere.
+        :param values: a 1D array of the values of the active cells
+        :param dtype: the data type of the array
+        :return: a 2D numpy array
+        """
+        out = np.empty(self.shape, dtype=dtype)
+        out[...] = self.fill
+        out.flat[self.index] = values
+        return out
+
+
+class SparseRaster(object):
+    """
+    A raster on a grid that stores only the cells with data, as flat indices
+    and values per tile, for masks such as proposed features that cover a
+    small part of the grid. Cells are addressed within each tile as
+    row * tile_size + col.
+    """
+
+    def __init__(self, grid, tile_size=256):
+        self.grid = grid
+        self.tileSize = int(tile_size)
+        # (tile row, tile col) mapped to sorted (indices, values) arrays
+        self.tiles = {}
+
+    @classmethod
+    def fromArray(cls, array, grid, window=None, nodata=np.nan, mask=None,
+                  tile_size=256):
+        """
+        Creates a sparse raster from the cells of an array with data.
+        :param array: a 2D numpy array covering window
+        :param grid: the Grid the window refers to
+        :param window: the Window of the grid covered by array, or None if
+        array covers the entire grid
+        :param nodata: the value of cells without data
+        :param mask: a boolean array of the cells to keep, optional; defaults
+        to all cells that are not nodata
+        :param tile_size: the number of rows and columns in each tile
+        :return: a SparseRaster
+        """
+        if mask is None:
+            if nodata != nodata:
+                mask = ~np.isnan(array)
+            else:
+                mask = array != nodata
+        rows, cols = np.nonzero(mask)
+        sparse = cls(grid, tile_size)
+        if window is not None:
+            sparse._addCells(rows + window.row, cols + window.col,
+                             array[mask])
+        else:
+            sparse._addCells(rows, cols, array[mask])
+        return sparse
+
+    @classmethod
+    def fromRaster(cls, raster, grid, tile_size=256):
+        """
+        Reads the cells of a raster with data within the grid, one tile at a
+        time. The raster must share the grid's cell size and alignment.
+        :param raster: a raster dataset, basename or Raster object
+        :param grid: the Grid to read
+        :param tile_size: the number of rows and columns in each tile
+        :return: a SparseRaster
+        """
+        sparse = cls(grid, tile_size)
+        for row in range(0, grid.nRows, tile_size):
+            for col in range(0, grid.nCols, tile_size):
+                window = Window(row, col, min(tile_size, grid.nRows - row),
+                                min(tile_size, grid.nCols - col))
+                values = ReadRasterWindow(raster, grid, window,
+                                          nodata=np.nan)
+                rows, cols = np.nonzero(~np.isnan(values))
+                sparse._addCells(rows + row, cols + col, values[rows, cols])
+        return sparse
+
+    def _addCells(self, rows, cols, values):
+        """Adds cells, given as grid rows and columns, to the tiles"""
+        size = self.tileSize
+        tile_rows = rows // size
+        tile_cols = cols // size
+        indices = (rows % size) * size + cols % size
+        order = np.lexsort((indices, tile_cols, tile_rows))
+        tile_rows, tile_cols = tile_rows[order], tile_cols[order]
+        indices, values = indices[order], np.asarray(values)[order]
+        starts = np.flatnonzero(np.r_[True, (np.diff(tile_rows) != 0) |
+                                      (np.diff(tile_cols) != 0)])
+        ends = np.r_[starts[1:], len(indices)]
+        for start, end in zip(starts, ends):
+            if start == end:
+                continue
+            key = (int(tile_rows[start]), int(tile_cols[start]))
+            self.tiles[key] = (indices[start:end], values[start:end])
+
+    def _checkGrid(self, other):
+        if self.grid != other.grid or self.tileSize != other.tileSize:
+            raise ValueError("Sparse rasters must share a grid and tiles")
+
+    @property
+    def Count(self):
+        return sum(len(indices) for indices, _ in self.tiles.values())
+
+    def filter(self, predicate):
+        """
+        Returns the cells whose values meet a condition.
+        :param predicate: a function of an array of values returning a
+        boolean array, e.g. lambda values: values == 1
+        :return: a SparseRaster
+        """
+        result = SparseRaster(self.grid, self.tileSize)
+        for key, (indices, values) in self.tiles.items():
+            keep = predicate(values)
+            if keep.any():
+                result.tiles[key] = (indices[keep], values[keep])
+        return result
+
+    def constant(self, value, dtype=np.float32):
+        """
+        Returns the cells of this raster with a constant value (Con(self,
+        value)).
+        :param value: the value of all cells
+        :param dtype: the data type of the values
+        :return: a SparseRaster
+        """
+        result = SparseRaster(self.grid, self.tileSize)
+        for key, (indices, _) in self.tiles.items():
+            result.tiles[key] = (indices, np.full(len(indices), value,
+                                                  dtype=dtype))
+        return result
+
+    def union(self, other):
+        """
+        Returns the cells of either sparse raster, with the values of this
+        raster where both have data (Con(IsNull(self), other, self)).
+        :param other: a SparseRaster on the same grid
+        :return: a SparseRaster
+        """
+        self._checkGrid(other)
+        result = SparseRaster(self.grid, self.tileSize)
+        result.tiles.update(other.tiles)
+        for key, (indices, values) in self.tiles.items():
+            if key in other.tiles:
+                other_indices, other_values = other.tiles[key]
+                keep = ~_sortedMember(other_indices, indices)
+                indices = np.concatenate((indices, other_indices[keep]))
+                values = np.concatenate((values, other_values[keep]))
+                order = np.argsort(indices, kind="mergesort")
+                indices, values = indices[order], values[order]
+            result.tiles[key] = (indices, values)
+        return result
+
+    def difference(self, other):
+        """
+        Returns the cells of this raster where the other raster has no data
+        (SetNull(other, self) within other's cells).
+        :param other: a SparseRaster on the same grid
+        :return: a SparseRaster
+        """
+        self._checkGrid(other)
+        result = SparseRaster(self.grid, self.tileSize)
+        for key, (indices, values) in self.tiles.items():
+            if key in other.tiles:
+                keep = ~_sortedMember(indices, other.tiles[key][0])
+                indices, values = indices[keep], values[keep]
+            if len(indices):
+                result.tiles[key] = (indices, values)
+        return result
+
+    def toArray(self, fill=np.nan, dtype=np.float32):
+        """
+        Materializes the sparse raster on its full grid.
+        :param fill: the value of cells without data
+        :param dtype: the data type of the output array
+        :return: a 2D numpy array with the shape of the grid
+        """
+        out = np.full(self.grid.Shape, fill, dtype=dtype)
+        size = self.tileSize
+        for (tile_row, tile_col), (indices, values) in self.tiles.items():
+            out[tile_row * size + indices // size,
+                tile_col * size + indices % size] = values
+        return out
+
+    def save(self, out_raster, fill=np.nan, spatial_reference=None):
+        """
+        Saves the sparse raster as a raster dataset, materializing it once.
+        :param out_raster: the name or path of the output raster dataset
+        :param fill: the value of cells without data; NaN is NoData
+        :param spatial_reference: the spatial reference of the raster,
+        optional
+        :return: the path of the output raster
+        """
+        return SaveArray(self.toArray(fill), self.grid, out_raster,
+                         spatial_reference=spatial_reference)
+
+
+class ZonalAccumulator(object):
+    """
+    Accumulates statistics of values by zone, one block of cells at a time,
+    so that a raster can be summarized without holding it in memory.
+    """
+
+    def __init__(self, n_zones, statistics):
+        self.statistics = [stat.upper() for stat in statistics]
+        for stat in self.statistics:
+            if stat not in STATISTICS:
+                raise ValueError("Unsupported statistic: " + stat)
+        self.count = np.zeros(n_zones, dtype=np.float64)
+        self.sum = np.zeros(n_zones, dtype=np.float64)
+        self.sumSquares = np.zeros(n_zones, dtype=np.float64)
+        self.min = np.full(n_zones, np.inf)
+        self.max = np.full(n_zones, -np.inf)
+
+    def update(self, zone_index, values):
+        """
+        Adds a block of cells to the running statistics.
+        :param zone_index: integer array of zone positions, -1 outside zones
+        :param values: array of values with the same shape as zone_index
+        :return: None
+        """
+        zone_index = np.ravel(zone_index)
+        values = np.ravel(values).astype(np.float64)
+        inside = zone_index >= 0
+        zone_index = zone_index[inside]
+        values = values[inside]
+        n_zones = len(self.count)
+        self.count += np.bincount(zone_index, minlength=n_zones)
+        self.sum += np.bincount(zone_index, values, minlength=n_zones)
+        if "STD" in self.statistics:
+            self.sumSquares += np.bincount(zone_index, values * values,
+                                           minlength=n_zones)
+        if "MIN" in self.statistics:
+            np.minimum.at(self.min, zone_index, values)
+        if "MAX" in self.statistics:
+            np.maximum.at(self.max, zone_index, values)
+
+    def result(self):
+        """
+        Returns the requested statistics. Zones without cells are NaN, except
+        for COUNT and SUM which are 0.
+        :return: an OrderedDict of statistic names mapped to arrays
+        """
+        empty = self.count == 0
+        count = np.where(empty, 1, self.count)
+        mean = np.where(empty, np.nan, self.sum / count)
+        results = collections.OrderedDict()
+        for stat in self.statistics:
+            if stat == "MEAN":
+                results[stat] = mean
+            elif stat == "SUM":
+                results[stat] = self.sum.copy()
+            elif stat == "COUNT":
+                results[stat] = self.count.copy()
+            elif stat == "MIN":
+                results[stat] = np.where(empty, np.nan, self.min)
+            elif stat == "MAX":
+                results[stat] = np.where(empty, np.nan, self.max)
+            elif stat == "STD":
+                variance = np.maximum(self.sumSquares / count - mean * mean,
+                                      0)
+                results[stat] = np.sqrt(variance)
+        return results
+
+
+# ----------------------------------------------------------------------------
+
+# CONSTANTS
+
+STATISTICS = ["MEAN", "SUM", "COUNT", "MIN", "MAX", "STD"]
+
+
+# ----------------------------------------------------------------------------
+
+# ARRAY FUNCTIONS
+
+def TileWindows(mask, tile_size=256):
+    """
+    Returns the windows of the tiles of an array that contain any cell of a
+    mask, merging adjacent tiles within each row of tiles, so that the
+    tiles outside a region of interest can be skipped.
+    :param mask: a 2D boolean array
+    :param tile_size: the number of rows and columns in each tile
+    :return: a list of Windows
+    """
+    n_rows, n_cols = mask.shape
+    windows = []
+    if n_cols == 0:
+        return windows
+    starts = np.arange(0, n_cols, tile_size)
+    for row in range(0, n_rows, tile_size):
+        n = min(tile_size, n_rows - row)
+        tiles = np.logical_or.reduceat(mask[row:row + n].any(axis=0), starts)
+        tile = 0
+        while tile < tiles.size:
+            if not tiles[tile]:
+                tile += 1
+                continue
+            first = tile
+            while tile < tiles.size and tiles[tile]:
+                tile += 1
+            col = starts[first]
+            end = min(starts[tile - 1] + tile_size, n_cols)
+            windows.append(Window(row, int(col), n, int(end - col)))
+    return windows
+
+
+def MergeWindows(windows):
+    """
+    Merges overlapping windows into their envelopes until no two windows
+    overlap, so that each cell of the input windows is read only once.
+    :param windows: a list of Windows
+    :return: a list of disjoint Windows, sorted by row and column
+    """
+    merged = [window for window in windows
+              if window.n_rows > 0 and window.n_cols > 0]
+    overlapping = True
+    while overlapping:
+        overlapping = False
+        merged.sort()
+        result = []
+        for window in merged:
+            for i, other in enumerate(result):
+                if (window.row < other.row + other.n_rows and
+                        other.row < window.row + window.n_rows and
+                        window.col < other.col + other.n_cols and
+                        other.col < window.col + window.n_cols):
+                    row = min(window.row, other.row)
+                    col = min(window.col, other.col)
+                    row_end = max(window.row + window.n_rows,
+                                  other.row + other.n_rows)
+                    col_end = max(window.col + window.n_cols,
+                                  other.col + other.n_cols)
+                    result[i] = Window(row, col, row_end - row, col_end - col)
+                    overlapping = True
+                    break
+            else:
+                result.append(window)
+        merged = result
+    return sorted(merged)
+
+
+def _asRaster(raster):
+    """Returns a Raster object for a raster dataset or basename"""
+    if hasattr(raster, "meanCellWidth"):
+        return raster
+    return arcpy.Raster(raster)
+
+
+def IterateBlocks(window, block_rows):
+    """
+    Splits a window into blocks of whole rows.
+    :param window: a Window
+    :param block_rows: the maximum number of rows in each block
+    :return: a generator of Windows
+    """
+    for row in range(window.row, window.row + window.n_rows, block_rows):
+        n_rows = min(block_rows, window.row + window.n_rows - row)
+        yield Window(row, window.col, n_rows, window.n_cols)
+
+
+def ReadRasterWindow(raster, grid, window=None, nodata=0, reads=None):
+    """
+    Reads the cells of a raster within a window of the provided grid. Cells
+    outside the raster or with NoData are assigned the nodata value. The
+    raster must be aligned to the grid (see Grid.isAligned), otherwise a
+    ValueError is raised.
+    :param raster: a raster dataset, basename, Raster object or
+    WindowExpression
+    :param grid: the Grid the window refers to
+    :param window: a Window, or None to read the entire grid
+    :param nodata: the value to assign to NoData cells, may be NaN
+    :param reads: a dictionary to hold the arrays read within this window,
+    optional; a dataset read by several rasters or WindowExpressions sharing
+    the dictionary is only read once. Returned arrays are shared; copy them
+    before modifying.
+    :return: a 2D numpy array
+    """
+    if isinstance(raster, WindowExpression):
+        values = np.asarray(raster.read(grid, window, reads))
+        if values.dtype.kind == "f":
+            values = np.where(np.isnan(values), nodata, values)
+        return values
+    if reads is not None:
+        key = (DatasetPath(raster), repr(nodata))
+        if key not in reads:
+            reads[key] = ReadRasterWindow(raster, grid, window, nodata)
+        return reads[key]
+    # Reading a raster on another grid would resample it
+    raster = _asRaster(raster)
+    grid.checkAligned(Grid.fromRaster(raster), DatasetPath(raster))
+    if window is not None:
+        grid = grid.subGrid(window)
+    lower_left = arcpy.Point(grid.xMin, grid.yMin)
+    if nodata != nodata:
+        # Integer rasters cannot hold NaN, so convert their NoData value
+        if raster.isInteger:
+            values = arcpy.RasterToNumPyArray(raster, lower_left, grid.nCols,
+                                              grid.nRows).astype(np.float64)
+            values[values == raster.noDataValue] = np.nan
+            return values
+    return arcpy.RasterToNumPyArray(raster, lower_left, grid.nCols,
+                                    grid.nRows, nodata)
+
+
+def DatasetPath(raster):
+    """Returns the path of a raster dataset, basename or Raster object"""
+    if hasattr(raster, "catalogPath"):
+        return raster.catalogPath
+    return str(raster)
+
+
+class RasterCache(object):
+    """
+    A bounded cache of opened raster datasets and the windows read from them,
+    keyed by dataset path and window, so that standard layers used several
+    times by a tool are opened and decoded once. The least recently used
+    windows are evicted when the cached arrays exceed max_bytes. Cached
+    arrays are read-only; copy them before modifying. Rasters found in an
+    ArrayStore, if provided, are read from it instead.
+    """
+
+    def __init__(self, max_bytes=512 * 2 ** 20, store=None):
+        self.maxBytes = max_bytes
+        self.store = store
+        self.nBytes = 0
+        self.hits = 0
+        self.misses = 0
+        # Content hashes of datasets by path (see
+        # hqtlib.DataPackageManifest), used in place of paths as keys
+        self.keys = {}
+        self._handles = {}
+        self._windows = collections.OrderedDict()
+
+    def _touch(self, key):
+        # Move the key to the most recently used end
+        value = self._windows.pop(key)
+        self._windows[key] = value
+        return value
+
+    def _storeName(self, raster):
+        """Returns the name of a raster in the array store, if it is there
+        and was exported from the same content"""
+        path = DatasetPath(raster)
+        name = self.store.lookup(path)
+        if name is None:
+            return None
+        exported = self.store.rasters[name].get("hash")
+        if path in self.keys and exported is not None and \
+                exported != self.keys[path]:
+            return None
+        return name
+
+    def raster(self, raster):
+        """
+        Returns the Raster object for a raster dataset, opening it once.
+        :param raster: a raster dataset path or Raster object
+        :return: a Raster object
+        """
+        path = DatasetPath(raster)
+        if path in self._handles:
+            self.hits += 1
+        else:
+            self.misses += 1
+            self._handles[path] = _asRaster(raster)
+        return self._handles[path]
+
+    def read(self, raster, grid, window=None, nodata=0):
+        """
+        Reads a window of a raster dataset, decoding it once.
+        :param raster: a raster dataset path or Raster object
+        :param grid: the Grid the window refers to
+        :param window: the Window to read, or None for the entire grid
+        :param nodata: the value assigned to NoData cells
+        :return: a read-only 2D numpy array
+        """
+        if window is None:
+            window = Window(0, 0, grid.nRows, grid.nCols)
+        if self.store is not None:
+            # Windows of exported rasters are slices of memory-mapped files
+            name = self._storeName(raster)
+            if name is not None and self.store.isAligned(name, grid):
+                return self.store.read(name, grid, window, nodata)
+        # nodata is keyed by its repr so that NaN keys match
+        path = DatasetPath(raster)
+        key = (self.keys.get(path) or path, grid.xMin, grid.yMax, grid.cellSize,
+               tuple(window), repr(nodata))
+        if key in self._windows:
+            self.hits += 1
+            return self._touch(key)
+        self.misses += 1
+        array = ReadRasterWindow(self.raster(raster), grid, window, nodata)
+        array.setflags(write=False)
+        self._windows[key] = array
+        self.nBytes += array.nbytes
+        while self.nBytes > self.maxBytes and len(self._windows) > 1:
+            _, evicted = self._windows.popitem(last=False)
+            self.nBytes -= evicted.nbytes
+        return array
+
+    def readStatic(self, name, grid, window=None, nodata=np.nan):
+        """
+        Reads a window of a static surface composed by ComposeStaticSurfaces.
+        :param name: the name of the static surface (e.g., "GrSG_Winter")
+        :param grid: the Grid the window refers to
+        :param window: the Window to read, or None for the entire grid
+        :param nodata: the value assigned to NoData cells
+        :return: a 2D numpy array, or None if the surface is not in the
+        store, is not aligned to the grid or any of its source rasters has
+        changed since it was composed
+        """
+        key = self.staticName(name, grid)
+        if key is None:
+            return None
+        return self.store.read(key, grid, window, nodata)
+
+    def staticName(self, name, grid):
+        """Returns the name of a static surface in the array store, if it is
+        there, aligned to the grid and composed from the current content of
+        its source rasters"""
+        if self.store is None:
+            return None
+        key = "Static/" + name
+        entry = self.store.rasters.get(key)
+        if entry is None or not self.store.isAligned(key, grid):
+            return None
+        current = dict((self.store.lookup(path), content)
+                       for path, content in self.keys.items())
+        for source, exported in entry["sources"].items():
+            if source in current and exported is not None and \
+                    exported != current[source]:
+                return None
+        return key
+
+    def prefetch(self, rasters, grid, window=None, static=()):
+        """
+        Starts reading the windows of rasters found in the array store in a
+        background thread, so that reading them later (e.g., in the next
+        stage of a tool) does not wait on the disk. arcpy is not used from
+        the thread, so rasters not in the store are read when requested.
+        :param rasters: a list of raster dataset paths or Raster objects
+        :param grid: the Grid the window refers to
+        :param window: the Window to read, or None for the entire grid
+        :param static: a list of static surface names (see readStatic)
+        :return: the started Thread, or None if no raster is in the store
+        """
+        if self.store is None:
+            return None
+        names = []
+        for raster in rasters:
+            name = self._storeName(raster)
+            if name is not None and self.store.isAligned(name, grid):
+                names.append(name)
+        for name in static:
+            name = self.staticName(name, grid)
+            if name is not None:
+                names.append(name)
+        if not names:
+            return None
+        # Open the arrays here, so the thread only reads files
+        for name in names:
+            self.store.array(name)
+
+        def prefetchNames():
+            for name in names:
+                self.store.prefetch(name, grid, window)
+
+        thread = threading.Thread(target=prefetchNames)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def clear(self):
+        """Closes the cached datasets and discards the cached windows"""
+        self._handles.clear()
+        self._windows.clear()
+        self.nBytes = 0
+
+
+class ArrayStore(object):
+    """
+    A folder of rasters exported by ExportArrayStore as .npy files, one
+    row-major array per raster, with a manifest.json of their grids. Arrays
+    are memory-mapped, so reading a window slices the file rather than
+    decoding the raster.
+    """
+    MANIFEST = "manifest.json"
+
+    def __init__(self, folder):
+        self.folder = folder
+        with open(os.path.join(folder, self.MANIFEST)) as manifest:
+            self.manifest = json.load(manifest)
+        self.rasters = self.manifest["rasters"]
+        self._arrays = {}
+
+    @classmethod
+    def open(cls, folder):
+        """
+        Opens an array store if the folder contains one.
+        :param folder: the folder of the array store
+        :return: an ArrayStore, or None if the folder has no manifest
+        """
+        if os.path.exists(os.path.join(folder, cls.MANIFEST)):
+            return cls(folder)
+        return None
+
+    def lookup(self, path):
+        """
+        Returns the name of a raster dataset in the store, if present.
+        :param path: the path of the raster dataset
+        :return: the name of the raster in the store (e.g.,
+        "InputData.gdb/Lakes"), or None
+        """
+        parts = os.path.normpath(path).replace("\\", "/").split("/")
+        name = "/".join(parts[-2:])
+        if name in self.rasters:
+            return name
+        return None
+
+    def grid(self, name):
+        """Returns the Grid of a raster in the store"""
+        entry = self.rasters[name]
+        return Grid(entry["x_min"], entry["y_max"], entry["cell_size"],
+                    entry["n_rows"], entry["n_cols"])
+
+    def isAligned(self, name, grid):
+        """Returns whether a grid is aligned to a raster in the store"""
+        return self.grid(name).isAligned(grid)
+
+    def array(self, name):
+        """Returns the memory-mapped array of a raster in the store"""
+        if name not in self._arrays:
+            self._arrays[name] = np.load(
+                os.path.join(self.folder, self.rasters[name]["file"]),
+                mmap_mode="r"
+                )
+        return self._arrays[name]
+
+    def nodata(self, name):
+        """Returns the NoData value of a raster in the store"""
+        nodata = self.rasters[name]["nodata"]
+        return np.nan if nodata is None else nodata
+
+    def _offset(self, name, grid, window):
+        """Returns the row and column of a window within a stored raster"""
+        offset = self.grid(name).windowOf(grid)
+        return offset.row + window.row, offset.col + window.col
+
+    def prefetch(self, name, grid, window=None, chunk_bytes=2 ** 22):
+        """
+        Reads the rows of a stored raster covered by a window from the file,
+        so that they are in the operating system's page cache when the
+        memory-mapped array is sliced. File reads release the interpreter
+        lock, so this can run in a background thread.
+        :param name: the name of the raster in the store
+        :param grid: the Grid the window refers to, aligned to the raster
+        :param window: a Window, or None for the entire grid
+        :param chunk_bytes: the number of bytes read at a time
+        :return: None
+        """
+        if window is None:
+            window = Window(0, 0, grid.nRows, grid.nCols)
+        array = self.array(name)
+        row, _ = self._offset(name, grid, window)
+        row_0 = min(max(row, 0), array.shape[0])
+        row_1 = min(max(row + window.n_rows, 0), array.shape[0])
+        row_bytes = array.shape[1] * array.dtype.itemsize
+        remaining = (row_1 - row_0) * row_bytes
+        with open(os.path.join(self.folder, self.rasters[name]["file"]),
+                  "rb") as f:
+            f.seek(array.offset + row_0 * row_bytes)
+            while remaining > 0:
+                data = f.read(min(chunk_bytes, remaining))
+                if not data:
+                    break
+                remaining -= len(data)
+
+    def read(self, name, grid, window=None, nodata=0):
+        """
+        Reads the cells of a raster in the store within a window of the
+        provided grid, as ReadRasterWindow. The window is returned as a
+        read-only view of the file if it lies within the raster and the
+        stored NoData value matches nodata, otherwise as a copy.
+        :param name: the name of the raster in the store
+        :param grid: the Grid the window refers to, aligned to the raster
+        :param window: a Window, or None to read the entire grid
+        :param nodata: the value to assign to NoData cells, may be NaN
+        :return: a 2D numpy array
+        """
+        if window is None:
+            window = Window(0, 0, grid.nRows, grid.nCols)
+        source = self.grid(name)
+        stored_nodata = self.nodata(name)
+        array = self.array(name)
+        row, col = self._offset(name, grid, window)
+        row_0, col_0 = max(row, 0), max(col, 0)
+        row_1 = min(row + window.n_rows, source.nRows)
+        col_1 = min(col + window.n_cols, source.nCols)
+        view = array[row_0:max(row_1, row_0), col_0:max(col_1, col_0)]
+        same_nodata = (nodata == stored_nodata or
+                       (nodata != nodata and stored_nodata != stored_nodata))
+        if view.shape == (window.n_rows, window.n_cols) and same_nodata:
+            return view
+        dtype = array.dtype
+        if nodata != nodata or (dtype.kind in "iu" and
+                                nodata != np.asarray(nodata, dtype)):
+            dtype = np.float64
+        out = np.full((window.n_rows, window.n_cols), nodata, dtype=dtype)
+        if view.size:
+            values = view.astype(dtype)
+            if stored_nodata != stored_nodata:
+                values[np.isnan(values)] = nodata
+            else:
+                values[view == stored_nodata] = nodata
+            out[row_0 - row:row_1 - row, col_0 - col:col_1 - col] = values
+        return out
+
+
+def ExportArrayStore(rasters, out_folder, block_rows=1024, hashes=None,
+                     static=None):
+    """
+    Exports raster datasets to an ArrayStore: one .npy file per raster, as
+    uint8 (NoData 255) if the raster holds integers from 0 to 254 and as
+    float32 (NoData NaN) otherwise, and a manifest.json with each raster's
+    grid. Rasters are copied block by block.
+    :param rasters: a dictionary of store names (e.g., "InputData.gdb/Lakes")
+    and raster dataset paths
+    :param out_folder: the folder of the array store, created if necessary
+    :param block_rows: the number of rows copied at a time
+    :param hashes: a dictionary of store names and the content hash of each
+    raster, optional; recorded so that rasters changed since the export are
+    read from their datasets instead
+    :param static: a dictionary of static surface names and the list of
+    store names multiplied to compose each, optional (see
+    ComposeStaticSurfaces)
+    :return: the ArrayStore
+    """
+    if not os.path.exists(out_folder):
+        os.makedirs(out_folder)
+    entries = collections.OrderedDict()
+    for name, path in rasters.items():
+        raster = _asRaster(path)
+        grid = Grid.fromRaster(raster)
+        if (raster.isInteger and raster.minimum is not None and
+                raster.minimum >= 0 and raster.maximum <= 254):
+            dtype, nodata = np.uint8, 255
+        else:
+            dtype, nodata = np.float32, np.nan
+        file_name = name.replace("/", "_").replace(".", "_") + ".npy"
+        out = np.lib.format.open_memmap(os.path.join(out_folder, file_name),
+                                        mode="w+", dtype=dtype,
+                                        shape=grid.Shape)
+        window = Window(0, 0, grid.nRows, grid.nCols)
+        for block in IterateBlocks(window, block_rows):
+            out[block.row:block.row + block.n_rows] = ReadRasterWindow(
+                raster, grid, block, nodata)
+        out.flush()
+        del out
+        entries[name] = collections.OrderedDict([
+            ("file", file_name), ("dtype", np.dtype(dtype).name),
+            ("nodata", None if nodata != nodata else nodata),
+            ("x_min", grid.xMin), ("y_max", grid.yMax),
+            ("cell_size", grid.cellSize), ("n_rows", grid.nRows),
+            ("n_cols", grid.nCols),
+            ("spatial_reference",
+             arcpy.Describe(path).spatialReference.exportToString()),
+            ("hash", (hashes or {}).get(name))
+            ])
+    with open(os.path.join(out_folder, ArrayStore.MANIFEST), "w") as manifest:
+        json.dump({"rasters": entries}, manifest, indent=2)
+    store = ArrayStore(out_folder)
+    if static:
+        ComposeStaticSurfaces(store, static, block_rows)
+    return store
+
+
+def ComposeStaticSurfaces(store, static, block_rows=1024):
+    """
+    Multiplies rasters in an ArrayStore into composed surfaces, stored as
+    float32 (NoData NaN) under "Static/<name>" on the grid of the first
+    raster of each product. The hash of each source raster is recorded, so
+    that a surface composed from rasters changed since is not used.
+    :param store: the ArrayStore holding the source rasters
+    :param static: a dictionary of static surface names and the list of
+    store names multiplied to compose each
+    :param block_rows: the number of rows composed at a time
+    :return: None
+    """
+    for name, sources in static.items():
+        grid = store.grid(sources[0])
+        entry = store.rasters[sources[0]]
+        for source in sources[1:]:
+            grid.checkAligned(store.grid(source), source)
+        file_name = "Static_" + name + ".npy"
+        out = np.lib.format.open_memmap(os.path.join(store.folder, file_name),
+                                        mode="w+", dtype=np.float32,
+                                        shape=grid.Shape)
+        window = Window(0, 0, grid.nRows, grid.nCols)
+        for block in IterateBlocks(window, block_rows):
+            product = store.read(sources[0], grid, block, np.nan).astype(
+                np.float64)
+            for source in sources[1:]:
+                product *= store.read(source, grid, block, np.nan)
+            out[block.row:block.row + block.n_rows] = product
+        out.flush()
+        del out
+        store.rasters["Static/" + name] = collections.OrderedDict([
+            ("file", file_name), ("dtype", "float32"), ("nodata", None),
+            ("x_min", grid.xMin), ("y_max", grid.yMax),
+            ("cell_size", grid.cellSize), ("n_rows", grid.nRows),
+            ("n_cols", grid.nCols),
+            ("spatial_reference", entry["spatial_reference"]),
+            ("hash", None),
+            ("sources", collections.OrderedDict(
+                (source, store.rasters[source]["hash"]) for source in sources
+                ))
+            ])
+        store._arrays.pop("Static/" + name, None)
+    with open(os.path.join(store.folder, ArrayStore.MANIFEST), "w") as manifest:
+        json.dump(store.manifest, manifest, indent=2)
+
+
+def FeatureGrid(in_features, snap_raster, cell_size):
+    """
+    Returns the grid that PolygonToRaster would produce for the provided
+    features: the processing extent (or the extent of the features, if no
+    processing extent is set) snapped to the snap raster.
+    :param in_features: a feature class or layer
+    :param snap_raster: a raster dataset, basename or Raster object to align
+    to, optional; defaults to the snapRaster environment
+    :param cell_size: the cell size of the grid
+    :return: a Grid
+    """
+    extent = arcpy.env.extent
+    if not hasattr(extent, "XMin"):
+        extent = arcpy.Describe(in_features).extent
+    snap_raster = snap_raster or arcpy.env.snapRaster
+    if snap_raster:
+        snap_grid = Grid.fromRaster(snap_raster)
+    else:
+        snap_grid = Grid(extent.XMin, extent.YMax, cell_size, 0, 0)
+    return snap_grid.snapExtent(extent.XMin, extent.YMin, extent.XMax,
+                                extent.YMax, cell_size)
+
+
+def GeometryRings(shape, densify_distance=None):
+    """
+    Converts a polygon geometry to arrays of ring coordinates. Interior rings
+    are included; holes are resolved by the even-odd rule when rasterizing.
+    :param shape: an arcpy Polygon
+    :param densify_distance: the distance at which to densify true curves,
+    optional
+    :return: a list of (n, 2) numpy arrays of x and y coordinates
+    """
+    if densify_distance and getattr(shape, "hasCurves", False):
+        shape = shape.densify("DISTANCE", densify_distance, densify_distance)
+    rings = []
+    for part in shape:
+        ring = []
+        for point in part:
+            # Interior rings are separated by None within a part
+            if point is None:
+                if ring:
+                    rings.append(np.array(ring, dtype=np.float64))
+                ring = []
+            else:
+                ring.append((point.X, point.Y))
+        if ring:
+            rings.append(np.array(ring, dtype=np.float64))
+    return rings
+
+
+def ReadPolygons(in_features, value_field=None, priority_field=None,
+                 where_clause=None, value=1, densify_distance=None):
+    """
+    Reads polygons with their value and priority in a single cursor pass.
+    Features without a geometry or value are skipped.
+    :param in_features: a polygon feature class or layer
+    :param value_field: the field holding the value to rasterize, optional;
+    if None, all polygons are given value
+    :param priority_field: the field holding the priority of each polygon,
+    optional; if None, all polygons have priority 0
+    :param where_clause: an SQL expression to select features, optional
+    :param value: the value of all polygons if value_field is None
+    :param densify_distance: the distance at which to densify true curves,
+    optional
+    :return: a list of (rings, value, priority) tuples
+    """
+    fields = ["SHAPE@"] + [field for field in (value_field, priority_field)
+                           if field]
+    polygons = []
+    with arcpy.da.SearchCursor(in_features, fields, where_clause) as cursor:
+        for row in cursor:
+            shape = row[0]
+            feature_value = row[1] if value_field else value
+            priority = row[-1] if priority_field else 0
+            if shape is None or feature_value is None:
+                continue
+            rings = GeometryRings(shape, densify_distance)
+            if rings:
+                polygons.append((rings, feature_value, priority or 0))
+    return polygons
+
+
+def GeometryPaths(shape, densify_distance=None):
+    """
+    Converts a polyline, point or multipoint geometry to arrays of vertex
+    coordinates. Each point becomes a path of a single vertex.
+    :param shape: an arcpy Polyline, PointGeometry or Multipoint
+    :param densify_distance: the distance at which to densify true curves,
+    optional
+    :return: a list of (n, 2) numpy arrays of x and y coordinates
+    """
+    if shape.type == "point":
+        point = shape.firstPoint
+        return [np.array([(point.X, point.Y)], dtype=np.float64)]
+    if shape.type == "multipoint":
+        return [np.array([(point.X, point.Y)], dtype=np.float64)
+                for point in shape if point is not None]
+    if densify_distance and getattr(shape, "hasCurves", False):
+        shape = shape.densify("DISTANCE", densify_distance, densify_distance)
+    paths = []
+    for part in shape:
+        path = [(point.X, point.Y) for point in part if point is not None]
+        if path:
+            paths.append(np.array(path, dtype=np.float64))
+    return paths
+
+
+def ReadFeatureGroups(in_features, group_field, value_field=None,
+                      priority_field=None, value=1, densify_distance=None):
+    """
+    Reads features grouped by the values of a field in a single cursor pass.
+    Polygons are read as rings (see GeometryRings) and lines and points as
+    paths (see GeometryPaths). Features without a group, geometry or value
+    are skipped.
+    :param in_features: a feature class or layer
+    :param group_field: the field to group features by (e.g., "Subtype")
+    :param value_field: the field holding the value to rasterize, optional;
+    if None, all features are given value
+    :param priority_field: the field holding the priority of each feature,
+    optional; if None, all features have priority 0
+    :param value: the value of all features if value_field is None
+    :param densify_distance: the distance at which to densify true curves,
+    optional
+    :return: an OrderedDict of group values, in order of first appearance,
+    mapped to lists of (rings or paths, value, priority) tuples
+    """
+    fields = ["SHAPE@", group_field] + [
+        field for field in (value_field, priority_field) if field
+        ]
+    groups = collections.OrderedDict()
+    with arcpy.da.SearchCursor(in_features, fields) as cursor:
+        for row in cursor:
+            shape, group = row[0], row[1]
+            feature_value = row[2] if value_field else value
+            priority = row[-1] if priority_field else 0
+            if group is None:
+                continue
+            features = groups.setdefault(group, [])
+            if shape is None or feature_value is None:
+                continue
+            if shape.type == "polygon":
+                coordinates = GeometryRings(shape, densify_distance)
+            else:
+                coordinates = GeometryPaths(shape, densify_distance)
+            if coordinates:
+                features.append((coordinates, feature_value, priority or 0))
+    return groups
+
+
+def ReadPolygonBands(in_features, value_fields, priority_fields=None,
+                     densify_distance=None):
+    """
+    Reads polygons with several values (bands) per polygon in a single
+    cursor pass. Features without a geometry or any value are skipped.
+    :param in_features: a polygon feature class or layer
+    :param value_fields: a list of fields holding the value of each band
+    :param priority_fields: a list of fields holding the priority of each
+    band, optional; if None, all polygons have priority 0
+    :param densify_distance: the distance at which to densify true curves,
+    optional
+    :return: a list of (rings, values, priorities) tuples
+    """
+    n_bands = len(value_fields)
+    fields = ["SHAPE@"] + list(value_fields) + list(priority_fields or [])
+    polygons = []
+    with arcpy.da.SearchCursor(in_features, fields) as cursor:
+        for row in cursor:
+            values = row[1:n_bands + 1]
+            if priority_fields:
+                priorities = row[n_bands + 1:]
+            else:
+                priorities = (0,) * n_bands
+            if row[0] is None or all(value is None for value in values):
+                continue
+            rings = GeometryRings(row[0], densify_distance)
+            if rings:
+                polygons.append((rings, values, priorities))
+    return polygons
+
+
+def _strOrder(boxes, node_size):
+    """Returns the Sort-Tile-Recursive order of boxes: vertical slices of
+    boxes sorted by x, each sorted by y"""
+    n = boxes.shape[0]
+    n_slices = int(math.ceil(math.sqrt(math.ceil(n / float(node_size)))))
+    slice_length = n_slices * node_size
+    x = (boxes[:, 0] + boxes[:, 2]) / 2.0
+    y = (boxes[:, 1] + boxes[:, 3]) / 2.0
+    order = np.argsort(x, kind="mergesort")
+    slices = np.arange(n) // slice_length
+    return order[np.lexsort((y[order], slices))]
+
+
+def _expandRanges(first, count):
+    """Returns the concatenated ranges first[i]:first[i] + count[i]"""
+    total = int(count.sum())
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    ends = np.cumsum(count)
+    return (np.arange(total) - np.repeat(ends - count, count)
+            + np.repeat(first, count))
+
+
+class EnvelopeIndex(object):
+    """
+    A packed R-tree (Sort-Tile-Recursive) of the envelopes of the features
+    of a feature class, so that the features that may intersect an extent
+    are found without reading the others. Each level holds the boxes of its
+    nodes and the range of children of each node in the level below; the
+    lowest level's children are features.
+    """
+
+    def __init__(self, oids, boxes, levels, key=None):
+        """
+        :param oids: an array of feature object ids, in the packed order
+        :param boxes: an (n, 4) array of feature envelopes (x min, y min,
+        x max, y max), in the packed order
+        :param levels: a list of (boxes, first, count) arrays per level,
+        from the lowest level up
+        :param key: the content hash of the feature class, optional
+        """
+        self.oids = oids
+        self.boxes = boxes
+        self.levels = levels
+        self.key = key
+
+    @classmethod
+    def fromBoxes(cls, oids, boxes, node_size=16, key=None):
+        """
+        Packs feature envelopes into an index.
+        :param oids: a sequence of feature object ids
+        :param boxes: an (n, 4) array of envelopes (x min, y min, x max,
+        y max)
+        :param node_size: the maximum number of children of a node
+        :param key: the content hash of the feature class, optional
+        :return: an EnvelopeIndex
+        """
+        oids = np.asarray(oids, dtype=np.int64)
+        boxes = np.asarray(boxes, dtype=np.float64).reshape(-1, 4)
+        order = _strOrder(boxes, node_size)
+        oids, boxes = oids[order], boxes[order]
+        levels = []
+        children = boxes
+        while children.shape[0] > 0:
+            n = children.shape[0]
+            first = np.arange(0, n, node_size)
+            count = np.diff(np.append(first, n))
+            nodes = np.column_stack([
+                np.minimum.reduceat(children[:, 0], first),
+                np.minimum.reduceat(children[:, 1], first),
+                np.maximum.reduceat(children[:, 2], first),
+                np.maximum.reduceat(children[:, 3], first)
+                ])
+            if nodes.shape[0] > node_size:
+                order = _strOrder(nodes, node_size)
+                nodes, first, count = nodes[order], first[order], count[order]
+            levels.append((nodes, first, count))
+            if nodes.shape[0] <= node_size:
+                break
+            children = nodes
+        return cls(oids, boxes, levels, key)
+
+    @classmethod
+    def fromFeatures(cls, in_features, node_size=16, key=None):
+        """
+        Reads the envelopes of the features of a feature class in one
+        cursor pass and packs them into an index. Features without a
+        geometry are skipped.
+        :param in_features: a feature class or layer
+        :param node_size: the maximum number of children of a node
+        :param key: the content hash of the feature class, optional
+        :return: an EnvelopeIndex
+        """
+        oids = []
+        boxes = []
+        with arcpy.da.SearchCursor(in_features, ["OID@", "SHAPE@"]) as cursor:
+            for oid, shape in cursor:
+                if shape is None:
+                    continue
+                extent = shape.extent
+                oids.append(oid)
+                boxes.append((extent.XMin, extent.YMin, extent.XMax,
+                              extent.YMax))
+        return cls.fromBoxes(oids, boxes, node_size, key)
+
+    @classmethod
+    def load(cls, path):
+        """Loads an index saved with save"""
+        with np.load(path) as data:
+            levels = [(data["nodes_%d" % level], data["first_%d" % level],
+                       data["count_%d" % level])
+                      for level in range(int(data["n_levels"]))]
+            key = str(data["key"]) or None
+            return cls(data["oids"], data["boxes"], levels, key)
+
+    def save(self, path):
+        """Saves the index to a .npz file"""
+        arrays = {"oids": self.oids, "boxes": self.boxes,
+                  "n_levels": np.array(len(self.levels)),
+                  "key": np.array(self.key or "")}
+        for level, (nodes, first, count) in enumerate(self.levels):
+            arrays["nodes_%d" % level] = nodes
+            arrays["first_%d" % level] = first
+            arrays["count_%d" % level] = count
+        np.savez(path, **arrays)
+
+    @property
+    def Count(self):
+        return self.oids.size
+
+    def query(self, x_min, y_min, x_max, y_max):
+        """
+        Returns the object ids of the features whose envelopes intersect an
+        extent, i.e., the candidates for an exact intersection.
+        :return: a sorted array of object ids
+        """
+        def hits(boxes):
+            return ((boxes[:, 0] <= x_max) & (boxes[:, 2] >= x_min) &
+                    (boxes[:, 1] <= y_max) & (boxes[:, 3] >= y_min))
+
+        if not self.levels:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.arange(self.levels[-1][0].shape[0])
+        for nodes, first, count in reversed(self.levels):
+            candidates = candidates[hits(nodes[candidates])]
+            candidates = _expandRanges(first[candidates],
+                                       count[candidates])
+        candidates = candidates[hits(self.boxes[candidates])]
+        return np.sort(self.oids[candidates])
+
+
+def PolygonCoverage(rings, grid, supersample=8):
+    """
+    Calculates the fraction of each cell covered by a polygon by sampling
+    supersample x supersample points per cell along scanlines. A supersample
+    of 1 tests cell centers only.
+    :param rings: a list of (n, 2) arrays of ring coordinates
+    :param grid: the Grid to rasterize to
+    :param supersample: the number of samples per cell along each axis
+    :return: the Window of the grid covered by the polygon's envelope and a
+    float32 array of coverage (0 - 1) within it, or (None, None) if the
+    polygon does not intersect the grid
+    """
+    points = np.concatenate(rings)
+    window = grid.clipWindow(grid.windowFromExtent(
+        points[:, 0].min(), points[:, 1].min(),
+        points[:, 0].max(), points[:, 1].max()
+        ))
+    if window.n_rows == 0 or window.n_cols == 0:
+        return None, None
+
+    # Convert edges to sample coordinates within the window, where sample
+    # (k, j) is centered at (j + 0.5, k + 0.5)
+    step = grid.cellSize / supersample
+    x_origin = grid.xMin + window.col * grid.cellSize
+    y_origin = grid.yMax - window.row * grid.cellSize
+    n_rows = window.n_rows * supersample
+    n_cols = window.n_cols * supersample
+    starts = np.concatenate(rings)
+    ends = np.concatenate([np.roll(ring, -1, axis=0) for ring in rings])
+    u0 = (starts[:, 0] - x_origin) / step
+    v0 = (y_origin - starts[:, 1]) / step
+    u1 = (ends[:, 0] - x_origin) / step
+    v1 = (y_origin - ends[:, 1]) / step
+    sloped = v0 != v1
+    u0, v0, u1, v1 = u0[sloped], v0[sloped], u1[sloped], v1[sloped]
+
+    # Find the sample rows crossed by each edge (half-open in v)
+    k_start = np.maximum(np.ceil(np.minimum(v0, v1) - 0.5), 0)
+    k_end = np.minimum(np.ceil(np.maximum(v0, v1) - 0.5), n_rows)
+    counts = np.maximum(k_end - k_start, 0).astype(np.int64)
+    total = int(counts.sum())
+    if total == 0:
+        return None, None
+    edge = np.repeat(np.arange(len(counts)), counts)
+    offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+    k = k_start.astype(np.int64)[edge] + offsets
+
+    # Toggle inside/outside at the first sample right of each crossing
+    u = u0[edge] + (k + 0.5 - v0[edge]) * ((u1 - u0) / (v1 - v0))[edge]
+    j = np.clip(np.ceil(u - 0.5), 0, n_cols).astype(np.int64)
+    toggles = np.zeros((n_rows, n_cols + 1), dtype=np.int32)
+    np.add.at(toggles, (k, j), 1)
+    inside = np.cumsum(toggles, axis=1)[:, :n_cols] & 1
+
+    coverage = inside.reshape(window.n_rows, supersample, window.n_cols,
+                              supersample).sum(axis=(1, 3))
+    return window, (coverage / float(supersample ** 2)).astype(np.float32)
+
+
+def LineCoverage(paths, distance, grid, supersample=8):
+    """
+    Calculates the fraction of each cell within a distance of a line or
+    points (a FULL, ROUND buffer), by testing the distance from each segment
+    to the samples within the segment's buffered envelope only. Distances
+    smaller than half a sample's diagonal are raised to it, so that every
+    cell the line crosses is covered.
+    :param paths: a list of (n, 2) arrays of vertex coordinates
+    :param distance: the buffer distance
+    :param grid: the Grid to rasterize to
+    :param supersample: the number of samples per cell along each axis
+    :return: the Window of the grid covered by the buffered envelope and a
+    float32 array of coverage (0 - 1) within it, or (None, None) if the
+    buffer does not intersect the grid
+    """
+    step = grid.cellSize / supersample
+    radius = max(float(distance or 0), step * math.sqrt(0.5))
+    points = np.concatenate(paths)
+    window = grid.clipWindow(grid.windowFromExtent(
+        points[:, 0].min() - radius, points[:, 1].min() - radius,
+        points[:, 0].max() + radius, points[:, 1].max() + radius
+        ))
+    if window.n_rows == 0 or window.n_cols == 0:
+        return None, None
+
+    x_origin = grid.xMin + window.col * grid.cellSize
+    y_origin = grid.yMax - window.row * grid.cellSize
+    n_rows = window.n_rows * supersample
+    n_cols = window.n_cols * supersample
+    inside = np.zeros((n_rows, n_cols), dtype=bool)
+    for path in paths:
+        ends = path[1:] if len(path) > 1 else path
+        for (x0, y0), (x1, y1) in zip(path, ends):
+            # Candidate samples within the segment's buffered envelope
+            j0 = max(int(math.floor(
+                (min(x0, x1) - radius - x_origin) / step)), 0)
+            j1 = min(int(math.ceil(
+                (max(x0, x1) + radius - x_origin) / step)), n_cols)
+            k0 = max(int(math.floor(
+                (y_origin - max(y0, y1) - radius) / step)), 0)
+            k1 = min(int(math.ceil(
+                (y_origin - min(y0, y1) + radius) / step)), n_rows)
+            if j1 <= j0 or k1 <= k0:
+                continue
+            x = x_origin + (np.arange(j0, j1) + 0.5) * step
+            y = y_origin - (np.arange(k0, k1)[:, np.newaxis] + 0.5) * step
+            dx, dy = x1 - x0, y1 - y0
+            length_squared = dx * dx + dy * dy
+            if length_squared > 0:
+                t = np.clip(((x - x0) * dx + (y - y0) * dy) / length_squared,
+                            0, 1)
+            else:
+                t = 0
+            distance_squared = (x - x0 - t * dx) ** 2 + (y - y0 - t * dy) ** 2
+            inside[k0:k1, j0:j1] |= distance_squared <= radius * radius
+
+    coverage = inside.reshape(window.n_rows, supersample, window.n_cols,
+                              supersample).sum(axis=(1, 3))
+    return window, (coverage / float(supersample ** 2)).astype(np.float32)
+
+
+def _assignPolygons(coverages, window, nodata, dtype, out, min_coverage):
+    """
+    Assigns cells of a window from polygon coverages with MAXIMUM_AREA and
+    priority semantics (see RasterizePolygons).
+    :param coverages: a list of (Window, coverage, value, priority) tuples,
+    with windows on the same grid as window
+    :return: a 2D numpy array with the shape of window
+    """
+    shape = (window.n_rows, window.n_cols)
+    values = np.zeros(shape, dtype=dtype)
+    best_priority = np.full(shape, -np.inf)
+    best_coverage = np.zeros(shape, dtype=np.float32)
+    total_coverage = np.zeros(shape, dtype=np.float32)
+    for cover_window, coverage, value, priority in coverages:
+        row = cover_window.row - window.row
+        col = cover_window.col - window.col
+        cells = (slice(row, row + cover_window.n_rows),
+                 slice(col, col + cover_window.n_cols))
+        window_priority = best_priority[cells]
+        window_coverage = best_coverage[cells]
+        wins = (coverage > 0) & (
+            (priority > window_priority) |
+            ((priority == window_priority) & (coverage > window_coverage))
+            )
+        window_priority[wins] = priority
+        window_coverage[wins] = coverage[wins]
+        values[cells][wins] = value
+        total_coverage[cells] += coverage
+
+    if out is None:
+        out = np.full(shape, nodata, dtype=dtype)
+    assigned = np.isfinite(best_priority) & (total_coverage >= min_coverage)
+    out[assigned] = values[assigned]
+    return out
+
+
+def _assignFractions(coverages, window, nodata, dtype, out):
+    """
+    Assigns cells of a window the largest fractional coverage of any polygon,
+    ignoring polygon values (see RasterizeFractions).
+    :param coverages: a list of (Window, coverage, value, priority) tuples,
+    with windows on the same grid as window
+    :return: a 2D numpy array with the shape of window
+    """
+    shape = (window.n_rows, window.n_cols)
+    fractions = np.zeros(shape, dtype=np.float32)
+    for cover_window, coverage, value, priority in coverages:
+        row = cover_window.row - window.row
+        col = cover_window.col - window.col
+        cells = (slice(row, row + cover_window.n_rows),
+                 slice(col, col + cover_window.n_cols))
+        np.maximum(fractions[cells], coverage, out=fractions[cells])
+
+    if out is None:
+        out = np.full(shape, nodata, dtype=dtype)
+    assigned = fractions > 0
+    if np.dtype(dtype) == np.uint8:
+        out[assigned] = np.maximum(np.round(fractions[assigned] * 255), 1)
+    else:
+        out[assigned] = fractions[assigned]
+    return out
+
+
+def _polygonCoverages(polygons, grid, supersample):
+    """Returns (Window, coverage, value, priority) for polygons on the grid"""
+    coverages = []
+    for rings, value, priority in polygons:
+        window, coverage = PolygonCoverage(rings, grid, supersample)
+        if window is not None:
+            coverages.append((window, coverage, value, priority))
+    return coverages
+
+
+def _stackCoverages(coverages, nodata, dtype, min_coverage, fractional):
+    """
+    Assigns the window spanned by a group's coverages.
+    :return: a (Window, array) tuple, or a (Window, array, coverage) tuple if
+    fractional (see RasterizePolygonGroups)
+    """
+    if coverages:
+        row = min(coverage[0].row for coverage in coverages)
+        col = min(coverage[0].col for coverage in coverages)
+        row_end = max(coverage[0].row + coverage[0].n_rows
+                      for coverage in coverages)
+        col_end = max(coverage[0].col + coverage[0].n_cols
+                      for coverage in coverages)
+        window = Window(row, col, row_end - row, col_end - col)
+    else:
+        window = Window(0, 0, 0, 0)
+    if fractional:
+        # Assign values to every cell touched, and keep the coverage apart
+        # so that it is not confused with the values
+        array = _assignPolygons(coverages, window, nodata, dtype, None, 0)
+        coverage = _assignFractions(coverages, window, 0, np.uint8, None)
+        return window, array, coverage
+    array = _assignPolygons(coverages, window, nodata, dtype, None,
+                            min_coverage)
+    return window, array
+
+
+def RasterizePolygons(polygons, grid, nodata=np.nan, dtype=np.float32,
+                      out=None, min_coverage=0.5, supersample=8):
+    """
+    Converts polygons to an array on the provided grid, reproducing the
+    MAXIMUM_AREA cell assignment of PolygonToRaster with a priority field.
+    Cells covered by at least min_coverage of their area are assigned the
+    value of the polygon with the highest priority, and of those the polygon
+    covering the largest area of the cell.
+    :param polygons: a list of (rings, value, priority) tuples, see
+    ReadPolygons
+    :param grid: the Grid to rasterize to
+    :param nodata: the value of cells that are not assigned
+    :param dtype: the data type of the output array
+    :param out: a preallocated array with the shape of the grid, optional;
+    only assigned cells are overwritten
+    :param min_coverage: the fraction of a cell that must be covered for it
+    to be assigned
+    :param supersample: the number of samples per cell along each axis, see
+    PolygonCoverage
+    :return: a 2D numpy array
+    """
+    coverages = _polygonCoverages(polygons, grid, supersample)
+    window = Window(0, 0, grid.nRows, grid.nCols)
+    return _assignPolygons(coverages, window, nodata, dtype, out,
+                           min_coverage)
+
+
+def RasterizePolygonBands(polygons, grid, nodata=np.nan, dtype=np.float32,
+                          min_coverage=0.5, supersample=8):
+    """
+    Converts polygons with several values to a multi-band array, as in
+    RasterizePolygons for each band, calculating the coverage of each polygon
+    only once. Polygons without a value for a band are ignored for that band.
+    :param polygons: a list of (rings, values, priorities) tuples, see
+    ReadPolygonBands
+    :param grid: the Grid to rasterize to
+    :param nodata: the value of cells that are not assigned
+    :param dtype: the data type of the output array
+    :param min_coverage: the fraction of a cell that must be covered for it
+    to be assigned
+    :param supersample: the number of samples per cell along each axis, see
+    PolygonCoverage
+    :return: a 3D numpy array of shape (bands, rows, cols)
+    """
+    coverages = _polygonCoverages(polygons, grid, supersample)
+    n_bands = len(polygons[0][1]) if polygons else 0
+    window = Window(0, 0, grid.nRows, grid.nCols)
+    bands = np.full((n_bands,) + grid.Shape, nodata, dtype=dtype)
+    for band in range(n_bands):
+        band_coverages = [
+            (cover_window, coverage, values[band], priorities[band] or 0)
+            for cover_window, coverage, values, priorities in coverages
+            if values[band] is not None
+            ]
+        _assignPolygons(band_coverages, window, nodata, dtype, bands[band],
+                        min_coverage)
+    return bands
+
+
+def RasterizeFractions(polygons, grid, nodata=np.nan, dtype=np.float32,
+                       out=None, supersample=8):
+    """
+    Converts polygons to an array of fractional cell coverage on the provided
+    grid, so that features smaller than a cell or missing cell centers are
+    not lost. As float, cells hold the fraction of the cell covered (0 - 1);
+    as uint8, the fraction covered scaled to 1 - 255. Where polygons
+    overlap, the largest fraction is kept. Values and priorities are
+    ignored.
+    :param polygons: a list of (rings, value, priority) tuples, see
+    ReadPolygons
+    :param grid: the Grid to rasterize to
+    :param nodata: the value of cells that are not covered
+    :param dtype: the data type of the output array, float or uint8
+    :param out: a preallocated array with the shape of the grid, optional;
+    only covered cells are overwritten
+    :param supersample: the number of samples per cell along each axis, see
+    PolygonCoverage
+    :return: a 2D numpy array
+    """
+    coverages = _polygonCoverages(polygons, grid, supersample)
+    window = Window(0, 0, grid.nRows, grid.nCols)
+    return _assignFractions(coverages, window, nodata, dtype, out)
+
+
+def RasterizePolygonGroups(groups, grid, nodata=np.nan, dtype=np.float32,
+                           min_coverage=0.5, supersample=8, fractional=False):
+    """
+    Converts groups of polygons to a stack of arrays in a single sweep, as in
+    RasterizePolygons (or RasterizeFractions). Each group's array only covers
+    the window of the grid spanned by its polygons; see ExpandArray to place
+    it on the full grid.
+    :param groups: a dictionary of group values mapped to lists of
+    (rings, value, priority) tuples, see ReadFeatureGroups
+    :param grid: the Grid to rasterize to
+    :param nodata: the value of cells that are not assigned
+    :param dtype: the data type of the output arrays
+    :param min_coverage: the fraction of a cell that must be covered for it
+    to be assigned
+    :param supersample: the number of samples per cell along each axis, see
+    PolygonCoverage
+    :param fractional: True to assign every cell a polygon touches and to
+    record the fraction of each cell covered separately, as uint8 scaled to
+    1 - 255 (0 where not covered, see RasterizeFractions)
+    :return: an OrderedDict of group values mapped to (Window, array) tuples,
+    or to (Window, array, coverage) tuples if fractional
+    """
+    stack = collections.OrderedDict()
+    for group, polygons in groups.items():
+        coverages = _polygonCoverages(polygons, grid, supersample)
+        stack[group] = _stackCoverages(coverages, nodata, dtype,
+                                       min_coverage, fractional)
+    return stack
+
+
+def RasterizeLineGroups(groups, distances, grid, nodata=np.nan,
+                        dtype=np.float32, min_coverage=0, supersample=8,
+                        fractional=False):
+    """
+    Converts groups of lines or points, buffered by a distance per group, to
+    a stack of arrays in a single sweep, without creating buffer polygons.
+    Cells are assigned as in RasterizePolygonGroups, except that by default
+    any cell the buffer reaches is assigned (burned).
+    :param groups: a dictionary of group values mapped to lists of
+    (paths, value, priority) tuples, see ReadFeatureGroups
+    :param distances: a dictionary of group values mapped to buffer
+    distances; groups that are missing or None are not buffered
+    :param grid: the Grid to rasterize to
+    :param nodata: the value of cells that are not assigned
+    :param dtype: the data type of the output arrays
+    :param min_coverage: the fraction of a cell that must be within the
+    buffer for it to be assigned
+    :param supersample: the number of samples per cell along each axis, see
+    LineCoverage
+    :param fractional: True to record the fraction of each cell within the
+    buffer separately, as in RasterizePolygonGroups
+    :return: an OrderedDict of group values mapped to (Window, array) tuples,
+    or to (Window, array, coverage) tuples if fractional
+    """
+    stack = collections.OrderedDict()
+    for group, lines in groups.items():
+        distance = distances.get(group)
+        coverages = []
+        for paths, value, priority in lines:
+            window, coverage = LineCoverage(paths, distance, grid,
+                                            supersample)
+            if window is not None:
+                coverages.append((window, coverage, value, priority))
+        stack[group] = _stackCoverages(coverages, nodata, dtype,
+                                       min_coverage, fractional)
+    return stack
+
+
+def ExpandArray(array, window, grid, fill, dtype=None):
+    """
+    Places an array covering a window of a grid on the full grid.
+    :param array: a 2D numpy array with the shape of window
+    :param window: the Window of the grid covered by array
+    :param grid: the Grid
+    :param fill: the value of cells outside the window
+    :param dtype: the data type of the output array, optional; defaults to
+    the data type of array
+    :return: a 2D numpy array with the shape of the grid
+    """
+    out = np.full(grid.Shape, fill, dtype=dtype or array.dtype)
+    out[window.row:window.row + window.n_rows,
+        window.col:window.col + window.n_cols] = array
+    return out
+
+
+def PolygonsToArray(in_features, value_field, grid, nodata):
+    """
+    Converts polygons to an array on the provided grid, assigning each cell
+    the value of the polygon containing the cell center.
+    :param in_features: a polygon feature class or layer
+    :param value_field: an integer field to assign to the cells
+    :param grid: the Grid to rasterize to
+    :param nodata: the value to assign to cells outside all polygons
+    :return: a 2D numpy array
+    """
+    polygons = ReadPolygons(in_features, value_field,
+                            densify_distance=grid.cellSize)
+    return RasterizePolygons(polygons, grid, nodata, np.int64,
+                             supersample=1)
+
+
+def SaveArray(array, grid, out_raster, nodata=None, spatial_reference=None):
+    """
+    Saves an array on the provided grid as a raster dataset.
+    :param array: a 2D numpy array with the shape of the grid
+    :param grid: the Grid of the array
+    :param out_raster: the name or path of the output raster dataset
+    :param nodata: the value of NoData cells, optional; NaN cells of float
+    arrays are always NoData
+    :param spatial_reference: the spatial reference of the raster, optional
+    :return: the path of the output raster
+    """
+    lower_left = arcpy.Point(grid.xMin, grid.yMin)
+    if nodata is None or nodata != nodata:
+        raster = arcpy.NumPyArrayToRaster(array, lower_left, grid.cellSize,
+                                          grid.cellSize)
+    else:
+        raster = arcpy.NumPyArrayToRaster(array, lower_left, grid.cellSize,
+                                          grid.cellSize, nodata)
+    raster.save(out_raster)
+    if spatial_reference is not None:
+        arcpy.DefineProjection_management(out_raster, spatial_reference)
+    return out_raster
+
+
+def UpsampleArray(array, factor):
+    """
+    Divides each cell of an array into factor x factor cells of the same
+    value (nearest neighbor resampling).
+    :param array: a 2D numpy array
+    :param factor: the number of new cells per cell along each axis
+    :return: a 2D numpy array
+    """
+    if factor == 1:
+        return array
+    return np.repeat(np.repeat(array, factor, axis=0), factor, axis=1)
+
+
+def ZoneIndex(zone_array, zone_ids):
+    """
+    Converts an array of zone values to positions in the sorted list of zone
+    ids, with -1 for cells that do not belong to any of the zones.
+    :param zone_array: array of zone values
+    :param zone_ids: sorted numpy array of zone ids
+    :return: an integer array with the shape of zone_array
+    """
+    if len(zone_ids) == 0:
+        return np.full(zone_array.shape, -1, dtype=np.int64)
+    index = np.searchsorted(zone_ids, zone_array)
+    index = np.minimum(index, len(zone_ids) - 1)
+    return np.where(zone_ids[index] == zone_array, index, -1)
@@ -0,0 +1,240 @@
+"""
+Tests of the array-based functions of rasterlib.py against brute force
+equivalents. rasterlib imports arcpy, so these tests run in an ArcGIS
+Python environment and are skipped elsewhere.
+"""
+
+import os
+import sys
+
+import numpy as np
+import pytest
+
+pytest.importorskip("arcpy")
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(
+    __file__))))
+import rasterlib  # noqa: E402
+from rasterlib import Grid, Window  # noqa: E402
+
+
+# ----------------------------------------------------------------------------
+
+# HELPERS
+
+def _square(x_min, y_min, x_max, y_max):
+    """Returns the ring of a rectangle, clockwise"""
+    return np.array([(x_min, y_min), (x_min, y_max), (x_max, y_max),
+                     (x_max, y_min)], dtype=np.float64)
+
+
+def _bruteCoverage(rings, grid, supersample):
+    """
+    Returns the fraction of the samples of each cell of the grid inside the
+    rings (even-odd rule), testing every sample against every edge.
+    """
+    step = grid.cellSize / supersample
+    n_rows = grid.nRows * supersample
+    n_cols = grid.nCols * supersample
+    x = grid.xMin + (np.arange(n_cols) + 0.5) * step
+    y = grid.yMax - (np.arange(n_rows) + 0.5) * step
+    xs, ys = np.meshgrid(x, y)
+    inside = np.zeros(xs.shape, dtype=bool)
+    for ring in rings:
+        for (x0, y0), (x1, y1) in zip(ring, np.roll(ring, -1, axis=0)):
+            if y0 == y1:
+                continue
+            crosses = (ys >= min(y0, y1)) & (ys < max(y0, y1))
+            x_cross = x0 + (ys - y0) * (x1 - x0) / (y1 - y0)
+            inside ^= crosses & (x_cross < xs)
+    coverage = inside.reshape(grid.nRows, supersample, grid.nCols,
+                              supersample).sum(axis=(1, 3))
+    return coverage / float(supersample ** 2)
+
+
+def _coverageOnGrid(rings, grid, supersample):
+    """Returns the output of PolygonCoverage expanded to the full grid"""
+    window, coverage = rasterlib.PolygonCoverage(rings, grid, supersample)
+    out = np.zeros(grid.Shape, dtype=np.float64)
+    if window is not None:
+        out[window.row:window.row + window.n_rows,
+            window.col:window.col + window.n_cols] = coverage
+    return out
+
+
+# ----------------------------------------------------------------------------
+
+# POLYGON COVERAGE
+
+GRID = Grid(0, 100, 10, 10, 10)
+
+
+# Vertices are kept off the sample lattice so that no sample lies on an edge,
+# where the scanline and brute force tie rules may differ
+@pytest.mark.parametrize("rings", [
+    [_square(12.3, 17.1, 68.4, 81.7)],
+    [np.array([(3.2, 4.1), (51.3, 96.4), (97.6, 22.7)], dtype=np.float64)],
+    [_square(5.3, 5.9, 94.1, 95.2), _square(33.7, 28.9, 71.2, 64.4)[::-1]],
+    ], ids=["square", "triangle", "ring with hole"])
+@pytest.mark.parametrize("supersample", [1, 4, 8])
+def test_polygon_coverage_matches_brute_force(rings, supersample):
+    expected = _bruteCoverage(rings, GRID, supersample)
+    actual = _coverageOnGrid(rings, GRID, supersample)
+    np.testing.assert_allclose(actual, expected, atol=1e-6)
+
+
+def test_polygon_coverage_of_aligned_square_is_exact():
+    rings = [_square(20, 30, 50, 70)]
+    coverage = _coverageOnGrid(rings, GRID, 8)
+    expected = np.zeros(GRID.Shape)
+    expected[3:7, 2:5] = 1
+    np.testing.assert_array_equal(coverage, expected)
+
+
+def test_polygon_coverage_of_hole_is_empty():
+    rings = [_square(0, 0, 100, 100), _square(30, 30, 70, 70)[::-1]]
+    coverage = _coverageOnGrid(rings, GRID, 8)
+    assert (coverage[3:7, 3:7] == 0).all()
+    assert coverage.sum() == pytest.approx((100 * 100 - 40 * 40) / 100.0)
+
+
+def test_polygon_coverage_outside_grid():
+    rings = [_square(200, 200, 250, 250)]
+    assert rasterlib.PolygonCoverage(rings, GRID) == (None, None)
+
+
+# ----------------------------------------------------------------------------
+
+# ENVELOPE INDEX
+
+def _randomBoxes(random, n):
+    corners = random.uniform(0, 1000, (n, 2))
+    sizes = random.exponential(20, (n, 2))
+    return np.column_stack([corners, corners + sizes])
+
+
+def _linearScan(oids, boxes, x_min, y_min, x_max, y_max):
+    hits = ((boxes[:, 0] <= x_max) & (boxes[:, 2] >= x_min) &
+            (boxes[:, 1] <= y_max) & (boxes[:, 3] >= y_min))
+    return np.sort(np.asarray(oids)[hits])
+
+
+@pytest.mark.parametrize("n, node_size", [(1, 16), (15, 4), (1000, 4),
+                                          (2000, 16)])
+def test_envelope_index_matches_linear_scan(n, node_size):
+    random = np.random.RandomState(n)
+    boxes = _randomBoxes(random, n)
+    oids = random.permutation(n) + 1
+    index = rasterlib.EnvelopeIndex.fromBoxes(oids, boxes, node_size)
+    assert index.Count == n
+    for query in _randomBoxes(random, 50):
+        np.testing.assert_array_equal(index.query(*query),
+                                      _linearScan(oids, boxes, *query))
+    np.testing.assert_array_equal(index.query(-1, -1, 2000, 2000),
+                                  np.sort(oids))
+    assert index.query(5000, 5000, 6000, 6000).size == 0
+
+
+def test_envelope_index_save_and_load(tmpdir):
+    random = np.random.RandomState(0)
+    boxes = _randomBoxes(random, 300)
+    oids = np.arange(300)
+    index = rasterlib.EnvelopeIndex.fromBoxes(oids, boxes, 8, key="abc")
+    path = str(tmpdir.join("index.npz"))
+    index.save(path)
+    loaded = rasterlib.EnvelopeIndex.load(path)
+    assert loaded.key == "abc"
+    query = (100, 100, 400, 300)
+    np.testing.assert_array_equal(loaded.query(*query), index.query(*query))
+
+
+# ----------------------------------------------------------------------------
+
+# SPARSE RASTERS
+
+def _randomRaster(random, shape, density):
+    values = random.randint(1, 10, shape).astype(np.float32)
+    values[random.uniform(size=shape) > density] = np.nan
+    return values
+
+
+@pytest.mark.parametrize("tile_size", [4, 7, 256])
+def test_sparse_union_and_difference_match_dense(tile_size):
+    random = np.random.RandomState(tile_size)
+    grid = Grid(0, 300, 10, 30, 25)
+    dense = _randomRaster(random, grid.Shape, 0.3)
+    other = _randomRaster(random, grid.Shape, 0.2)
+    sparse = rasterlib.SparseRaster.fromArray(dense, grid,
+                                              tile_size=tile_size)
+    sparse_other = rasterlib.SparseRaster.fromArray(other, grid,
+                                                    tile_size=tile_size)
+
+    # Con(IsNull(dense), other, dense)
+    union = np.where(np.isnan(dense), other, dense)
+    np.testing.assert_array_equal(sparse.union(sparse_other).toArray(),
+                                  union)
+
+    # SetNull(~IsNull(other), dense)
+    difference = np.where(np.isnan(other), dense, np.nan)
+    np.testing.assert_array_equal(sparse.difference(sparse_other).toArray(),
+                                  difference)
+    assert (sparse.difference(sparse_other).Count ==
+            np.count_nonzero(~np.isnan(difference)))
+
+
+def test_sparse_from_window_and_constant():
+    random = np.random.RandomState(1)
+    grid = Grid(0, 200, 10, 20, 20)
+    window = Window(3, 5, 8, 9)
+    values = _randomRaster(random, (window.n_rows, window.n_cols), 0.5)
+    sparse = rasterlib.SparseRaster.fromArray(values, grid, window,
+                                              tile_size=6)
+    expected = np.full(grid.Shape, np.nan, dtype=np.float32)
+    expected[3:11, 5:14] = values
+    np.testing.assert_array_equal(sparse.toArray(), expected)
+
+    # Con(raster, 1) and filtering by value
+    ones = np.where(np.isnan(expected), np.nan, 1)
+    np.testing.assert_array_equal(sparse.constant(1).toArray(), ones)
+    np.testing.assert_array_equal(
+        sparse.filter(lambda cells: cells > 5).toArray(),
+        np.where(expected > 5, expected, np.nan)
+        )
+
+
+# ----------------------------------------------------------------------------
+
+# WINDOWS
+
+def _cells(windows, shape):
+    """Returns the number of windows covering each cell"""
+    counts = np.zeros(shape, dtype=np.int64)
+    for window in windows:
+        counts[window.row:window.row + window.n_rows,
+               window.col:window.col + window.n_cols] += 1
+    return counts
+
+
+@pytest.mark.parametrize("seed", range(10))
+def test_merge_windows_are_disjoint_and_cover_input(seed):
+    random = np.random.RandomState(seed)
+    shape = (200, 200)
+    windows = [Window(int(row), int(col), int(n_rows), int(n_cols))
+               for row, col, n_rows, n_cols in zip(
+                   random.randint(0, 150, 40), random.randint(0, 150, 40),
+                   random.randint(0, 40, 40), random.randint(0, 40, 40))]
+    merged = rasterlib.MergeWindows(windows)
+
+    assert merged == sorted(merged)
+    assert all(window.n_rows > 0 and window.n_cols > 0 for window in merged)
+    coverage = _cells(merged, shape)
+    assert coverage.max() <= 1
+    assert (coverage[_cells(windows, shape) > 0] == 1).all()
+
+
+def test_merge_windows_keeps_touching_windows_apart():
+    windows = [Window(0, 0, 5, 5), Window(0, 5, 5, 5), Window(5, 0, 5, 5)]
+    assert rasterlib.MergeWindows(windows) == sorted(windows)
+    assert rasterlib.MergeWindows([Window(0, 0, 5, 5),
+                                   Window(4, 4, 5, 5)]) == [
+        Window(0, 0, 9, 9)]